@@ -12,6 +12,8 @@ import rasterio
 import matplotlib.pyplot as plt
 from typing import List, Tuple
 
+import profiling
+
 
 # Function to create a map with drawing capabilities
 def create_map(map_file):
@@ -58,13 +60,16 @@ def wait_for_geojson(downloads_folder):
     return geojson_file
 
 # Main workflow
+@profiling.profiled('20_09_web_app')
 def main():
     # Step 1: Create and open the map
+    profiling.mark('open_map')
     map_file = 'interactive_map.html'
     create_map(map_file)
     open_map(map_file)
 
     # Step 2: Wait for the user to export the GeoJSON file to Downloads folder
+    profiling.mark('wait_for_geojson')
     downloads_folder = os.path.expanduser('~/Downloads')
     geojson_file = wait_for_geojson(downloads_folder)
 
@@ -90,9 +95,11 @@ def main():
         return coords, baseline_period, comparison_period
 
     # Step 3: Extract coordinates and date periods from GeoJSON
+    profiling.mark('parse_geojson')
     coords, baseline_period, comparison_period = extract_data_from_geojson(geojson_file)
 
     # Step 4: Calculate min/max latitude and longitude
+    profiling.mark('bounds')
     if coords:
         latitudes = [coord[1] for coord in coords]
         longitudes = [coord[0] for coord in coords]
@@ -143,6 +150,7 @@ def main():
     coordinates = f"{(min_latitude + max_latitude) / 2},{(min_longitude + max_longitude) / 2}"  # Center for GMaps
 
     # Step 7: Load image collections and calculate change using Earth Engine
+    profiling.mark('composite')
     def load_image_collection(start_date, end_date):
         collection = (ee.ImageCollection('COPERNICUS/S1_GRD')
                       .filterBounds(geometry)
@@ -177,6 +185,7 @@ def main():
         return
 
     # Step 8: Export the image to Google Drive
+    profiling.mark('export')
     try:
         task = ee.batch.Export.image.toDrive(
             image=change,
@@ -195,9 +204,11 @@ def main():
         print(f"An error occurred during export: {e}")
 
     # Step 9: Open Google Maps with the area of interest
+    profiling.mark('google_maps')
     webbrowser.open(f"https://www.google.com/maps/@{coordinates},15z")
 
     # Step 10: Prepare the GEE script
+    profiling.mark('gee_script')
     gee_script = f"""
     var geometry = ee.Geometry.Rectangle([{min_longitude}, {min_latitude}, {max_longitude}, {max_latitude}]);
     
@@ -244,6 +255,7 @@ def main():
     print("Code executed in GEE Code Editor.")
 
     # Step 11: Visualize the exported TIFF file
+    profiling.mark('visualize')
     tiff_file = os.path.join(downloads_folder, 'Sentinel1_SAR_VV_Image.tif')
 
     # Wait for the TIFF file to be downloaded
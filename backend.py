@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Blocking Earth Engine calls used by the change pipeline.
+
+Every round trip to the service lives here so the pipeline can run them in
+an executor, and so a local stand-in (``standin_backend.py``) can replace
+the service in benchmarks and load tests.
+"""
+import os
+
+import masks
+
+ACTIVE_STATES = ('UNSUBMITTED', 'READY', 'RUNNING', 'CANCEL_REQUESTED')
+POLARISATIONS = ('VV', 'VH', 'VV/VH')
+ORBIT_PASSES = {'ASC': 'ASCENDING', 'DESC': 'DESCENDING'}
+
+
+# Output band name for a polarisation, e.g. 'VV/VH' -> 'VV_VH', with an orbit suffix
+def band_name(polarisation, orbit=None):
+    name = polarisation.replace('/', '_')
+    return f"{name}_{orbit}" if orbit else name
+
+
+# Band names a composite will carry for the requested polarisations and orbit split
+def composite_bands(polarisations, orbit_split=False):
+    orbits = list(ORBIT_PASSES) if orbit_split else [None]
+    return [band_name(p, orbit) for orbit in orbits for p in polarisations]
+
+
+# Raw polarisations a scene must carry to produce the requested bands
+def required_polarisations(polarisations):
+    for polarisation in polarisations:
+        if polarisation not in POLARISATIONS:
+            raise ValueError(f"Unknown polarisation {polarisation!r}, expected one of {POLARISATIONS}.")
+    required = {p for p in polarisations if p != 'VV/VH'}
+    if 'VV/VH' in polarisations:
+        required.update(('VV', 'VH'))
+    return sorted(required, key=POLARISATIONS.index)
+
+
+class EarthEngineBackend:
+    def rectangle(self, bounds):
+        import ee
+        return ee.Geometry.Rectangle(list(bounds))
+
+    # Server-side land mask (1 = keep) for the given AOI; no round trip
+    def land_mask(self, method, bounds, dates):
+        return masks.water_mask_image(method, self.rectangle(bounds), dates).Not()
+
+    # One tile of the local mask cache (see masks.load_or_compute_mask)
+    def fetch_mask_tile(self, method, dates, scale, tile_row, tile_col):
+        return masks.fetch_tile_from_ee(method, dates, scale, tile_row, tile_col)
+
+    # Multi-band median composite for a period: one band per polarisation,
+    # and per orbit direction when orbit_split is set. Returns (image, bands),
+    # or None when no scenes match. Scene count and band names come back in a
+    # single getInfo round trip; an orbit with no scenes contributes no bands.
+    def composite(self, bounds, start_date, end_date, land=None,
+                  polarisations=('VV',), orbit_split=False):
+        import ee
+
+        geometry = self.rectangle(bounds)
+        collection = (ee.ImageCollection('COPERNICUS/S1_GRD')
+                      .filterBounds(geometry)
+                      .filterDate(start_date, end_date)
+                      .filter(ee.Filter.eq('instrumentMode', 'IW')))
+        for polarisation in required_polarisations(polarisations):
+            collection = collection.filter(
+                ee.Filter.listContains('transmitterReceiverPolarisation', polarisation))
+        if 'VV/VH' in polarisations:
+            collection = collection.map(lambda image: image.addBands(
+                image.select('VV').subtract(image.select('VH')).rename('VV_VH')))  # dB ratio
+        if land is not None:
+            collection = collection.map(lambda image: image.updateMask(land))  # Skip masked pixels early
+
+        sources = [band_name(p) for p in polarisations]
+        if orbit_split:
+            parts = [collection.filter(ee.Filter.eq('orbitProperties_pass', orbit_pass))
+                     .select(sources, [band_name(p, orbit) for p in polarisations])
+                     for orbit, orbit_pass in ORBIT_PASSES.items()]
+            median = ee.Image.cat([part.median() for part in parts])
+        else:
+            median = collection.select(sources).median()
+
+        info = ee.Dictionary({'size': collection.size(), 'bands': median.bandNames()}).getInfo()
+        print(f"Number of images in collection from {start_date} to {end_date}: {info['size']}")
+        if info['size'] == 0:
+            return None
+        if not info['bands']:
+            raise ValueError("Image does not have any bands.")
+        return median, info['bands']
+
+    # Per-band change and significance layers for the given bands; no round trip
+    def difference(self, baseline, comparison, threshold, bands=('VV',)):
+        bands = list(bands)
+        change = (comparison.select(bands).subtract(baseline.select(bands))
+                  .rename([f"{b}_change" for b in bands]))
+        significant = change.gt(threshold).rename([f"{b}_significant" for b in bands])
+        return change, significant
+
+    # Single multi-band image so one export carries every layer
+    def stack(self, change, significant):
+        return change.addBands(significant.toFloat())
+
+    # Image graph as JSON, so a restarted job can export without rebuilding it
+    def serialize(self, image):
+        return image.serialize()
+
+    def deserialize(self, blob):
+        import ee
+        return ee.deserializer.fromJSON(blob)
+
+    # Start a Drive export and return its task id
+    def start_export(self, image, bounds, description, scale):
+        import ee
+
+        task = ee.batch.Export.image.toDrive(
+            image=image,
+            description=description,
+            scale=scale,
+            region=self.rectangle(bounds),
+            maxPixels=1e13
+        )
+        task.start()
+        return task.id
+
+    # Synchronous GeoTIFF download of a small region (see planner.DIRECT_MAX_BYTES)
+    def download(self, image, bounds, scale, path):
+        import urllib.request
+
+        url = image.getDownloadURL({
+            'region': self.rectangle(bounds),
+            'scale': scale,
+            'format': 'GEO_TIFF',
+        })
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        urllib.request.urlretrieve(url, path + '.part')
+        os.replace(path + '.part', path)
+        return path
+
+    def task_state(self, task_id):
+        import ee
+        return ee.data.getTaskStatus(task_id)[0]['state']
+
+    def cancel_task(self, task_id):
+        import ee
+        ee.data.cancelTask(task_id)
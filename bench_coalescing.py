@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Several analysts draw overlapping rectangles over the same event at once.
+
+Runs the same jobs with and without coalescing against StandInBackend and
+reports service calls, computations and pixels saved:
+
+    python bench_coalescing.py --analysts 12 --jitter 0.01 --duplicates 3
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import pipeline
+from standin_backend import StandInBackend
+
+
+def analyst_jobs(analysts, jitter, duplicates, output_dir):
+    rng = random.Random(0)
+    jobs = []
+    for i in range(analysts):
+        dx, dy = rng.uniform(-jitter, jitter), rng.uniform(-jitter, jitter)
+        bounds = (72.80 + dx, 19.00 + dy, 72.90 + dx, 19.10 + dy)
+        for copy in range(1 + (duplicates if i == 0 else 0)):
+            jobs.append(pipeline.ChangeJob(bounds=bounds,
+                                           baseline=('2023-06-01', '2023-06-15'),
+                                           comparison=('2023-07-01', '2023-07-15'),
+                                           strategy='direct', output_dir=output_dir,
+                                           description=f"analyst_{i}_{copy}"))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--analysts', type=int, default=12)
+    parser.add_argument('--jitter', type=float, default=0.01, help='AOI offset in degrees')
+    parser.add_argument('--duplicates', type=int, default=3, help='identical copies of one request')
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    jobs = analyst_jobs(args.analysts, args.jitter, args.duplicates, tempfile.mkdtemp())
+    for coalesce in (False, True):
+        backend = StandInBackend(latency=args.latency)
+        started = time.monotonic()
+        results = pipeline.run(backend, jobs, poll_interval=0.1, coalesce=coalesce)
+        elapsed = time.monotonic() - started
+        failed = [r['error'] for r in results if r['state'] != 'COMPLETED']
+        print(f"coalesce={coalesce}: {len(jobs)} jobs, {backend.calls} service calls, "
+              f"{elapsed:.2f} s, {len(failed)} failed")
+
+
+if __name__ == "__main__":
+    main()
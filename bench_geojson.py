@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Time and peak memory of json.load parsing vs. geojson_stream on a large upload.
+
+    python bench_geojson.py --features 20000 --vertices 200
+
+``--check N`` instead parses N random documents (Polygons with holes,
+MultiPolygons, other geometry types, int and float coordinates, altitudes,
+varied whitespace) with small random chunk sizes, and checks that the
+geojson_stream drop-ins and bbox give exactly what the scripts' json.load
+versions give (ints stay ints, altitudes are kept):
+
+    python bench_geojson.py --check 500
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import geojson_stream
+
+
+# What extract_data_from_geojson + the bbox code in main() do today
+def parse_with_json_load(geojson_file):
+    with open(geojson_file, 'r') as f:
+        data = json.load(f)
+    coords = []
+    for feature in data.get('features', []):
+        geometry = feature.get('geometry', {})
+        if geometry.get('type') == 'Polygon':
+            coords.extend(geometry['coordinates'][0])
+    latitudes = [coord[1] for coord in coords]
+    longitudes = [coord[0] for coord in coords]
+    bbox = (min(longitudes), min(latitudes), max(longitudes), max(latitudes))
+    return coords, bbox
+
+
+# The scripts' extract_data_from_geojson, as written with json.load
+def extract_data_with_json_load(geojson_file):
+    with open(geojson_file, 'r') as f:
+        data = json.load(f)
+    baseline_period = data.get("baseline_period", {})
+    comparison_period = data.get("comparison_period", {})
+    coords = []
+    for feature in data.get('features', []):
+        geometry = feature.get('geometry', {})
+        if geometry.get('type') == 'Polygon':
+            coords.extend(geometry['coordinates'][0])
+    return coords, baseline_period, comparison_period
+
+
+def parse_streaming(geojson_file):
+    parsed = geojson_stream.parse_geojson(geojson_file)
+    return parsed, parsed.bbox()
+
+
+def write_feature_collection(path, features, vertices):
+    rng = random.Random(0)
+    with open(path, 'w') as f:
+        f.write('{"type": "FeatureCollection", "baseline_period": '
+                '{"start_date": "2023-01-01", "end_date": "2023-01-10"}, "features": [')
+        for i in range(features):
+            lon, lat = rng.uniform(68, 97), rng.uniform(8, 37)
+            ring = [[round(lon + 0.01 * rng.random(), 6), round(lat + 0.01 * rng.random(), 6)]
+                    for _ in range(vertices)]
+            ring.append(ring[0])
+            f.write(('' if i == 0 else ',') + json.dumps({
+                'type': 'Feature', 'properties': {'id': i},
+                'geometry': {'type': 'Polygon', 'coordinates': [ring]}}))
+        f.write(']}')
+
+
+def _random_coord(rng):
+    lon, lat = rng.uniform(-180, 180), rng.uniform(-90, 90)
+    if rng.random() < 0.3:
+        lon = int(lon)
+    if rng.random() < 0.3:
+        lat = int(lat)
+    if rng.random() < 0.1:
+        lon, lat = rng.choice([(77, 28), (77.0, 28.0), (77, 28.0)])  # equal values, different types
+    coord = [lon, lat]
+    if rng.random() < 0.1:
+        coord.append(rng.choice([0, 12.5, -3]))  # altitude
+    return coord
+
+
+def _random_ring(rng):
+    return [_random_coord(rng) for _ in range(rng.randint(1, 12))]
+
+
+def _random_geometry(rng):
+    kind = rng.choice(['Polygon', 'Polygon', 'MultiPolygon', 'Point', 'LineString'])
+    if kind == 'Polygon':
+        coordinates = [_random_ring(rng) for _ in range(rng.randint(1, 3))]
+    elif kind == 'MultiPolygon':
+        coordinates = [[_random_ring(rng) for _ in range(rng.randint(1, 2))] for _ in range(rng.randint(0, 3))]
+    elif kind == 'Point':
+        coordinates = _random_coord(rng)
+    else:
+        coordinates = _random_ring(rng)
+    return {'type': kind, 'coordinates': coordinates}
+
+
+def write_random_document(path, rng):
+    document = {'type': 'FeatureCollection'}
+    if rng.random() < 0.8:
+        document['baseline_period'] = {'start_date': '2023-01-01', 'end_date': '2023-02-01'}
+    features = [{'type': 'Feature', 'properties': {'id': i, 'name': rng.choice(['a', 'é', '"q"', ''])},
+                 'geometry': _random_geometry(rng)} for i in range(rng.randint(0, 8))]
+    if rng.random() < 0.9:
+        document['features'] = features
+    if rng.random() < 0.5:
+        document['comparison_period'] = {'start_date': '2024-01-01', 'end_date': '2024-02-01'}
+    items = list(document.items())
+    rng.shuffle(items)
+    with open(path, 'w') as f:
+        json.dump(dict(items), f, indent=rng.choice([None, 0, 2]),
+                  separators=rng.choice([None, (',', ':'), (' , ', ' : ')]))
+
+
+# Random documents through both parsers; the drop-ins must match json.load exactly.
+# Values are compared as JSON text, so 77 and 77.0 differ.
+def check_equivalence(documents, seed=0):
+    rng = random.Random(seed)
+    path = os.path.join(tempfile.mkdtemp(), 'random_aoi.json')
+    for i in range(documents):
+        write_random_document(path, rng)
+        expected = extract_data_with_json_load(path)
+        coords = expected[0]
+        bbox = None
+        if coords:
+            lons, lats = [c[0] for c in coords], [c[1] for c in coords]
+            bbox = (min(lons), min(lats), max(lons), max(lats))
+        for chunk_size in (rng.randint(1, 64), geojson_stream.CHUNK_SIZE):
+            parsed = geojson_stream.parse_geojson(path, chunk_size)
+            got = (parsed.polygon_coord_list(), parsed.baseline_period, parsed.comparison_period)
+            assert json.dumps(got) == json.dumps(expected), (i, chunk_size, got, expected)
+            assert json.dumps(parsed.bbox()) == json.dumps(bbox), (i, chunk_size, parsed.bbox(), bbox)
+        assert json.dumps(geojson_stream.extract_data_from_geojson(path)) == json.dumps(expected), i
+        assert json.dumps(geojson_stream.extract_coordinates_from_geojson(path)) == json.dumps(coords), i
+    os.remove(path)
+    print(f"{documents} random documents: geojson_stream matches json.load")
+
+
+# Wall time of a plain run, then peak memory of a second run under tracemalloc
+def measure(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - started
+    del result
+    tracemalloc.start()
+    result = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--features', type=int, default=20000)
+    parser.add_argument('--vertices', type=int, default=200)
+    parser.add_argument('--check', type=int, metavar='N', help='check N random documents instead')
+    args = parser.parse_args()
+    if args.check:
+        check_equivalence(args.check)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(), 'large_aoi.json')
+    write_feature_collection(path, args.features, args.vertices)
+    size_mb = os.path.getsize(path) / 1024 ** 2
+    print(f"{args.features} features x {args.vertices + 1} vertices, {size_mb:.1f} MB")
+
+    (coords, bbox_old), t_old, m_old = measure(parse_with_json_load, path)
+    (parsed, bbox_new), t_new, m_new = measure(parse_streaming, path)
+    assert bbox_old == bbox_new, (bbox_old, bbox_new)
+    assert len(coords) == len(parsed.polygon_coords())
+
+    print(f"json.load + lists: {t_old:6.2f} s, peak {m_old / 1024 ** 2:7.1f} MB")
+    print(f"streaming arrays:  {t_new:6.2f} s, peak {m_new / 1024 ** 2:7.1f} MB "
+          f"({t_old / t_new:.1f}x faster, {m_old / m_new:.1f}x less memory)")
+    started = time.perf_counter()
+    extents = parsed.feature_extents()
+    print(f"per-feature extents for {len(extents)} features: {time.perf_counter() - started:.3f} s")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
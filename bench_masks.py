@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Size and op speed of packed_mask vs. plain bool arrays for significance masks.
+
+The significance mask is a few change patches plus isolated false
+positives at rate ``--noise`` (speckle); the water mask is a few discs.
+
+    python bench_masks.py --size 8192 --noise 0.001
+"""
+import argparse
+import time
+
+import numpy as np
+
+from packed_mask import PackedMask
+
+
+def make_masks(size, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    significant = rng.random((size, size), dtype=np.float32) < noise
+    for _ in range(20):
+        r, c = rng.integers(0, size, 2)
+        h, w = rng.integers(size // 100, size // 10, 2)
+        significant[r:r + h, c:c + w] = True
+    water = np.zeros((size, size), dtype=bool)
+    rows, cols = np.ogrid[:size, :size]
+    for _ in range(3):
+        r, c = rng.integers(0, size, 2)
+        radius = rng.integers(size // 20, size // 6)
+        water |= (rows - r) ** 2 + (cols - c) ** 2 < radius ** 2
+    return significant, water
+
+
+def timed(fn, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=8192)
+    parser.add_argument('--noise', type=float, default=0.001, help='rate of isolated true pixels')
+    parser.add_argument('--tile-size', type=int, default=256)
+    args = parser.parse_args()
+
+    significant, water = make_masks(args.size, args.noise)
+    (sig_p, pack_time) = timed(lambda: PackedMask.pack(significant, args.tile_size), 1)
+    water_p = PackedMask.pack(water, args.tile_size)
+    assert (sig_p.unpack() == significant).all()
+    _, unpack_time = timed(sig_p.unpack, 1)
+
+    print(f"{args.size}x{args.size} mask, {significant.mean():.2%} significant, {water.mean():.1%} water")
+    for name, array, packed in (('significance', significant, sig_p), ('water', water, water_p)):
+        kinds = np.bincount(packed.kinds, minlength=4)
+        print(f"  {name:<13} {array.nbytes / 1024 ** 2:8.1f} MB bool -> {packed.nbytes / 1024 ** 2:7.2f} MB packed "
+              f"({array.nbytes / packed.nbytes:.0f}x; tiles empty/full/runs/bits {'/'.join(map(str, kinds))})")
+    print(f"  pack {pack_time:.3f} s, unpack {unpack_time:.3f} s")
+
+    print(f"  {'op':<12} {'bool':>9} {'packed':>9}")
+    ops = (
+        ('AND', lambda: significant & water, lambda: sig_p & water_p),
+        ('OR', lambda: significant | water, lambda: sig_p | water_p),
+        ('NOT', lambda: ~significant, lambda: ~sig_p),
+        ('apply_water', lambda: significant & ~water, lambda: sig_p.apply_water(water_p)),
+        ('count', lambda: int(np.count_nonzero(significant)), sig_p.count),
+    )
+    for name, plain, packed in ops:
+        expected, t_plain = timed(plain)
+        result, t_packed = timed(packed)
+        if isinstance(result, PackedMask):
+            assert (result.unpack() == expected).all(), name
+        else:
+            assert result == expected, name
+        print(f"  {name:<12} {t_plain * 1000:7.1f}ms {t_packed * 1000:7.1f}ms  ({t_plain / t_packed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Compare the old sequential workflow with the asyncio pipeline.
+
+Uses StandInBackend, which sleeps for a fixed latency on every service
+call, so the numbers measure orchestration only:
+
+    python bench_pipeline.py --jobs 20 --latency 0.5 --export-time 2
+"""
+import argparse
+import time
+
+import pipeline
+from standin_backend import StandInBackend
+
+
+# The workflow as main() ran it: one call after another, polling with time.sleep
+def run_job_sequential(backend, job, poll_interval):
+    baseline, bands = backend.composite(job.bounds, job.baseline[0], job.baseline[1])
+    comparison, _ = backend.composite(job.bounds, job.comparison[0], job.comparison[1])
+    change, significant = backend.difference(baseline, comparison, job.threshold, bands)
+    task_id = backend.start_export(backend.stack(change, significant), job.bounds,
+                                   job.description, job.scale)
+    while backend.task_state(task_id) in pipeline.ACTIVE_STATES:
+        time.sleep(poll_interval)
+
+
+def make_jobs(count):
+    return [pipeline.ChangeJob(bounds=(30.5 + i * 0.1, 49.5, 30.6 + i * 0.1, 49.6),
+                               baseline=('2023-01-01', '2023-01-10'),
+                               comparison=('2023-01-11', '2023-01-20'),
+                               description=f"bench_{i}")
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--export-time', type=float, default=2.0)
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.jobs)
+
+    backend = StandInBackend(latency=args.latency, export_time=args.export_time)
+    started = time.monotonic()
+    run_job_sequential(backend, jobs[0], args.poll_interval)
+    single_sequential = time.monotonic() - started
+
+    backend = StandInBackend(latency=args.latency, export_time=args.export_time)
+    started = time.monotonic()
+    pipeline.run(backend, jobs[:1], poll_interval=args.poll_interval)
+    single_async = time.monotonic() - started
+
+    backend = StandInBackend(latency=args.latency, export_time=args.export_time)
+    started = time.monotonic()
+    results = pipeline.run(backend, jobs, poll_interval=args.poll_interval)
+    many_async = time.monotonic() - started
+    failed = [r for r in results if r['state'] != 'COMPLETED']
+
+    print(f"One job, sequential:      {single_sequential:.2f} s")
+    print(f"One job, asyncio:         {single_async:.2f} s "
+          f"({single_sequential / single_async:.2f}x)")
+    print(f"{args.jobs} jobs, sequential (est.): {single_sequential * args.jobs:.2f} s")
+    print(f"{args.jobs} jobs, one event loop: {many_async:.2f} s "
+          f"({single_sequential * args.jobs / many_async:.1f}x), {len(failed)} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Throughput, peak memory and accuracy of local_change on synthetic SAR stacks.
+
+Generates a VV/VH stack per size with synthetic_sar, runs composite ->
+difference -> threshold with each worker count and reports MPix/s (output
+pixels per second), peak traced memory of the calling process, peak RSS of
+the largest pool worker (with several workers; their total is at most
+workers x that) and F1/IoU against the injected change. Save a baseline
+once and compare later runs against it; the exit code is 1 when any case
+got slower, used more memory or became less accurate:
+
+    python bench_raster.py --sizes 512 1024 2048 --workers 1 2 4 --save baseline.json
+    python bench_raster.py --sizes 512 1024 2048 --workers 1 2 4 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import local_change
+import synthetic_sar
+
+SPEED_TOLERANCE = 0.2  # fraction of MPix/s a case may lose before it counts as a regression
+F1_TOLERANCE = 0.02
+MEMORY_TOLERANCE = 0.2  # fraction of peak memory a case may gain...
+MEMORY_SLACK_MB = 8  # ...beyond this much, so small cases are not flagged for noise
+
+
+# Write a synthetic stack to .npy files and return it as memmaps plus truth / water
+def prepare(size, scenes, directory, seed=0):
+    stack = synthetic_sar.generate_stack(size, size, scenes, seed=seed)
+    arrays = {}
+    for name in ('baseline', 'comparison', 'water'):
+        path = os.path.join(directory, f"{name}_{size}.npy")
+        np.save(path, stack[name])
+        arrays[name] = np.load(path, mmap_mode='r')
+    arrays['truth'] = stack['truth']
+    return arrays
+
+
+# Peak RSS in MB of the largest pool worker of one run. Runs in a fresh process so
+# RUSAGE_CHILDREN covers only that run's workers; None where it is not available.
+def worker_peak_mb(paths, threshold, workers, tile_size):
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    baseline, comparison, water = (np.load(path, mmap_mode='r') for path in paths)
+    local_change.detect_change(baseline, comparison, threshold, water=water, workers=workers,
+                               tile_size=tile_size)
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def run_case(arrays, threshold, workers, tile_size, repeats):
+    args = (arrays['baseline'], arrays['comparison'], threshold)
+    kwargs = {'water': arrays['water'], 'workers': workers, 'tile_size': tile_size}
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        change, significant = local_change.detect_change(*args, **kwargs)
+        times.append(time.perf_counter() - started)
+    del change
+    tracemalloc.start()
+    local_change.detect_change(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    worker_peak = None
+    if workers > 1:
+        paths = [arrays[name].filename for name in ('baseline', 'comparison', 'water')]
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            worker_peak = pool.submit(worker_peak_mb, paths, threshold, workers, tile_size).result()
+
+    height, width = arrays['truth'].shape
+    best = min(times)
+    detected = significant[0]  # VV, as in the scripts
+    return {
+        'size': f"{height}x{width}",
+        'workers': workers,
+        'seconds': round(best, 4),
+        'mpix_s': round(height * width / best / 1e6, 3),
+        'parent_peak_mb': round(peak / 1024 ** 2, 1),  # traced, calling process only
+        'worker_rss_mb': worker_peak,
+        **local_change.accuracy(detected, arrays['truth'], valid=~np.asarray(arrays['water'])),
+    }
+
+
+# Cases that got slower, more memory-hungry or less accurate than the baseline, as messages
+def regressions(results, baseline):
+    previous = {(case['size'], case['workers']): case for case in baseline['results']}
+    found = []
+    for case in results:
+        before = previous.get((case['size'], case['workers']))
+        if before is None:
+            continue
+        label = f"{case['size']} / {case['workers']} workers"
+        if case['mpix_s'] < before['mpix_s'] * (1 - SPEED_TOLERANCE):
+            found.append(f"{label}: {case['mpix_s']} MPix/s, baseline {before['mpix_s']}")
+        if case['f1'] < before['f1'] - F1_TOLERANCE:
+            found.append(f"{label}: F1 {case['f1']}, baseline {before['f1']}")
+        for key, name in (('parent_peak_mb', 'parent'), ('worker_rss_mb', 'worker')):
+            now, then = case.get(key), before.get(key)
+            if now is not None and then is not None and now > max(then * (1 + MEMORY_TOLERANCE),
+                                                                  then + MEMORY_SLACK_MB):
+                found.append(f"{label}: {name} peak {now} MB, baseline {then} MB")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--scenes', type=int, default=6)
+    parser.add_argument('--threshold', type=float, default=3.0, help='change threshold in dB')
+    parser.add_argument('--tile-size', type=int, default=local_change.TILE_SIZE)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--save', help='write results to this baseline JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to check for regressions')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'size':>10} {'workers':>7} {'seconds':>8} {'MPix/s':>8} {'parent MB':>9} {'worker MB':>9} "
+          f"{'precision':>9} {'recall':>7} {'F1':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            arrays = prepare(size, args.scenes, tmp)
+            for workers in args.workers:
+                case = run_case(arrays, args.threshold, workers, args.tile_size, args.repeats)
+                results.append(case)
+                worker_rss = '-' if case['worker_rss_mb'] is None else f"{case['worker_rss_mb']:.1f}"
+                print(f"{case['size']:>10} {workers:>7} {case['seconds']:>8.3f} {case['mpix_s']:>8.2f} "
+                      f"{case['parent_peak_mb']:>9.1f} {worker_rss:>9} {case['precision']:>9.3f} "
+                      f"{case['recall']:>7.3f} {case['f1']:>6.3f}")
+            del arrays
+
+    report = {'scenes': args.scenes, 'threshold': args.threshold, 'tile_size': args.tile_size,
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'cpus': os.cpu_count(), 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f))
+        for message in found:
+            print(f"REGRESSION {message}")
+        if found:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
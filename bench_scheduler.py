@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Run many jobs against a stand-in that rejects calls with 429-style errors.
+
+Compares the pipeline calling the backend directly with the same jobs going
+through RequestScheduler:
+
+    python bench_scheduler.py --jobs 30 --failure-rate 0.2 --max-tasks 3
+"""
+import argparse
+import threading
+import time
+
+import pipeline
+from bench_pipeline import make_jobs
+from scheduler import RequestScheduler, SchedulingBackend
+from standin_backend import StandInBackend
+
+
+def run(backend, jobs, poll_interval):
+    started = time.monotonic()
+    results = pipeline.run(backend, jobs, poll_interval=poll_interval)
+    elapsed = time.monotonic() - started
+    completed = sum(r['state'] == 'COMPLETED' for r in results)
+    return results, completed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--export-time', type=float, default=0.5)
+    parser.add_argument('--failure-rate', type=float, default=0.2)
+    parser.add_argument('--max-tasks', type=int, default=3)
+    parser.add_argument('--rate', type=float, default=50.0)
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.jobs)
+
+    def standin():
+        return StandInBackend(latency=args.latency, export_time=args.export_time,
+                              failure_rate=args.failure_rate, max_tasks=args.max_tasks)
+
+    _, completed, elapsed = run(standin(), jobs, poll_interval=0.1)
+    print(f"Direct calls:   {completed}/{args.jobs} jobs completed in {elapsed:.2f} s")
+
+    scheduler = RequestScheduler(rate=args.rate, burst=args.rate, max_batch=args.max_tasks,
+                                 base_delay=0.05, max_delay=1.0, max_retries=10)
+    peak_depth = 0
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_depth
+        while not done.wait(0.05):
+            peak_depth = max(peak_depth, scheduler.stats()['queue_depth'])
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    results, completed, elapsed = run(SchedulingBackend(standin(), scheduler), jobs, poll_interval=0.1)
+    done.set()
+    sampler.join()
+    stats = scheduler.stats()
+    scheduler.shutdown()
+
+    job_times = sorted(r['elapsed'] for r in results)
+    print(f"Via scheduler:  {completed}/{args.jobs} jobs completed in {elapsed:.2f} s")
+    print(f"  retries: {stats['retries']}, quota errors: {stats['quota_errors']}, "
+          f"failed: {stats['failed']}")
+    print(f"  queue wait: mean {stats['mean_wait'] * 1000:.1f} ms, "
+          f"p95 {stats['p95_wait'] * 1000:.1f} ms, max {stats['max_wait'] * 1000:.1f} ms")
+    print(f"  peak queue depth: {peak_depth}")
+    print(f"  job time: fastest {job_times[0]:.2f} s, slowest {job_times[-1]:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
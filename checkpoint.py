@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Small durable state record per job, so a restarted job resumes instead of redoing work.
+
+Each job gets ``<checkpoint_dir>/<job_key>.json`` holding the last finished
+stage, submitted task ids and output paths (one per downloaded tile). Every update
+is written to a temporary file and renamed into place, so a crash leaves
+either the old record or the new one, never a torn file.
+"""
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, is_dataclass
+
+DEFAULT_CHECKPOINT_DIR = os.path.expanduser(os.path.join('~', '.sar_change', 'jobs'))
+STAGES = ('new', 'mask', 'composite', 'export', 'download', 'done')
+
+
+# Stable key for a job: the same parameters always map to the same record
+def job_key(params) -> str:
+    if is_dataclass(params):
+        params = asdict(params)
+    blob = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()[:16]
+
+
+class JobCheckpoint:
+    def __init__(self, path: str, state: dict):
+        self.path = path
+        self.state = state
+
+    @classmethod
+    def load(cls, checkpoint_dir: str, key: str):
+        path = os.path.join(checkpoint_dir, f"{key}.json")
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return cls(path, json.load(f))
+        return cls(path, {'key': key, 'stage': 'new', 'task_ids': {}, 'outputs': {}, 'data': {},
+                          'updated': None})
+
+    def save(self):
+        self.state['updated'] = time.time()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+    @property
+    def stage(self) -> str:
+        return self.state['stage']
+
+    # True once `stage` (or a later one) has finished
+    def reached(self, stage: str) -> bool:
+        return STAGES.index(self.state['stage']) >= STAGES.index(stage)
+
+    def finish_stage(self, stage: str, **data):
+        """Record `stage` as finished, with any values needed to skip it next time."""
+        self.state['stage'] = stage
+        self.state['data'].update(data)
+        self.save()
+
+    # Go back to an earlier stage, e.g. when a recorded export task failed
+    def rewind(self, stage: str):
+        self.state['stage'] = stage
+        self.save()
+
+    def get(self, name, default=None):
+        return self.state['data'].get(name, default)
+
+    def record_task(self, name: str, task_id: str):
+        self.state['task_ids'][name] = task_id
+        self.save()
+
+    def task_id(self, name: str):
+        return self.state['task_ids'].get(name)
+
+    # Drop a task id, e.g. of an export that failed, so the next run submits a new one
+    def forget_task(self, name: str):
+        self.state['task_ids'].pop(name, None)
+        self.save()
+
+    def record_output(self, name: str, path: str):
+        self.state['outputs'][name] = path
+        self.save()
+
+    # Recorded output path, only if the file is still there
+    def output(self, name: str):
+        path = self.state['outputs'].get(name)
+        return path if path and os.path.exists(path) else None
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Coalesce overlapping concurrent change jobs into one computation.
+
+Jobs with the same dates and parameters whose AOIs overlap heavily are
+merged into a single job over the union of their AOIs (snapped to the
+grid in ``grid.py``), and each caller gets its own window sliced out of
+the shared result. Identical requests share one computation outright.
+
+A new job joins:
+
+* a group that is still collecting (within ``window`` seconds of its first
+  job) if merging costs no more pixels than computing both separately and
+  at least ``min_overlap`` of the new AOI is already covered;
+* a group that is already running if its union contains the new AOI.
+
+Otherwise it starts a group of its own.
+"""
+import asyncio
+import os
+from dataclasses import asdict, replace
+from typing import Dict, List, Optional
+
+import grid
+import pipeline
+import planner
+from checkpoint import job_key
+
+COALESCE_WINDOW = 0.5  # seconds a new group waits for overlapping jobs
+MIN_OVERLAP = 0.5
+
+
+# Everything except where the job is and what it is called must match to share work
+def coalesce_key(job: pipeline.ChangeJob) -> tuple:
+    params = asdict(job)
+    for name in ('bounds', 'description', 'strategy', 'tile_grid', 'output_dir'):
+        params.pop(name)
+    return tuple(sorted((name, repr(value)) for name, value in params.items()))
+
+
+class _Group:
+    def __init__(self, key, job, window):
+        self.key = key
+        self.template = job
+        self.windows = [window]
+        self.union = window
+        self.descriptions = [job.description]
+        self.on_stage = []  # stage callbacks of every member
+        self.cancel_checks = []  # the shared run is cancelled only once every member is
+        self.started = False
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class Coalescer:
+    def __init__(self, backend, window: float = COALESCE_WINDOW, min_overlap: float = MIN_OVERLAP,
+                 policy: Optional[planner.CostPolicy] = None,
+                 poll_interval=pipeline.POLL_INTERVAL, checkpoint_dir=None, profile=None,
+                 history_root=None):
+        self.backend = backend
+        self.window = window
+        self.min_overlap = min_overlap
+        self.policy = policy
+        self.poll_interval = poll_interval
+        self.checkpoint_dir = checkpoint_dir
+        self.profile = profile
+        self.history_root = history_root  # each caller's share is added to its own AOI's history
+        self._groups: Dict[tuple, List[_Group]] = {}
+        self.stats = {'requests': 0, 'computations': 0, 'shared': 0,
+                      'pixels_requested': 0, 'pixels_computed': 0}
+
+    def report(self) -> dict:
+        saved = self.stats['pixels_requested'] - self.stats['pixels_computed']
+        return dict(self.stats, pixels_saved=saved,
+                    saved_fraction=saved / self.stats['pixels_requested'] if self.stats['pixels_requested'] else 0.0)
+
+    async def submit(self, job: pipeline.ChangeJob, on_stage=None, should_cancel=None) -> dict:
+        """Run `job`, sharing the computation with overlapping jobs where possible.
+
+        `on_stage(stage)` is called as the shared computation enters each stage;
+        it is cancelled once `should_cancel()` is true for every job sharing it.
+        """
+        key = coalesce_key(job)
+        window = grid.pixel_window(job.bounds, job.scale)
+        self.stats['requests'] += 1
+        self.stats['pixels_requested'] += grid.window_size(window)
+
+        group = self._find_group(key, job, window)
+        if group is None:
+            group = _Group(key, job, window)
+            self._groups.setdefault(key, []).append(group)
+            asyncio.get_running_loop().create_task(self._run_group(group))
+        else:
+            self.stats['shared'] += 1
+        if on_stage:
+            group.on_stage.append(on_stage)
+        group.cancel_checks.append(should_cancel)
+        result = self._slice(await asyncio.shield(group.done), group, job, window)
+        if self.history_root:
+            result['history'] = await pipeline.call(pipeline.record_history, job, result, self.history_root)
+        return result
+
+    def _find_group(self, key, job, window):
+        for group in self._groups.get(key, []):
+            if group.started:
+                if grid.intersect_windows(group.union, window) == window:
+                    group.descriptions.append(job.description)
+                    return group
+            elif self._can_merge(group, job, window):
+                group.windows.append(window)
+                group.union = grid.union_windows([group.union, window])
+                group.descriptions.append(job.description)
+                return group
+        return None
+
+    def _can_merge(self, group, job, window) -> bool:
+        overlap = grid.intersect_windows(group.union, window)
+        if overlap is None or grid.window_size(overlap) < self.min_overlap * grid.window_size(window):
+            return False
+        union = grid.union_windows([group.union, window])
+        if grid.window_size(union) > grid.window_size(group.union) + grid.window_size(window):
+            return False
+        # The merged job must still fit the budget at the requested scale
+        plan = planner.plan(grid.window_bounds(union, job.scale), job.baseline, job.comparison,
+                            scale=job.scale, polarisations=job.polarisations,
+                            orbit_split=job.orbit_split, policy=self.policy)
+        return plan['decision']['action'] == 'run'
+
+    async def _run_group(self, group: _Group):
+        try:
+            await asyncio.sleep(self.window)
+            group.started = True
+            job = replace(group.template, bounds=grid.window_bounds(group.union, group.template.scale))
+            if len(group.descriptions) > 1:
+                # Named after what it computes, so every process (and every rerun) gives a
+                # group the same output files and checkpoint, and different groups differ
+                name = job_key({'params': group.key, 'bounds': job.bounds})
+                job = replace(job, description=f"coalesced_{name}")
+            plan = planner.plan(job.bounds, job.baseline, job.comparison, scale=job.scale,
+                                polarisations=job.polarisations, orbit_split=job.orbit_split,
+                                policy=self.policy)
+            if plan['decision']['action'] == 'run':
+                job = pipeline.job_from_plan(job, plan)
+            self.stats['computations'] += 1
+            self.stats['pixels_computed'] += grid.window_size(group.union)
+            result = await pipeline.run_job(self.backend, job, self.poll_interval, self.checkpoint_dir,
+                                            on_stage=lambda stage: [fn(stage) for fn in group.on_stage],
+                                            profile=self.profile,
+                                            should_cancel=lambda: all(fn is not None and fn()
+                                                                      for fn in group.cancel_checks))
+            group.done.set_result(result)
+        except Exception as e:
+            group.done.set_exception(e)
+        finally:
+            self._groups[group.key].remove(group)
+
+    # This caller's share of a group result: its window inside the shared raster. Of
+    # a tiled result it gets only the tiles that intersect its window, each cropped.
+    def _slice(self, shared: dict, group: _Group, job, window) -> dict:
+        result = dict(shared, description=job.description,
+                      shared_description=shared['description'],
+                      shared_with=list(group.descriptions),
+                      window=list(window), shared_window=list(group.union),
+                      slices=[[s.start, s.stop] for s in grid.window_slices(window, group.union)])
+        outputs = shared.get('outputs') or []
+        if len(outputs) == 1 and window != group.union:
+            path = os.path.join(os.path.dirname(outputs[0]), f"{job.description}.tif")
+            result['outputs'] = [crop_geotiff(outputs[0], job.bounds, path)]
+        elif len(outputs) > 1:
+            result['outputs'] = []
+            for output in outputs:
+                tile = geotiff_bounds(output)
+                part = (max(tile[0], job.bounds[0]), max(tile[1], job.bounds[1]),
+                        min(tile[2], job.bounds[2]), min(tile[3], job.bounds[3]))
+                if part[0] >= part[2] or part[1] >= part[3]:
+                    continue
+                if window == group.union:
+                    result['outputs'].append(output)
+                    continue
+                path = os.path.join(os.path.dirname(output),
+                                    f"{job.description}_{len(result['outputs'])}.tif")
+                result['outputs'].append(crop_geotiff(output, part, path))
+        return result
+
+
+# (west, south, east, north) of a GeoTIFF
+def geotiff_bounds(path: str) -> grid.Bounds:
+    import rasterio
+
+    with rasterio.open(path) as src:
+        return tuple(src.bounds)
+
+
+# Cut the part of a downloaded GeoTIFF covering `bounds` into its own file. The
+# shared export can be smaller than the union (mask_stage drops water), so pixels
+# outside it are read as nodata rather than shifting the crop onto the raster.
+def crop_geotiff(src_path: str, bounds: grid.Bounds, dst_path: str) -> str:
+    import numpy as np
+    import rasterio
+    from rasterio.windows import from_bounds
+
+    with rasterio.open(src_path) as src:
+        window = from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths()
+        nodata = src.nodata
+        if nodata is None:
+            nodata = np.nan if np.issubdtype(np.dtype(src.dtypes[0]), np.floating) else 0
+        data = src.read(window=window, boundless=True, fill_value=nodata)
+        profile = dict(src.profile, width=data.shape[2], height=data.shape[1], nodata=nodata,
+                       transform=src.window_transform(window))
+        descriptions = src.descriptions  # band names, e.g. VV_change
+    with rasterio.open(dst_path, 'w', **profile) as dst:
+        dst.write(data)
+        dst.descriptions = descriptions
+    return dst_path
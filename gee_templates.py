@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""Earth Engine Code Editor scripts rendered from compiled, validated templates.
+
+One template per script variant the apps used to build with f-strings:
+
+* ``overlay`` - median change and significant-change layers (``webapp.py``);
+* ``export`` - change layer plus an ``Export.image.toDrive`` task
+  (``updated_script.py``);
+* ``land_mask`` - mean change with a MODIS land mask (``semi_final_wab_app.py``).
+
+Each template is compiled once into a %-format string. Parameters are
+validated and normalized before they reach the JavaScript: dates must be
+ISO ``YYYY-MM-DD`` with start before end, coordinates finite and in range,
+the threshold and scale finite, and the export description limited to the
+characters Earth Engine accepts. A rendered script is identified by a hash
+of its variant and normalized parameters, so a batch renders each distinct
+script once and files are written once per hash.
+
+    python gee_templates.py render aois.jsonl --variant overlay --out scripts/
+    python gee_templates.py serve scripts/ --port 8765
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_SCRIPT_DIR = os.path.expanduser(os.path.join('~', '.sar_change', 'scripts'))
+DEFAULT_DESCRIPTION = 'Sentinel1_Change_Detection'
+CODE_EDITOR_URL = 'https://code.earthengine.google.com/'
+_FIELD = re.compile(r'\{\{(\w+)\}\}')
+_DESCRIPTION = re.compile(r'[A-Za-z0-9.,:;_-]{1,100}\Z')  # allowed in EE task descriptions
+_ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}\Z')  # periods are whole days, as the scripts filter them
+
+PARAMS = ('min_lon', 'min_lat', 'max_lon', 'max_lat', 'baseline_start', 'baseline_end',
+          'comparison_start', 'comparison_end', 'threshold', 'scale', 'description')
+
+OVERLAY = """\
+var geometry = ee.Geometry.Rectangle([{{min_lon}}, {{min_lat}}, {{max_lon}}, {{max_lat}}]);
+
+var collection1 = ee.ImageCollection('COPERNICUS/S1_GRD')
+                    .filterBounds(geometry)
+                    .filterDate('{{baseline_start}}', '{{baseline_end}}')
+                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                    .select('VV')
+                    .median();
+
+var collection2 = ee.ImageCollection('COPERNICUS/S1_GRD')
+                    .filterBounds(geometry)
+                    .filterDate('{{comparison_start}}', '{{comparison_end}}')
+                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                    .select('VV')
+                    .median();
+
+var change = collection2.subtract(collection1).rename('Change');
+var significantChange = change.gt({{threshold}});
+Map.centerObject(geometry, 10);
+
+// Add the "Change Detection" layer with reduced opacity
+Map.addLayer(change,
+  {min: -2, max: 2, palette: ['yellow', 'black', 'red'], opacity: 0.3},
+  'Change Detection'
+);
+
+// Add the "Significant Change" layer with reduced opacity
+Map.addLayer(significantChange.updateMask(significantChange),
+  {palette: ['red'], opacity: 0.2},
+  'Significant Change'
+);
+"""
+
+EXPORT = """\
+// Define the area of interest (AOI)
+var geometry = ee.Geometry.Rectangle([{{min_lon}}, {{min_lat}}, {{max_lon}}, {{max_lat}}]);
+
+// Date ranges for the baseline and comparison periods
+var baseline_start = '{{baseline_start}}';
+var baseline_end = '{{baseline_end}}';
+var comparison_start = '{{comparison_start}}';
+var comparison_end = '{{comparison_end}}';
+
+// Load and process the Sentinel-1 SAR image collection for the baseline period
+var collection1 = ee.ImageCollection('COPERNICUS/S1_GRD')
+                    .filterBounds(geometry)
+                    .filterDate(baseline_start, baseline_end)
+                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                    .select('VV')
+                    .median();
+
+// Load and process the Sentinel-1 SAR image collection for the comparison period
+var collection2 = ee.ImageCollection('COPERNICUS/S1_GRD')
+                    .filterBounds(geometry)
+                    .filterDate(comparison_start, comparison_end)
+                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                    .select('VV')
+                    .median();
+
+// Check if an image was found
+if (collection1 && collection2) {
+  // Calculate the change between the two periods
+  var change = collection2.subtract(collection1);
+
+  // Define visualization parameters
+  var visParams = {
+      min: -30,
+      max: 0,
+      palette: ['white', 'black']  // Grayscale palette
+  };
+
+  // Add the change layer to the map
+  Map.centerObject(geometry, 12);  // Center the map on the AOI with zoom level 12
+  Map.addLayer(change, visParams, 'Sentinel-1 Change Detection');
+
+  // Set the export parameters
+  Export.image.toDrive({
+      image: change,
+      description: '{{description}}',
+      scale: {{scale}},  // Set the scale/resolution
+      region: geometry,  // Export the AOI
+      maxPixels: 1e13  // Adjust if necessary
+  });
+
+  print('Export task created. Check the Tasks tab to start the export.');
+} else {
+  print('No images found for the selected area and date ranges.');
+}
+"""
+
+LAND_MASK = """\
+var geometry = ee.Geometry.Rectangle([{{min_lon}}, {{min_lat}}, {{max_lon}}, {{max_lat}}]);
+
+var collection1 = ee.ImageCollection('COPERNICUS/S1_GRD')
+                    .filterBounds(geometry)
+                    .filterDate('{{baseline_start}}', '{{baseline_end}}')
+                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                    .select('VV');
+
+var collection2 = ee.ImageCollection('COPERNICUS/S1_GRD')
+                    .filterBounds(geometry)
+                    .filterDate('{{comparison_start}}', '{{comparison_end}}')
+                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                    .select('VV');
+
+var change = collection2.mean().subtract(collection1.mean()).rename('Change');
+var significantChange = change.gt({{threshold}});
+Map.centerObject(geometry, 10);
+
+// Create a land mask
+var landMask = ee.Image('MODIS/006/MCD12Q1/2018_01_01')
+                 .select('LC_Type1')
+                 .eq(1)  // 1 corresponds to 'Water'
+                 .not(); // Invert the mask to get land areas
+
+// Apply the land mask
+var maskedChange = change.updateMask(landMask);
+
+// Adjust the color palette for smooth transitions
+Map.addLayer(maskedChange,
+  {min: -1, max: 1, palette: ['blue', 'white', 'yellow', 'red'], opacity: 0.6},
+  'Change Detection'
+);
+
+Map.addLayer(significantChange.updateMask(significantChange).updateMask(landMask),
+  {palette: ['red'], opacity: 0.3},
+  'Significant Change'
+);
+"""
+
+
+class CompiledTemplate:
+    """A script template with ``{{name}}`` fields, compiled once to a %-format string."""
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.fields = tuple(dict.fromkeys(_FIELD.findall(text)))
+        unknown = set(self.fields) - set(PARAMS)
+        if unknown:
+            raise ValueError(f"Template {name!r} uses unknown fields {sorted(unknown)}.")
+        self.digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+        self._format = _FIELD.sub(lambda m: f"%({m.group(1)})s", text.replace('%', '%%'))
+
+    def render(self, values: Dict[str, str]) -> str:
+        return self._format % values
+
+    # Hash of the template and the values it actually uses
+    def key(self, values: Dict[str, str]) -> str:
+        joined = '\x1f'.join([self.digest] + [values[field] for field in self.fields])
+        return hashlib.sha1(joined.encode('utf-8')).hexdigest()[:16]
+
+
+TEMPLATES = {name: CompiledTemplate(name, text)
+             for name, text in (('overlay', OVERLAY), ('export', EXPORT), ('land_mask', LAND_MASK))}
+
+
+def _iso_date(value: str) -> str:
+    if _ISO_DATE.match(value):
+        try:
+            return date.fromisoformat(value).isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date {value!r}; expected YYYY-MM-DD.")
+
+
+# A date or an ISO date string as YYYY-MM-DD; a time of day would be dropped, so it is refused
+def _date(value) -> str:
+    if isinstance(value, datetime):
+        if value.time() != datetime.min.time():
+            raise ValueError(f"Invalid date {value!r}; expected a date without a time of day.")
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid date {value!r}; expected YYYY-MM-DD.")
+    return _iso_date(value)
+
+
+@lru_cache(maxsize=4096)
+def _checked_period(start, end, name: str) -> Tuple[str, str]:
+    start, end = _date(start), _date(end)
+    if start >= end:
+        raise ValueError(f"The {name} period must start before it ends ({start} to {end}).")
+    return start, end
+
+
+# (start, end) from a tuple or a GeoJSON-style {'start_date': ..., 'end_date': ...} period
+def _period(period, name: str) -> Tuple[str, str]:
+    if isinstance(period, dict):
+        period = (period.get('start_date'), period.get('end_date'))
+    try:
+        start, end = period
+    except (TypeError, ValueError):
+        raise ValueError(f"The {name} period must be (start, end), got {period!r}.") from None
+    for value in (start, end):
+        if not isinstance(value, (str, date)):  # checked here: the cache needs hashable values
+            raise ValueError(f"Invalid date {value!r}; expected YYYY-MM-DD.")
+    return _checked_period(start, end, name)
+
+
+def _number(value, name: str) -> float:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}.") from None
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be finite, got {value!r}.")
+    return number
+
+
+def normalize_params(bounds, baseline, comparison, threshold=0.1, scale=10,
+                     description: str = DEFAULT_DESCRIPTION) -> Dict[str, str]:
+    """Validated template values, formatted as they appear in the script."""
+    if len(bounds) != 4:
+        raise ValueError(f"Bounds must be (min_lon, min_lat, max_lon, max_lat), got {bounds!r}.")
+    min_lon, min_lat, max_lon, max_lat = (_number(v, n) for v, n in zip(bounds, PARAMS[:4]))
+    if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise ValueError(f"Bounds {bounds!r} are not a valid longitude/latitude rectangle.")
+    scale = _number(scale, 'scale')
+    if scale <= 0:
+        raise ValueError(f"scale must be positive, got {scale!r}.")
+    if not isinstance(description, str) or not _DESCRIPTION.match(description):
+        raise ValueError(f"Invalid export description {description!r}: use up to 100 letters, "
+                         f"digits and . , : ; _ -")
+    baseline_start, baseline_end = _period(baseline, 'baseline')
+    comparison_start, comparison_end = _period(comparison, 'comparison')
+    return {
+        'min_lon': repr(min_lon), 'min_lat': repr(min_lat),
+        'max_lon': repr(max_lon), 'max_lat': repr(max_lat),
+        'baseline_start': baseline_start, 'baseline_end': baseline_end,
+        'comparison_start': comparison_start, 'comparison_end': comparison_end,
+        'threshold': repr(_number(threshold, 'threshold')), 'scale': repr(scale),
+        'description': description,
+    }
+
+
+def _template(variant: str) -> CompiledTemplate:
+    try:
+        return TEMPLATES[variant]
+    except KeyError:
+        raise ValueError(f"Unknown script variant {variant!r}, expected one of {sorted(TEMPLATES)}.") from None
+
+
+def render(variant: str, **params) -> Tuple[str, str]:
+    """``(key, script)`` for one set of parameters (see ``normalize_params``)."""
+    template = _template(variant)
+    values = normalize_params(**params)
+    return template.key(values), template.render(values)
+
+
+def render_batch(variant: str, params: Iterable[dict]) -> Tuple[List[str], Dict[str, str]]:
+    """Render many parameter sets; returns each input's key and one script per distinct key.
+
+    Invalid parameters raise ValueError naming the (0-based) input index.
+    """
+    template = _template(variant)
+    keys, scripts = [], {}
+    for i, item in enumerate(params):
+        try:
+            values = normalize_params(**item)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Parameters #{i}: {e}") from None
+        key = template.key(values)
+        if key not in scripts:
+            scripts[key] = template.render(values)
+        keys.append(key)
+    return keys, scripts
+
+
+# Write scripts as <key>.js; a file already present for a key is not rewritten
+def save_scripts(scripts: Dict[str, str], directory: str = DEFAULT_SCRIPT_DIR) -> Dict[str, str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for key, script in scripts.items():
+        path = os.path.join(directory, f"{key}.js")
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(script)
+            os.replace(path + '.tmp', path)
+        paths[key] = path
+    return paths
+
+
+# Render and save one script, returning the path of its file
+def save_script(variant: str, directory: str = DEFAULT_SCRIPT_DIR, **params) -> str:
+    key, script = render(variant, **params)
+    return save_scripts({key: script}, directory)[key]
+
+
+# Serve <key>.js files from a directory, plus an index of the keys at /
+def serve(directory: str = DEFAULT_SCRIPT_DIR, host: str = '127.0.0.1', port: int = 8765):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = self.path.strip('/').split('?')[0]
+            if name == '':
+                keys = sorted(f[:-3] for f in os.listdir(directory) if f.endswith('.js'))
+                body, content_type = json.dumps(keys).encode('utf-8'), 'application/json'
+            elif re.fullmatch(r'[0-9a-f]{16}(\.js)?', name) and \
+                    os.path.exists(os.path.join(directory, name.split('.')[0] + '.js')):
+                with open(os.path.join(directory, name.split('.')[0] + '.js'), 'rb') as f:
+                    body, content_type = f.read(), 'text/javascript; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving scripts from {directory} at http://{host}:{server.server_address[1]}/<key>.js")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render Earth Engine Code Editor scripts')
+    commands = parser.add_subparsers(dest='command', required=True)
+    render_cmd = commands.add_parser('render', help='render a JSON-lines file of parameter sets')
+    render_cmd.add_argument('params', help='one JSON object of normalize_params arguments per line')
+    render_cmd.add_argument('--variant', default='overlay', choices=sorted(TEMPLATES))
+    render_cmd.add_argument('--out', default=DEFAULT_SCRIPT_DIR)
+    serve_cmd = commands.add_parser('serve', help='serve rendered scripts over HTTP')
+    serve_cmd.add_argument('directory', nargs='?', default=DEFAULT_SCRIPT_DIR)
+    serve_cmd.add_argument('--host', default='127.0.0.1')
+    serve_cmd.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.command == 'render':
+        with open(args.params, 'r') as f:
+            params = [json.loads(line) for line in f if line.strip()]
+        keys, scripts = render_batch(args.variant, params)
+        save_scripts(scripts, args.out)
+        print(json.dumps({'inputs': len(keys), 'scripts': len(scripts), 'directory': args.out, 'keys': keys}))
+    else:
+        server = serve(args.directory, args.host, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
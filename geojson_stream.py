@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Streaming, array-backed GeoJSON parsing for large AOI uploads.
+
+The file is read in fixed-size chunks and the ``features`` array is decoded
+one feature at a time, so memory stays bounded by the largest single
+feature rather than the whole document. Coordinates go straight into one
+contiguous float64 array with ring offsets, and the bbox and per-feature
+extents are computed with vectorized reductions.
+
+``extract_data_from_geojson`` and ``extract_coordinates_from_geojson``
+return exactly what the functions of the same name in the scripts return
+(the exterior rings of Polygon features, and the date periods), and
+``bbox`` the same values the scripts' min / max give: exterior rings
+that are not plain [lon, lat] floats (integers, altitudes) are also kept
+as written and used for those. ``bench_geojson.py --check`` compares them
+against the ``json.load`` versions on random documents.
+"""
+import json
+from array import array
+from itertools import chain
+from typing import List, Tuple
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 16
+_WHITESPACE = ' \t\n\r'
+
+
+class _Reader:
+    """Incremental JSON reader over a text file."""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.saw_int = False  # an integer was decoded since this was last reset
+        self._decoder = json.JSONDecoder(parse_int=self._int)
+
+    def _int(self, text):
+        self.saw_int = True
+        return int(text)
+
+    def _fill(self, size=None) -> bool:
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # Next non-whitespace character, without consuming it ('' at end of file)
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid GeoJSON: expected {char!r}, found {found or 'end of file'!r}.")
+        self.pos += 1
+
+    # Decode one complete JSON value, reading more of the file as needed
+    def value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Truncated value: read more, doubling each time so a large
+                # feature is re-decoded a logarithmic number of times
+                size *= 2
+                if self._fill(size):
+                    continue
+                raise
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+class ParsedGeoJSON:
+    """Coordinates of every ring, in contiguous arrays.
+
+    ``coords`` is (N, 2) float64 [lon, lat]; ring ``i`` is
+    ``coords[ring_offsets[i]:ring_offsets[i + 1]]``. ``ring_feature`` gives
+    each ring's feature index, ``ring_exterior`` whether it is the first
+    ring of its polygon and ``ring_polygon`` whether the feature is a
+    plain Polygon (as opposed to a MultiPolygon). ``raw_rings`` maps the
+    index of each Polygon exterior ring that is not plain [lon, lat] floats
+    to the ring as written in the file.
+    """
+
+    def __init__(self, coords, ring_offsets, ring_feature, ring_exterior, ring_polygon,
+                 feature_count, properties, raw_rings=None):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.ring_feature = ring_feature
+        self.ring_exterior = ring_exterior
+        self.ring_polygon = ring_polygon
+        self.feature_count = feature_count
+        self.properties = properties  # top-level members other than 'features'
+        self.raw_rings = raw_rings or {}
+
+    @property
+    def baseline_period(self) -> dict:
+        return self.properties.get('baseline_period', {})
+
+    @property
+    def comparison_period(self) -> dict:
+        return self.properties.get('comparison_period', {})
+
+    # Coordinates of the exterior rings of Polygon features - what the scripts use
+    def polygon_coords(self) -> np.ndarray:
+        selected = np.flatnonzero(self.ring_exterior & self.ring_polygon)
+        if selected.size == 0:
+            return np.empty((0, 2))
+        starts, ends = self.ring_offsets[selected], self.ring_offsets[selected + 1]
+        lengths = ends - starts
+        index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return self.coords[index]
+
+    # polygon_coords() as lists, with every coordinate exactly as written in the file
+    def polygon_coord_list(self) -> list:
+        if not self.raw_rings:
+            return self.polygon_coords().tolist()
+        coords = []
+        for ring in np.flatnonzero(self.ring_exterior & self.ring_polygon):
+            raw = self.raw_rings.get(int(ring))
+            if raw is None:
+                raw = self.coords[self.ring_offsets[ring]:self.ring_offsets[ring + 1]].tolist()
+            coords.extend(raw)
+        return coords
+
+    # Coordinate `position` of polygon_coords(), as written in the file
+    def _polygon_coord(self, position: int):
+        selected = np.flatnonzero(self.ring_exterior & self.ring_polygon)
+        ends = np.cumsum(self.ring_offsets[selected + 1] - self.ring_offsets[selected])
+        k = int(np.searchsorted(ends, position, side='right'))
+        raw = self.raw_rings.get(int(selected[k]))
+        if raw is None:
+            return self.polygon_coords()[position].tolist()
+        return raw[position - (int(ends[k - 1]) if k else 0)]
+
+    def bbox(self, polygons_only: bool = True):
+        """(min_lon, min_lat, max_lon, max_lat), or None when there are no coordinates.
+
+        For Polygon exterior rings each value is the coordinate as written, like
+        min() / max() over the scripts' coordinate lists.
+        """
+        coords = self.polygon_coords() if polygons_only else self.coords
+        if len(coords) == 0:
+            return None
+        if polygons_only and self.raw_rings:
+            # The first coordinate holding each extreme, as min() / max() would pick it
+            lows, highs = coords.argmin(axis=0), coords.argmax(axis=0)
+            return (self._polygon_coord(int(lows[0]))[0], self._polygon_coord(int(lows[1]))[1],
+                    self._polygon_coord(int(highs[0]))[0], self._polygon_coord(int(highs[1]))[1])
+        mins, maxs = coords.min(axis=0), coords.max(axis=0)
+        return float(mins[0]), float(mins[1]), float(maxs[0]), float(maxs[1])
+
+    def feature_extents(self) -> np.ndarray:
+        """(feature_count, 4) array of per-feature bboxes; NaN for features without rings."""
+        extents = np.full((self.feature_count, 4), np.nan)
+        nonempty = np.flatnonzero(np.diff(self.ring_offsets) > 0)
+        if nonempty.size == 0:
+            return extents
+        starts = self.ring_offsets[nonempty]
+        ring_min = np.minimum.reduceat(self.coords, starts, axis=0)
+        ring_max = np.maximum.reduceat(self.coords, starts, axis=0)
+        features = self.ring_feature[nonempty]
+        # Rings are stored in feature order, so each feature is one contiguous run
+        first = np.flatnonzero(np.r_[True, features[1:] != features[:-1]])
+        feature_ids = features[first]
+        extents[feature_ids, 0:2] = np.minimum.reduceat(ring_min, first, axis=0)
+        extents[feature_ids, 2:4] = np.maximum.reduceat(ring_max, first, axis=0)
+        return extents
+
+
+# Polygon rings of a geometry as (rings, polygon-type flag); other types have no rings
+def _geometry_rings(geometry):
+    if not isinstance(geometry, dict):
+        return [], False
+    kind = geometry.get('type')
+    if kind == 'Polygon':
+        return [(ring, i == 0) for i, ring in enumerate(geometry.get('coordinates') or [])], True
+    if kind == 'MultiPolygon':
+        return [(ring, i == 0) for polygon in geometry.get('coordinates') or []
+                for i, ring in enumerate(polygon)], False
+    return [], False
+
+
+# Append a ring's [lon, lat] pairs (without any altitude) to the flat coordinate
+# array. Returns whether the ring was exactly that: [lon, lat] pairs of floats.
+def _append_ring(coords: array, ring, may_have_ints: bool) -> bool:
+    try:
+        values = np.asarray(ring, dtype=np.float64)
+    except ValueError:  # ragged ring, e.g. some points with altitude
+        values = None
+    if values is not None and values.ndim == 2 and values.shape[1] >= 2:
+        coords.frombytes(np.ascontiguousarray(values[:, :2]).tobytes())
+        return values.shape[1] == 2 and (
+            not may_have_ints or set(map(type, chain.from_iterable(ring))) == {float})
+    for coord in ring:
+        coords.append(coord[0])
+        coords.append(coord[1])
+    return False
+
+
+def parse_geojson(geojson_file: str, chunk_size: int = CHUNK_SIZE) -> ParsedGeoJSON:
+    """Parse a GeoJSON FeatureCollection, decoding one feature at a time."""
+    coords = array('d')
+    offsets = array('q', [0])
+    ring_feature, ring_exterior, ring_polygon = array('i'), array('b'), array('b')
+    raw_rings = {}
+    properties = {}
+    feature_count = 0
+
+    with open(geojson_file, 'r') as f:
+        reader = _Reader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            reader.pos += 1
+        else:
+            while True:
+                key = reader.value()
+                reader.expect(':')
+                if key == 'features' and reader.peek() == '[':
+                    reader.expect('[')
+                    if reader.peek() == ']':
+                        reader.pos += 1
+                    else:
+                        while True:
+                            reader.saw_int = False
+                            feature = reader.value()
+                            geometry = feature.get('geometry') if isinstance(feature, dict) else None
+                            rings, is_polygon = _geometry_rings(geometry)
+                            for ring, exterior in rings:
+                                plain = _append_ring(coords, ring, reader.saw_int)
+                                if exterior and is_polygon and not plain:
+                                    raw_rings[len(offsets) - 1] = ring
+                                offsets.append(len(coords) // 2)
+                                ring_feature.append(feature_count)
+                                ring_exterior.append(exterior)
+                                ring_polygon.append(is_polygon)
+                            feature_count += 1
+                            if reader.peek() == ',':
+                                reader.pos += 1
+                                continue
+                            reader.expect(']')
+                            break
+                else:
+                    properties[key] = reader.value()
+                if reader.peek() == ',':
+                    reader.pos += 1
+                    continue
+                reader.expect('}')
+                break
+
+    return ParsedGeoJSON(
+        coords=np.frombuffer(coords, dtype=np.float64).reshape(-1, 2),
+        ring_offsets=np.frombuffer(offsets, dtype=np.int64),
+        ring_feature=np.frombuffer(ring_feature, dtype=np.int32),
+        ring_exterior=np.frombuffer(ring_exterior, dtype=np.int8).astype(bool),
+        ring_polygon=np.frombuffer(ring_polygon, dtype=np.int8).astype(bool),
+        feature_count=feature_count,
+        properties=properties,
+        raw_rings=raw_rings,
+    )
+
+
+# Drop-in for the scripts' extract_data_from_geojson
+def extract_data_from_geojson(geojson_file: str) -> Tuple[List[Tuple[float, float]], dict, dict]:
+    parsed = parse_geojson(geojson_file)
+    return parsed.polygon_coord_list(), parsed.baseline_period, parsed.comparison_period
+
+
+# Drop-in for the scripts' extract_coordinates_from_geojson
+def extract_coordinates_from_geojson(geojson_file):
+    return parse_geojson(geojson_file).polygon_coord_list()
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""Read Sentinel-1 GRD scenes from local disk, lazily and per AOI window.
+
+Two kinds of scene are indexed:
+
+* SAFE products (``*.SAFE`` directories or ``*.zip`` of one). Date, mode,
+  polarisations, orbit pass and footprint come from ``manifest.safe``;
+  pixels are digital numbers calibrated to sigma0 with the product's
+  ``sigmaNought`` LUT and geocoded from its tie-point grid (GCPs).
+  Thermal noise removal and terrain correction, which ``COPERNICUS/S1_GRD``
+  applies, are not done here.
+* GeoTIFF / COG scenes that are already georeferenced, e.g. Earth Engine
+  exports or ``synthetic_sar.py`` output. Metadata comes from the tags
+  ``date``, ``instrumentMode`` and ``units`` (``dB`` or linear power) and
+  the band descriptions, falling back to the usual S1 file naming.
+
+``SceneIndex.filter`` selects scenes the way ``load_image_collection`` in
+the scripts does (IW mode, VV available, bounds, date range) and returns
+``Scene`` objects that hold only metadata. ``Scene.read`` reads the source
+window that covers the AOI - only the blocks it touches - and resamples it
+onto the global grid of ``grid.py`` at the requested scale, in dB.
+"""
+import glob
+import os
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from bisect import bisect_left
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import grid
+
+SCENE_PATTERNS = ('*.SAFE', '*.SAFE.zip', '*.zip', '*.tif', '*.tiff')
+S1_NAME = re.compile(r'S1[ABCD]_(?P<mode>IW|EW|SM|WV)_\w*?(?P<date>\d{8})T(?P<time>\d{6})')
+GRID_MARGIN = 16  # source pixels read beyond the AOI so resampling has full support
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+# Text of every element with this local name, in document order
+def _find_text(root, name: str) -> List[str]:
+    return [el.text.strip() for el in root.iter() if _local(el.tag) == name and el.text]
+
+
+def _to_db(linear: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        db = 10 * np.log10(linear)
+    db[~np.isfinite(db)] = np.nan
+    return db.astype(np.float32)
+
+
+# Destination of a read: the grid window covering `bounds` and its affine transform
+def _target(bounds: grid.Bounds, scale: float):
+    from rasterio.transform import from_bounds
+
+    window = grid.pixel_window(bounds, scale)
+    height, width = grid.window_shape(window)
+    return window, (height, width), from_bounds(*grid.window_bounds(window, scale), width, height)
+
+
+class _SafeFiles:
+    """Member access for a SAFE product stored as a directory or a zip."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as z:
+                self.names = z.namelist()
+        else:
+            self.names = [os.path.relpath(p, path).replace(os.sep, '/')
+                          for p in glob.glob(os.path.join(path, '**', '*'), recursive=True)]
+
+    def find(self, pattern: str) -> Optional[str]:
+        regex = re.compile(pattern, re.IGNORECASE)
+        return next((name for name in sorted(self.names) if regex.search(name)), None)
+
+    def read(self, name: str) -> bytes:
+        if zipfile.is_zipfile(self.path):
+            with zipfile.ZipFile(self.path) as z:
+                return z.read(name)
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return f.read()
+
+    # Path GDAL can open for a member
+    def gdal_path(self, name: str) -> str:
+        if zipfile.is_zipfile(self.path):
+            return f"/vsizip/{os.path.abspath(self.path)}/{name}"
+        return os.path.join(self.path, name)
+
+
+# sigmaNought LUT of a calibration XML as (lines, pixels, values[lines, pixels])
+def _parse_calibration(xml: bytes):
+    root = ET.fromstring(xml)
+    lines, pixels, values = [], None, []
+    for vector in root.iter():
+        if _local(vector.tag) != 'calibrationVector':
+            continue
+        fields = {_local(child.tag): child.text for child in vector}
+        lines.append(int(fields['line']))
+        pixels = np.array(fields['pixel'].split(), dtype=np.float64)
+        values.append(np.array(fields['sigmaNought'].split(), dtype=np.float64))
+    return np.array(lines, dtype=np.float64), pixels, np.vstack(values)
+
+
+# Bilinear interpolation of a LUT given on a (lines x pixels) grid at rows x cols
+def _interp_lut(lines, pixels, values, rows, cols) -> np.ndarray:
+    across = np.vstack([np.interp(cols, pixels, vector) for vector in values])
+    i = np.clip(np.searchsorted(lines, rows) - 1, 0, len(lines) - 2)
+    w = np.clip((rows - lines[i]) / (lines[i + 1] - lines[i]), 0, 1)[:, None]
+    return across[i] * (1 - w) + across[i + 1] * w
+
+
+class Scene:
+    """Metadata of one scene on disk; pixels are read on demand by ``read``."""
+
+    def __init__(self, path, kind, date, mode, polarisations, footprint, orbit_pass=None, units='dB'):
+        self.path = path
+        self.kind = kind  # 'safe' or 'geotiff'
+        self.date = date
+        self.mode = mode
+        self.polarisations = tuple(polarisations)
+        self.footprint = footprint  # (min_lon, min_lat, max_lon, max_lat)
+        self.orbit_pass = orbit_pass
+        self.units = units
+
+    def __repr__(self):
+        return (f"Scene({os.path.basename(self.path)}, {self.date:%Y-%m-%d}, {self.mode}, "
+                f"{'/'.join(self.polarisations)})")
+
+    def intersects(self, bounds: grid.Bounds) -> bool:
+        return (self.footprint[0] < bounds[2] and bounds[0] < self.footprint[2]
+                and self.footprint[1] < bounds[3] and bounds[1] < self.footprint[3])
+
+    def read(self, bounds: grid.Bounds, scale: float = 10, polarisation: str = 'VV') -> Tuple[np.ndarray, grid.Window]:
+        """sigma0 in dB over the grid window covering `bounds`; NaN outside the scene."""
+        if polarisation not in self.polarisations:
+            raise ValueError(f"{self} has no {polarisation} band.")
+        if self.kind == 'safe':
+            return self._read_safe(bounds, scale, polarisation)
+        return self._read_geotiff(bounds, scale, polarisation)
+
+    def _read_geotiff(self, bounds, scale, polarisation):
+        import rasterio
+        from rasterio.enums import Resampling
+        from rasterio.warp import reproject, transform_bounds
+        from rasterio.windows import Window, from_bounds
+
+        window, shape, transform = _target(bounds, scale)
+        out = np.full(shape, np.nan, dtype=np.float32)
+        with rasterio.open(self.path) as src:
+            band = _geotiff_band(src, self.polarisations, polarisation)
+            # Only the source blocks under the AOI (plus a margin) are read
+            aoi = from_bounds(*transform_bounds('EPSG:4326', src.crs, *bounds), transform=src.transform)
+            row0 = max(0, int(np.floor(aoi.row_off)) - GRID_MARGIN)
+            col0 = max(0, int(np.floor(aoi.col_off)) - GRID_MARGIN)
+            row1 = min(src.height, int(np.ceil(aoi.row_off + aoi.height)) + GRID_MARGIN)
+            col1 = min(src.width, int(np.ceil(aoi.col_off + aoi.width)) + GRID_MARGIN)
+            if row0 >= row1 or col0 >= col1:
+                return out, window
+            src_window = Window(col0, row0, col1 - col0, row1 - row0)
+            data = src.read(band, window=src_window, masked=True).astype(np.float32).filled(np.nan)
+            src_transform, src_crs = src.window_transform(src_window), src.crs
+        if self.units.lower() == 'db':
+            data = (10 ** (data / 10)).astype(np.float32)
+        # Average in linear power, then convert, as for SAFE products
+        reproject(data, out, src_transform=src_transform, src_crs=src_crs, src_nodata=np.nan,
+                  dst_transform=transform, dst_crs='EPSG:4326', dst_nodata=np.nan,
+                  resampling=Resampling.average)
+        return _to_db(out), window
+
+    def _read_safe(self, bounds, scale, polarisation):
+        import rasterio
+        from rasterio.control import GroundControlPoint
+        from rasterio.enums import Resampling
+        from rasterio.transform import GCPTransformer
+        from rasterio.warp import reproject
+        from rasterio.windows import Window
+
+        files = _SafeFiles(self.path)
+        pol = polarisation.lower()
+        measurement = files.find(rf'measurement/.*-{pol}-.*\.tiff?$')
+        calibration = files.find(rf'annotation/calibration/calibration-.*-{pol}-.*\.xml$')
+        if measurement is None or calibration is None:
+            raise ValueError(f"{self.path} has no {polarisation} measurement or calibration file.")
+
+        window, shape, transform = _target(bounds, scale)
+        out = np.full(shape, np.nan, dtype=np.float32)
+        with rasterio.open(files.gdal_path(measurement)) as src:
+            gcps, gcp_crs = src.gcps
+            # Source rows / cols of points along the AOI outline give the window to read
+            lons = np.linspace(bounds[0], bounds[2], 9)
+            lats = np.linspace(bounds[1], bounds[3], 9)
+            xs = np.concatenate([lons, lons, np.full(9, bounds[0]), np.full(9, bounds[2])])
+            ys = np.concatenate([np.full(9, bounds[1]), np.full(9, bounds[3]), lats, lats])
+            with GCPTransformer(gcps) as transformer:
+                rows, cols = transformer.rowcol(xs, ys)
+            row0 = max(0, int(np.min(rows)) - GRID_MARGIN)
+            col0 = max(0, int(np.min(cols)) - GRID_MARGIN)
+            row1 = min(src.height, int(np.max(rows)) + GRID_MARGIN + 1)
+            col1 = min(src.width, int(np.max(cols)) + GRID_MARGIN + 1)
+            if row0 >= row1 or col0 >= col1:
+                return out, window
+            dn = src.read(1, window=Window(col0, row0, col1 - col0, row1 - row0)).astype(np.float32)
+
+        lines, pixels, values = _parse_calibration(files.read(calibration))
+        lut = _interp_lut(lines, pixels, values, np.arange(row0, row1), np.arange(col0, col1))
+        sigma0 = np.where(dn > 0, dn ** 2 / lut ** 2, np.nan).astype(np.float32)
+        shifted = [GroundControlPoint(row=g.row - row0, col=g.col - col0, x=g.x, y=g.y, z=g.z)
+                   for g in gcps]
+        # Average in linear power, then convert
+        reproject(sigma0, out, gcps=shifted, src_crs=gcp_crs, src_nodata=np.nan,
+                  dst_transform=transform, dst_crs='EPSG:4326', dst_nodata=np.nan,
+                  resampling=Resampling.average)
+        return _to_db(out), window
+
+
+def _safe_scene(path: str) -> Optional[Scene]:
+    files = _SafeFiles(path)
+    manifest = files.find(r'(^|/)manifest\.safe$')
+    if manifest is None:
+        return None
+    root = ET.fromstring(files.read(manifest))
+    if 'GRD' not in _find_text(root, 'productType'):
+        return None
+    points = np.array([pair.split(',') for text in _find_text(root, 'coordinates')
+                       for pair in text.split()], dtype=np.float64)  # lat,lon pairs
+    passes = _find_text(root, 'pass')
+    return Scene(path, 'safe',
+                 date=datetime.fromisoformat(_find_text(root, 'startTime')[0][:19]),
+                 mode=_find_text(root, 'mode')[0],
+                 polarisations=_find_text(root, 'transmitterReceiverPolarisation'),
+                 footprint=(points[:, 1].min(), points[:, 0].min(), points[:, 1].max(), points[:, 0].max()),
+                 orbit_pass=passes[0] if passes else None, units='linear')
+
+
+# 1-based band of `polarisation` in a scene GeoTIFF: by band description or, in a file
+# without descriptions, by its place among the polarisations in the file name
+def _geotiff_band(src, polarisations, polarisation: str) -> int:
+    if polarisation in src.descriptions:
+        return src.descriptions.index(polarisation) + 1
+    if not any(src.descriptions) and len(polarisations) == src.count and polarisation in polarisations:
+        return list(polarisations).index(polarisation) + 1
+    raise ValueError(f"{src.name} has no band for {polarisation}.")
+
+
+def _geotiff_scene(path: str) -> Optional[Scene]:
+    import rasterio
+    from rasterio.warp import transform_bounds
+
+    with rasterio.open(path) as src:
+        if src.crs is None:
+            return None
+        tags = src.tags()
+        descriptions = [d for d in src.descriptions if d]
+        footprint = transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+    name = S1_NAME.search(os.path.basename(path))
+    if 'date' in tags:
+        date = datetime.fromisoformat(tags['date'][:19])
+    elif name:
+        date = datetime.strptime(name['date'] + name['time'], '%Y%m%d%H%M%S')
+    else:
+        return None
+    mode = tags.get('instrumentMode') or (name['mode'] if name else None)
+    polarisations = descriptions or re.findall(r'(?<![A-Z])(VV|VH|HH|HV)(?![A-Z])', os.path.basename(path).upper())
+    return Scene(path, 'geotiff', date, mode, polarisations or ['VV'], footprint,
+                 orbit_pass=tags.get('orbitProperties_pass'), units=tags.get('units', 'dB'))
+
+
+class SceneIndex:
+    """Scenes under a directory, sorted by acquisition date."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.scenes: List[Scene] = []
+        self.skipped: List[str] = []
+        self.scan()
+
+    def scan(self):
+        paths = sorted({p for pattern in SCENE_PATTERNS
+                        for p in glob.glob(os.path.join(self.directory, '**', pattern), recursive=True)})
+        scenes, self.skipped = [], []
+        for path in paths:
+            # GeoTIFFs inside a SAFE product are read through the product
+            if '.SAFE' + os.sep in path:
+                continue
+            try:
+                scene = _safe_scene(path) if path.endswith(('.SAFE', '.zip')) else _geotiff_scene(path)
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                scene = None
+            if scene is None:
+                self.skipped.append(path)
+            else:
+                scenes.append(scene)
+        self.scenes = sorted(scenes, key=lambda s: s.date)
+        self._dates = [s.date for s in self.scenes]
+        print(f"Indexed {len(self.scenes)} scenes in {self.directory}")
+
+    def filter(self, bounds: grid.Bounds, start_date: str, end_date: str,
+               polarisation: str = 'VV', mode: str = 'IW', orbit_pass: Optional[str] = None) -> List[Scene]:
+        """Scenes acquired in [start_date, end_date) that cover part of `bounds`."""
+        first = bisect_left(self._dates, datetime.fromisoformat(start_date))
+        last = bisect_left(self._dates, datetime.fromisoformat(end_date))
+        return [s for s in self.scenes[first:last]
+                if s.mode == mode and polarisation in s.polarisations and s.intersects(bounds)
+                and (orbit_pass is None or s.orbit_pass == orbit_pass)]
+
+
+# (scenes, height, width) dB stack of the scenes over the grid window covering `bounds`
+def read_stack(scenes: List[Scene], bounds: grid.Bounds, scale: float = 10,
+               polarisation: str = 'VV') -> Tuple[np.ndarray, grid.Window]:
+    window = grid.pixel_window(bounds, scale)
+    stack = np.empty((len(scenes),) + grid.window_shape(window), dtype=np.float32)
+    for i, scene in enumerate(scenes):
+        stack[i], _ = scene.read(bounds, scale, polarisation)
+    return stack, window
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Fixed EPSG:4326 pixel grid shared by the mask, planning and storage stages.
+
+Every stage snaps its AOI onto the same global grid so that rasters produced
+for overlapping AOIs line up pixel for pixel and can be reused or sliced.
+"""
+import math
+from typing import Iterator, List, Tuple
+
+METERS_PER_DEGREE = 111320.0
+
+# (min_lon, min_lat, max_lon, max_lat)
+Bounds = Tuple[float, float, float, float]
+# (col0, row0, col1, row1) in global pixel indices, end-exclusive
+Window = Tuple[int, int, int, int]
+
+
+# Size of one pixel in degrees for a scale given in meters
+def degrees_per_pixel(scale: float) -> float:
+    return scale / METERS_PER_DEGREE
+
+
+# Global pixel window covering the bounds (row 0 is at latitude 90)
+def pixel_window(bounds: Bounds, scale: float) -> Window:
+    step = degrees_per_pixel(scale)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    col0 = int(math.floor((min_lon + 180.0) / step))
+    col1 = max(int(math.ceil((max_lon + 180.0) / step)), col0 + 1)
+    row0 = int(math.floor((90.0 - max_lat) / step))
+    row1 = max(int(math.ceil((90.0 - min_lat) / step)), row0 + 1)
+    return col0, row0, col1, row1
+
+
+# Geographic bounds of a global pixel window
+def window_bounds(window: Window, scale: float) -> Bounds:
+    step = degrees_per_pixel(scale)
+    col0, row0, col1, row1 = window
+    return (col0 * step - 180.0, 90.0 - row1 * step,
+            col1 * step - 180.0, 90.0 - row0 * step)
+
+
+# (height, width) of a window
+def window_shape(window: Window) -> Tuple[int, int]:
+    col0, row0, col1, row1 = window
+    return row1 - row0, col1 - col0
+
+
+def window_size(window: Window) -> int:
+    height, width = window_shape(window)
+    return height * width
+
+
+# Overlap of two windows, or None when they do not touch
+def intersect_windows(a: Window, b: Window):
+    col0, row0 = max(a[0], b[0]), max(a[1], b[1])
+    col1, row1 = min(a[2], b[2]), min(a[3], b[3])
+    if col0 >= col1 or row0 >= row1:
+        return None
+    return col0, row0, col1, row1
+
+
+# Smallest window containing all the given windows
+def union_windows(windows: List[Window]) -> Window:
+    return (min(w[0] for w in windows), min(w[1] for w in windows),
+            max(w[2] for w in windows), max(w[3] for w in windows))
+
+
+# Tiles of a fixed-size tiling that intersect a window, as (tile_row, tile_col)
+def tiles_for_window(window: Window, tile_size: int) -> Iterator[Tuple[int, int]]:
+    col0, row0, col1, row1 = window
+    for tile_row in range(row0 // tile_size, (row1 - 1) // tile_size + 1):
+        for tile_col in range(col0 // tile_size, (col1 - 1) // tile_size + 1):
+            yield tile_row, tile_col
+
+
+# Global pixel window of one tile
+def tile_window(tile_row: int, tile_col: int, tile_size: int) -> Window:
+    return (tile_col * tile_size, tile_row * tile_size,
+            (tile_col + 1) * tile_size, (tile_row + 1) * tile_size)
+
+
+# Array slices that select `inner` out of a raster covering `outer`
+def window_slices(inner: Window, outer: Window) -> Tuple[slice, slice]:
+    return (slice(inner[1] - outer[1], inner[3] - outer[1]),
+            slice(inner[0] - outer[0], inner[2] - outer[0]))
+
+
+# Split bounds into a grid of `rows` x `cols` equal sub-rectangles, row-major from the north-west
+def split_bounds(bounds: Bounds, rows: int, cols: int) -> List[Bounds]:
+    rows, cols = max(1, rows), max(1, cols)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    step_lon, step_lat = (max_lon - min_lon) / cols, (max_lat - min_lat) / rows
+    return [(min_lon + c * step_lon, max_lat - (r + 1) * step_lat,
+             min_lon + (c + 1) * step_lon, max_lat - r * step_lat)
+            for r in range(rows) for c in range(cols)]
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Chunked, memory-mapped store of every change raster produced for an AOI.
+
+Layout of a store directory::
+
+    store.json                 metadata, date axis and chunk index
+    chunks/t<block>/<r>_<c>.npy  one (time_chunk, chunk_size, chunk_size) array
+
+Spatial chunks follow the global tiling in ``grid.py``; the time axis is cut
+into blocks of ``time_chunk`` dates. Appending a date writes one slot of the
+newest block only, and queries open just the chunks that cover the pixel or
+region asked for, as read-only memory maps.
+
+Writers that may run at the same time (threads of a coalesced job, queue
+worker processes) open and append inside ``HistoryStore.lock(path)``.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import grid
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+DEFAULT_ROOT = os.path.expanduser(os.path.join('~', '.sar_change', 'history'))
+CHUNK_SIZE = 256
+TIME_CHUNK = 32
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+class HistoryStore:
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.window = tuple(meta['window'])
+        self.scale = meta['scale']
+        self.chunks_read = 0  # chunks opened by queries, for checking locality
+
+    @classmethod
+    def create(cls, path: str, bounds: grid.Bounds, scale: float, band: str = 'change',
+               chunk_size: int = CHUNK_SIZE, time_chunk: int = TIME_CHUNK, dtype: str = 'float32'):
+        if os.path.exists(os.path.join(path, 'store.json')):
+            raise FileExistsError(f"A history store already exists at {path}.")
+        meta = {
+            'band': band,
+            'scale': scale,
+            'window': list(grid.pixel_window(bounds, scale)),
+            'chunk_size': chunk_size,
+            'time_chunk': time_chunk,
+            'dtype': dtype,
+            'dates': [],
+            'index': {},  # time block -> list of "r_c" spatial chunks present
+        }
+        store = cls(path, meta)
+        store._save_meta()
+        return store
+
+    @classmethod
+    def open(cls, path: str):
+        with open(os.path.join(path, 'store.json'), 'r') as f:
+            return cls(path, json.load(f))
+
+    # Open the store at `path`, creating it for the AOI if it does not exist yet
+    @classmethod
+    def open_or_create(cls, path: str, bounds: grid.Bounds, scale: float, **kwargs):
+        if os.path.exists(os.path.join(path, 'store.json')):
+            return cls.open(path)
+        return cls.create(path, bounds, scale, **kwargs)
+
+    # Hold this while opening, creating or appending to the store at `path`
+    @staticmethod
+    @contextmanager
+    def lock(path: str):
+        path = os.path.abspath(path)
+        with _locks_guard:
+            thread_lock = _locks.setdefault(path, threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.lock', 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @property
+    def dates(self) -> List[str]:
+        return list(self.meta['dates'])
+
+    def _save_meta(self):
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, 'store.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _chunk_path(self, block: int, tile_row: int, tile_col: int) -> str:
+        return os.path.join(self.path, 'chunks', f"t{block}", f"{tile_row}_{tile_col}.npy")
+
+    # Spatial chunks covering a window, with the part of the window each one holds
+    def _chunks_for(self, window: grid.Window):
+        size = self.meta['chunk_size']
+        for tile_row, tile_col in grid.tiles_for_window(window, size):
+            tile_win = grid.tile_window(tile_row, tile_col, size)
+            yield tile_row, tile_col, tile_win, grid.intersect_windows(window, tile_win)
+
+    def append(self, date: str, raster: np.ndarray, window: grid.Window = None):
+        """Add the raster for `date` (not before any stored date) to the store.
+
+        Appending the newest date again fills in more of it, e.g. one tile at a time.
+        """
+        dates = self.meta['dates']
+        if dates and date < dates[-1]:
+            raise ValueError(f"Dates must be appended in order; {date} is before {dates[-1]}.")
+        window = tuple(window) if window is not None else self.window
+        if np.shape(raster) != grid.window_shape(window):
+            raise ValueError(f"Raster shape {np.shape(raster)} does not match window {window}.")
+        window = grid.intersect_windows(window, self.window)
+        if window is None:
+            raise ValueError("The raster does not overlap the store's area of interest.")
+
+        new_date = not dates or date != dates[-1]
+        t = len(dates) if new_date else len(dates) - 1
+        block, slot = divmod(t, self.meta['time_chunk'])
+        present = self.meta['index'].setdefault(str(block), [])
+        size, dtype = self.meta['chunk_size'], self.meta['dtype']
+        for tile_row, tile_col, tile_win, overlap in self._chunks_for(window):
+            path = self._chunk_path(block, tile_row, tile_col)
+            key = f"{tile_row}_{tile_col}"
+            if key not in present:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                chunk = np.lib.format.open_memmap(
+                    path, mode='w+', dtype=dtype, shape=(self.meta['time_chunk'], size, size))
+                chunk[:] = np.nan
+                present.append(key)
+            else:
+                chunk = np.load(path, mmap_mode='r+')
+            chunk[(slot,) + grid.window_slices(overlap, tile_win)] = \
+                raster[grid.window_slices(overlap, window)]
+            chunk.flush()
+            del chunk
+        if new_date:
+            dates.append(date)
+        self._save_meta()
+
+    def region_series(self, bounds: grid.Bounds) -> Tuple[List[str], np.ndarray]:
+        """Full time series of a small region: (dates, array of shape (T, H, W))."""
+        window = grid.intersect_windows(grid.pixel_window(bounds, self.scale), self.window)
+        if window is None:
+            raise ValueError("The region is outside the store's area of interest.")
+        dates = self.meta['dates']
+        out = np.full((len(dates),) + grid.window_shape(window), np.nan, dtype=self.meta['dtype'])
+        time_chunk = self.meta['time_chunk']
+        index: Dict[str, list] = self.meta['index']
+        for block in range((len(dates) + time_chunk - 1) // time_chunk):
+            present = index.get(str(block), [])
+            t0, t1 = block * time_chunk, min((block + 1) * time_chunk, len(dates))
+            for tile_row, tile_col, tile_win, overlap in self._chunks_for(window):
+                if f"{tile_row}_{tile_col}" not in present:
+                    continue
+                chunk = np.load(self._chunk_path(block, tile_row, tile_col), mmap_mode='r')
+                self.chunks_read += 1
+                out[(slice(t0, t1),) + grid.window_slices(overlap, window)] = \
+                    chunk[(slice(0, t1 - t0),) + grid.window_slices(overlap, tile_win)]
+        return list(dates), out
+
+    def pixel_series(self, lon: float, lat: float) -> Tuple[List[str], np.ndarray]:
+        """Full time series of the pixel containing (lon, lat)."""
+        dates, values = self.region_series((lon, lat, lon, lat))
+        return dates, values[:, 0, 0]
+
+    # Append a GeoTIFF exported by the pipeline, resampled onto the store's grid
+    # (reprojected to EPSG:4326 first if need be). `band` is a 1-based index or a
+    # band name such as 'VV_change', looked up in the band descriptions or, for a
+    # file without them, in `band_names` (the bands in file order). Returns False,
+    # adding nothing, if the GeoTIFF lies outside the store's area of interest.
+    def append_geotiff(self, date: str, tiff_file: str, band=1, band_names=None) -> bool:
+        import rasterio
+        from rasterio.crs import CRS
+        from rasterio.enums import Resampling
+        from rasterio.vrt import WarpedVRT
+
+        with rasterio.open(tiff_file) as src:
+            if src.crs is None:
+                raise ValueError(f"{tiff_file} has no coordinate reference system.")
+            if isinstance(band, str):
+                if band in src.descriptions:
+                    band = src.descriptions.index(band) + 1
+                elif (not any(src.descriptions) and band_names and len(band_names) == src.count
+                      and band in band_names):
+                    band = list(band_names).index(band) + 1
+                else:
+                    raise ValueError(f"{tiff_file} has no band named {band!r}.")
+            if src.crs != CRS.from_epsg(4326):
+                with WarpedVRT(src, crs=CRS.from_epsg(4326), resampling=Resampling.nearest) as vrt:
+                    return self._append_dataset(date, vrt, band)
+            return self._append_dataset(date, src, band)
+
+    def _append_dataset(self, date, dataset, band) -> bool:
+        from rasterio.enums import Resampling
+
+        window = grid.pixel_window(tuple(dataset.bounds), self.scale)
+        if grid.intersect_windows(window, self.window) is None:
+            return False
+        raster = dataset.read(band, out_shape=grid.window_shape(window),
+                              resampling=Resampling.nearest, masked=True)
+        self.append(date, raster.filled(np.nan).astype(self.meta['dtype']), window)
+        return True
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+"""Durable SQLite job queue with a pool of worker processes.
+
+The web app submits change jobs here instead of running them inline.
+Worker processes claim the highest-priority queued job, report progress
+while it runs and store its result, so any client can ask for status.
+Jobs survive restarts: a worker renews a lease on the jobs it runs every
+``HEARTBEAT_INTERVAL`` seconds, and a job whose lease has not been renewed
+for ``LEASE_TIMEOUT`` seconds is requeued (or cancelled, if a cancel was
+asked for) the next time a pool starts or a worker claims. A job whose params include ``"profile": true`` is
+profiled stage by stage (see profiling.py) and its result names the report.
+A handler result with ``"state": "SKIPPED"`` (e.g. an AOI that is all water)
+ends the job as 'skipped', with the reason as its error.
+With ``"policy": {...}`` (planner.CostPolicy fields) it is planned under
+that policy, e.g. the one the submitting app planned it with.
+
+A handler may also offer ``run_group`` and ``matches``: a worker then
+claims, together with the job it takes, up to ``GROUP_LIMIT`` - 1 queued
+jobs that ``matches`` pairs with it, and runs them as one group. The
+default change-job handler uses this to coalesce overlapping requests
+(see coalescing.py) so they share one computation.
+
+    python job_queue.py workers --count 4
+    python job_queue.py submit '{"bounds": [30.5, 49.5, 30.6, 49.6], ...}' --priority 5
+    python job_queue.py status 12
+    python job_queue.py cancel 12
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import List, Optional
+
+import profiling
+
+DEFAULT_QUEUE_PATH = os.path.expanduser(os.path.join('~', '.sar_change', 'queue.sqlite'))
+DEFAULT_HANDLER = 'job_queue:run_change_job'
+STATUSES = ('queued', 'running', 'done', 'skipped', 'failed', 'cancelled')
+GROUP_LIMIT = 16  # jobs one worker runs as a coalesced group
+GROUP_SCAN = 200  # queued jobs looked at for a group
+HEARTBEAT_INTERVAL = 10  # seconds between a worker's lease renewals
+LEASE_TIMEOUT = 120  # seconds without a renewal before a running job counts as orphaned
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    params TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, id);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+            columns = {row['name'] for row in db.execute('PRAGMA table_info(jobs)')}
+            if 'heartbeat' not in columns:  # queue files from before leases
+                db.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.row_factory = sqlite3.Row
+        return db
+
+    def submit(self, params: dict, priority: int = 0) -> int:
+        with closing(self._connect()) as db:
+            cursor = db.execute('INSERT INTO jobs (params, priority, created) VALUES (?, ?, ?)',
+                                (json.dumps(params), priority, time.time()))
+            return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Atomically take the highest-priority queued job, or None if there is none."""
+        jobs = self.claim_group(worker)
+        return jobs[0] if jobs else None
+
+    def claim_group(self, worker: str, matches=None, limit: int = 1) -> List[dict]:
+        """Atomically take the highest-priority queued job and up to `limit` - 1 more
+        for which ``matches(first_params, params)`` is true; [] if none is queued."""
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            self._release_expired(db, now)
+            rows = db.execute("SELECT id, params FROM jobs WHERE status = 'queued' "
+                              "ORDER BY priority DESC, id LIMIT ?",
+                              (1 if matches is None or limit <= 1 else GROUP_SCAN,)).fetchall()
+            jobs = []
+            for row in rows:
+                params = json.loads(row['params'])
+                if not jobs or matches(jobs[0]['params'], params):
+                    jobs.append({'id': row['id'], 'params': params})
+                if len(jobs) >= limit:
+                    break
+            db.executemany("UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ? "
+                           "WHERE id = ?", [(worker, now, now, job['id']) for job in jobs])
+            db.execute('COMMIT')
+            return jobs
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+    # Renew the lease of running jobs, so they are not taken for orphans
+    def heartbeat(self, job_ids: List[int]):
+        with closing(self._connect()) as db:
+            db.executemany("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running'",
+                           [(time.time(), job_id) for job_id in job_ids])
+
+    def update_progress(self, job_id: int, progress: float, message: str = None):
+        with closing(self._connect()) as db:
+            db.execute('UPDATE jobs SET progress = ?, message = ? WHERE id = ?',
+                       (progress, message, job_id))
+
+    def finish(self, job_id: int, status: str, result=None, error: str = None):
+        with closing(self._connect()) as db:
+            db.execute('UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, '
+                       'progress = CASE WHEN ? IN (\'done\', \'skipped\') THEN 1 ELSE progress END '
+                       'WHERE id = ?',
+                       (status, json.dumps(result, default=str) if result is not None else None,
+                        error, time.time(), status, job_id))
+
+    def cancel(self, job_id: int) -> str:
+        """Cancel a queued job at once; ask a running one to stop. Returns the job's status."""
+        with closing(self._connect()) as db:
+            db.execute("UPDATE jobs SET status = 'cancelled', finished = ? "
+                       "WHERE id = ? AND status = 'queued'", (time.time(), job_id))
+            db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                       (job_id,))
+        return self.status(job_id)['status']
+
+    def cancel_requested(self, job_id: int) -> bool:
+        with closing(self._connect()) as db:
+            row = db.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def status(self, job_id: int) -> Optional[dict]:
+        with closing(self._connect()) as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def counts(self) -> dict:
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({row['status']: row['n'] for row in rows})
+        return counts
+
+    # Put jobs left 'running' by workers that stopped renewing their lease back in the queue
+    def requeue_orphans(self) -> int:
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            requeued = self._release_expired(db, time.time())
+            db.execute('COMMIT')
+        return requeued
+
+    # Orphaned running jobs are cancelled if a cancel was asked for and requeued,
+    # with a clean cancel flag, otherwise. Returns how many were requeued.
+    @staticmethod
+    def _release_expired(db, now: float) -> int:
+        expired = now - LEASE_TIMEOUT
+        db.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE status = 'running' "
+                   "AND COALESCE(heartbeat, started, 0) < ? AND cancel_requested = 1", (now, expired))
+        return db.execute("UPDATE jobs SET status = 'queued', worker = NULL, cancel_requested = 0 "
+                          "WHERE status = 'running' AND COALESCE(heartbeat, started, 0) < ?",
+                          (expired,)).rowcount
+
+
+# Renew the lease on `job_ids` every HEARTBEAT_INTERVAL seconds while the block runs
+@contextmanager
+def _lease(queue: JobQueue, job_ids: List[int]):
+    done = threading.Event()
+
+    def renew():
+        while not done.wait(HEARTBEAT_INTERVAL):
+            queue.heartbeat(job_ids)
+
+    thread = threading.Thread(target=renew, name='job-lease', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+# Import a handler given as 'module:function'
+def load_handler(spec: str):
+    module_name, function_name = spec.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+# ChangeJob from queued params (JSON lists back to tuples)
+def change_job(params: dict):
+    import pipeline
+
+    return pipeline.ChangeJob(**{key: tuple(value) if isinstance(value, list) else value
+                                 for key, value in params.items() if key not in ('profile', 'policy')})
+
+
+# The CostPolicy a job was submitted with, or None for the planner's default
+def cost_policy(params: dict):
+    import planner
+
+    return planner.CostPolicy(**params['policy']) if params.get('policy') else None
+
+
+def _planned(job, policy=None):
+    import pipeline
+    import planner
+
+    plan = planner.plan(job.bounds, job.baseline, job.comparison, scale=job.scale,
+                        polarisations=job.polarisations, orbit_split=job.orbit_split, policy=policy)
+    return pipeline.job_from_plan(job, plan)
+
+
+# Default handler: plan and run one change job against Earth Engine
+def run_change_job(params: dict, progress) -> dict:
+    import ee
+    import history_store
+    from backend import EarthEngineBackend
+    from checkpoint import DEFAULT_CHECKPOINT_DIR
+
+    ee.Initialize()
+    job = change_job(params)
+    progress(0.05, 'planning')
+    return run_pipeline_job(EarthEngineBackend(), _planned(job, cost_policy(params)), progress,
+                            DEFAULT_CHECKPOINT_DIR, history_root=history_store.DEFAULT_ROOT)
+
+
+# Queued change jobs worth claiming together: same dates, parameters and cost
+# policy, overlapping AOIs
+def change_jobs_match(first: dict, params: dict) -> bool:
+    import grid
+    from coalescing import coalesce_key
+
+    if first.get('policy') != params.get('policy'):
+        return False
+    try:
+        a, b = change_job(first), change_job(params)
+    except TypeError:
+        return False
+    return coalesce_key(a) == coalesce_key(b) and grid.intersect_windows(
+        grid.pixel_window(a.bounds, a.scale), grid.pixel_window(b.bounds, b.scale)) is not None
+
+
+# Group handler: plan each job, then run them through one Coalescer so overlapping
+# AOIs share a computation. Returns a result or an exception per job. Matched jobs
+# share a cost policy.
+def run_change_jobs(params_list: List[dict], progresses: list) -> list:
+    import ee
+    import history_store
+    from backend import EarthEngineBackend
+    from checkpoint import DEFAULT_CHECKPOINT_DIR
+
+    ee.Initialize()
+    return run_coalesced_jobs(EarthEngineBackend(), [change_job(p) for p in params_list], progresses,
+                              DEFAULT_CHECKPOINT_DIR, history_root=history_store.DEFAULT_ROOT,
+                              policy=cost_policy(params_list[0]))
+
+
+run_change_job.run_group = run_change_jobs
+run_change_job.matches = change_jobs_match
+
+STAGE_PROGRESS = {'mask': 0.1, 'composite': 0.3, 'export': 0.6, 'done': 1.0}
+
+
+# A pipeline result as a job result; a skipped job keeps its reason as 'error'
+def _job_result(result: dict) -> dict:
+    if result['error'] and result['state'] != 'SKIPPED':
+        raise RuntimeError(result['error'])
+    return {key: result.get(key) for key in ('state', 'stage', 'bands', 'task_id', 'outputs', 'history',
+                                             'error', 'elapsed')}
+
+
+# Store a handler's result as 'done', or as 'skipped' if there was nothing to do
+def _finish_result(queue, job_id, result):
+    if isinstance(result, dict) and result.get('state') == 'SKIPPED':
+        queue.finish(job_id, 'skipped', result=result, error=result.get('error'))
+    else:
+        queue.finish(job_id, 'done', result=result)
+
+
+# Run a ChangeJob through the pipeline, turning its stages into progress updates.
+# A worker's progress callback carries `cancel_requested`, which the pipeline also
+# checks while it waits on an export, so a cancel does not wait for the next stage.
+def run_pipeline_job(backend, job, progress, checkpoint_dir=None, poll_interval=None,
+                     history_root=None) -> dict:
+    import pipeline
+
+    # The worker loop already profiles the job through its progress messages
+    result = pipeline.run_job_sync(
+        backend, job, poll_interval=poll_interval or pipeline.POLL_INTERVAL,
+        checkpoint_dir=checkpoint_dir,
+        on_stage=lambda stage: progress(STAGE_PROGRESS[stage], stage), profile=False,
+        should_cancel=getattr(progress, 'cancel_requested', None), history_root=history_root)
+    return _job_result(result)
+
+
+# Plan ChangeJobs under `policy` and run them through one Coalescer; a result or an
+# exception per job
+def run_coalesced_jobs(backend, jobs, progresses, checkpoint_dir=None, poll_interval=None,
+                       history_root=None, policy=None) -> list:
+    import asyncio
+
+    import pipeline
+    from coalescing import Coalescer
+
+    async def run_one(coalescer, job, progress):
+        progress(0.05, 'planning')
+        result = await coalescer.submit(
+            _planned(job, policy), on_stage=lambda stage: progress(STAGE_PROGRESS[stage], stage),
+            should_cancel=getattr(progress, 'cancel_requested', None))
+        return _job_result(result)
+
+    async def run_all():
+        # Every job is known up front, so groups need not wait for more to arrive
+        coalescer = Coalescer(backend, window=0, policy=policy,
+                              poll_interval=poll_interval or pipeline.POLL_INTERVAL,
+                              checkpoint_dir=checkpoint_dir, profile=False, history_root=history_root)
+        results = await asyncio.gather(*(run_one(coalescer, job, progress)
+                                         for job, progress in zip(jobs, progresses)),
+                                       return_exceptions=True)
+        report = coalescer.report()
+        print(f"Coalescing: {report['requests']} queued jobs ran as {report['computations']} computation(s).")
+        return results
+
+    return asyncio.run(run_all())
+
+
+def _worker_loop(queue_path, handler_spec, stop, poll_interval):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when workers stop
+    worker_name = str(os.getpid())
+    queue = JobQueue(queue_path)
+    handler = load_handler(handler_spec)
+    run_group = getattr(handler, 'run_group', None)
+    while not stop.is_set():
+        if run_group is not None:
+            jobs = queue.claim_group(worker_name, handler.matches, GROUP_LIMIT)
+        else:
+            jobs = queue.claim_group(worker_name)
+        if not jobs:
+            stop.wait(poll_interval)
+            continue
+        if len(jobs) > 1:
+            with _lease(queue, [job['id'] for job in jobs]):
+                _run_job_group(queue, run_group, jobs)
+            continue
+        job = jobs[0]
+        job_id = job['id']
+        params = dict(job['params'])
+        profiler = profiling.profiler(f"queue_job_{job_id}", params.pop('profile', None))
+
+        def progress(fraction, message=None):
+            if queue.cancel_requested(job_id):
+                raise JobCancelled(f"Job {job_id} was cancelled.")
+            if message:
+                profiler.mark(message)
+            queue.update_progress(job_id, fraction, message)
+
+        progress.cancel_requested = lambda: queue.cancel_requested(job_id)
+
+        try:
+            profiler.mark('start')
+            with _lease(queue, [job_id]):
+                result = handler(params, progress)
+        except Exception as e:
+            profiler.finish(state='failed', error=str(e))
+            if isinstance(e, JobCancelled) or queue.cancel_requested(job_id):
+                queue.finish(job_id, 'cancelled', error=str(e))
+            else:
+                queue.finish(job_id, 'failed', error=f"{type(e).__name__}: {e}")
+            continue
+        report = profiler.finish(state='done')
+        if report and isinstance(result, dict):
+            result = dict(result, profile=report)
+        _finish_result(queue, job_id, result)
+
+
+# Run claimed jobs as one group; each job still gets its own progress, status and result
+def _run_job_group(queue, run_group, jobs):
+    ids = [job['id'] for job in jobs]
+    params = [dict(job['params']) for job in jobs]
+    requested = [p.pop('profile', None) for p in params]
+    profiler = profiling.profiler(f"queue_group_{ids[0]}_{len(ids)}", True if True in requested else None)
+
+    def progress_for(job_id):
+        def progress(fraction, message=None):
+            if message and job_id == ids[0]:
+                profiler.mark(message)
+            queue.update_progress(job_id, fraction, message)
+        progress.cancel_requested = lambda: queue.cancel_requested(job_id)
+        return progress
+
+    try:
+        profiler.mark('start')
+        results = run_group(params, [progress_for(job_id) for job_id in ids])
+    except Exception as e:
+        results = [e] * len(ids)
+    failed = any(isinstance(result, Exception) for result in results)
+    report = profiler.finish(state='failed' if failed else 'done', jobs=ids)
+    for job_id, result in zip(ids, results):
+        if queue.cancel_requested(job_id):
+            queue.finish(job_id, 'cancelled', error=f"Job {job_id} was cancelled.")
+        elif isinstance(result, Exception):
+            queue.finish(job_id, 'failed', error=f"{type(result).__name__}: {result}")
+        else:
+            if report and isinstance(result, dict):
+                result = dict(result, profile=report)
+            _finish_result(queue, job_id, result)
+
+
+class WorkerPool:
+    def __init__(self, queue_path: str = DEFAULT_QUEUE_PATH, workers: int = None,
+                 handler: str = DEFAULT_HANDLER, poll_interval: float = 0.5):
+        self.queue_path = queue_path
+        self.workers = workers or os.cpu_count() or 1
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self._stop = multiprocessing.Event()
+        self._processes = []
+
+    def start(self):
+        requeued = JobQueue(self.queue_path).requeue_orphans()
+        if requeued:
+            print(f"Requeued {requeued} job(s) left running by a previous pool.")
+        for i in range(self.workers):
+            process = multiprocessing.Process(
+                target=_worker_loop, name=f"sar-worker-{i}",
+                args=(self.queue_path, self.handler, self._stop, self.poll_interval))
+            process.start()
+            self._processes.append(process)
+        return self
+
+    # Wait until no job is queued or running
+    def drain(self, check_interval: float = 0.2):
+        queue = JobQueue(self.queue_path)
+        while True:
+            counts = queue.counts()
+            if counts['queued'] == 0 and counts['running'] == 0:
+                return
+            time.sleep(check_interval)
+
+    def shutdown(self, drain: bool = False):
+        """Stop the workers once their current job is finished (after the queue empties if `drain`)."""
+        if drain:
+            self.drain()
+        self._stop.set()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SAR change-detection job queue')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help='SQLite queue file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    workers = commands.add_parser('workers', help='run a worker pool until interrupted')
+    workers.add_argument('--count', type=int, default=None)
+    workers.add_argument('--handler', default=DEFAULT_HANDLER)
+    submit = commands.add_parser('submit', help='queue a job given as JSON ChangeJob fields')
+    submit.add_argument('params')
+    submit.add_argument('--priority', type=int, default=0)
+    for name in ('status', 'cancel'):
+        commands.add_parser(name).add_argument('job_id', type=int)
+    commands.add_parser('counts')
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue)
+    if args.command == 'workers':
+        pool = WorkerPool(args.queue, args.count, args.handler).start()
+        print(f"{pool.workers} worker(s) running. Press Ctrl+C to stop after the current jobs.")
+        try:
+            signal.pause() if hasattr(signal, 'pause') else pool.drain()
+        except KeyboardInterrupt:
+            pass
+        pool.shutdown()
+    elif args.command == 'submit':
+        print(queue.submit(json.loads(args.params), args.priority))
+    elif args.command == 'status':
+        print(json.dumps(queue.status(args.job_id), indent=2, default=str))
+    elif args.command == 'cancel':
+        print(queue.cancel(args.job_id))
+    else:
+        print(json.dumps(queue.counts(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Load-test the job queue: hundreds of synthetic jobs against the local stand-in.
+
+Each job runs the real pipeline against StandInBackend, so the workers
+spend their time waiting on simulated service latency the same way they
+would on Earth Engine. Throughput is measured for each worker count:
+
+    python loadtest_queue.py --jobs 300 --workers 1 2 4 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from job_queue import JobQueue, WorkerPool, run_pipeline_job
+
+LATENCY = float(os.environ.get('LOADTEST_LATENCY', '0.02'))
+EXPORT_TIME = float(os.environ.get('LOADTEST_EXPORT_TIME', '0.1'))
+
+
+# Queue handler: one synthetic job through the pipeline on the stand-in backend
+def standin_job(params: dict, progress) -> dict:
+    import pipeline
+    from standin_backend import StandInBackend
+
+    job = pipeline.ChangeJob(bounds=tuple(params['bounds']), baseline=tuple(params['baseline']),
+                             comparison=tuple(params['comparison']),
+                             description=params['description'])
+    backend = StandInBackend(latency=LATENCY, export_time=EXPORT_TIME)
+    return run_pipeline_job(backend, job, progress, poll_interval=EXPORT_TIME / 2)
+
+
+def synthetic_params(i: int) -> dict:
+    lon, lat = random.uniform(68, 97), random.uniform(8, 37)
+    return {'bounds': [lon, lat, lon + 0.1, lat + 0.1],
+            'baseline': ['2023-01-01', '2023-01-31'],
+            'comparison': ['2023-02-01', '2023-02-28'],
+            'description': f"loadtest_{i}"}
+
+
+def run_once(jobs: int, workers: int) -> dict:
+    queue_path = os.path.join(tempfile.mkdtemp(prefix='sar_queue_'), 'queue.sqlite')
+    queue = JobQueue(queue_path)
+    ids = [queue.submit(synthetic_params(i), priority=random.randint(0, 9)) for i in range(jobs)]
+    # Cancel a few queued jobs to exercise that path too
+    for job_id in random.sample(ids, max(1, jobs // 50)):
+        queue.cancel(job_id)
+
+    started = time.monotonic()
+    pool = WorkerPool(queue_path, workers=workers, handler='loadtest_queue:standin_job',
+                      poll_interval=0.05).start()
+    pool.shutdown(drain=True)
+    elapsed = time.monotonic() - started
+    counts = queue.counts()
+    return {'workers': workers, 'elapsed': elapsed, 'jobs_per_s': counts['done'] / elapsed, **counts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=300)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        stats = run_once(args.jobs, workers)
+        baseline = baseline or stats['jobs_per_s']
+        print(f"{workers:>2} worker(s): {stats['done']} done, {stats['failed']} failed, "
+              f"{stats['cancelled']} cancelled in {stats['elapsed']:.1f} s -> "
+              f"{stats['jobs_per_s']:.1f} jobs/s ({stats['jobs_per_s'] / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Local (numpy) version of the composite -> difference -> threshold path.
+
+Mirrors ``EarthEngineBackend.composite`` / ``difference``: a per-pixel
+median over each period's scenes, comparison minus baseline per band, and
+``change > threshold``. Stacks are (scenes, bands, height, width) in dB and
+are processed in square tiles, so the working set is one tile of each
+stack; with ``workers > 1`` tiles are spread over a process pool that
+reads the stacks from ``.npy`` memmaps instead of pickling them.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+
+import grid
+
+TILE_SIZE = 512
+
+
+# Per-pixel median over the scene axis; NaN marks missing data
+def composite(stack: np.ndarray) -> np.ndarray:
+    if np.isnan(stack).any():
+        return np.nanmedian(stack, axis=0)
+    return np.median(stack, axis=0)
+
+
+def difference(baseline: np.ndarray, comparison: np.ndarray, threshold: float):
+    change = composite(comparison) - composite(baseline)
+    return change, change > threshold
+
+
+# Tile of both stacks -> (change, significant); water pixels become NaN / False
+def _detect_window(baseline, comparison, window: grid.Window, threshold, water=None):
+    col0, row0, col1, row1 = window
+    region = (slice(None), slice(None), slice(row0, row1), slice(col0, col1))
+    change, significant = difference(baseline[region], comparison[region], threshold)
+    if water is not None:
+        tile_water = water[row0:row1, col0:col1]
+        change[:, tile_water] = np.nan
+        significant[:, tile_water] = False
+    return change.astype(np.float32), significant
+
+
+def _detect_from_files(baseline_path, comparison_path, water_path, window, threshold):
+    baseline = np.load(baseline_path, mmap_mode='r')
+    comparison = np.load(comparison_path, mmap_mode='r')
+    water = np.load(water_path, mmap_mode='r') if water_path else None
+    return window, _detect_window(baseline, comparison, window, threshold, water)
+
+
+# Path of an .npy file holding `array`: its own file if it is a memmap of one
+def _as_file(array, directory, name):
+    filename = getattr(array, 'filename', None)
+    if filename and filename.endswith('.npy') and array.offset == 128 and array.flags.c_contiguous:
+        return filename
+    path = os.path.join(directory, f"{name}.npy")
+    np.save(path, array)
+    return path
+
+
+def detect_change(baseline: np.ndarray, comparison: np.ndarray, threshold: float,
+                  water: Optional[np.ndarray] = None, workers: int = 1,
+                  tile_size: int = TILE_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Return ``(change, significant)``, each (bands, height, width)."""
+    if baseline.shape[1:] != comparison.shape[1:]:
+        raise ValueError(f"Stack shapes differ: {baseline.shape} vs {comparison.shape}.")
+    _, bands, height, width = baseline.shape
+    change = np.empty((bands, height, width), dtype=np.float32)
+    significant = np.empty((bands, height, width), dtype=bool)
+    full = (0, 0, width, height)
+    windows = [grid.intersect_windows(grid.tile_window(row, col, tile_size), full)
+               for row, col in grid.tiles_for_window(full, tile_size)]
+
+    def store(window, result):
+        col0, row0, col1, row1 = window
+        change[:, row0:row1, col0:col1], significant[:, row0:row1, col0:col1] = result
+
+    if workers <= 1:
+        for window in windows:
+            store(window, _detect_window(baseline, comparison, window, threshold, water))
+        return change, significant
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = (_as_file(baseline, tmp, 'baseline'), _as_file(comparison, tmp, 'comparison'),
+                 _as_file(water, tmp, 'water') if water is not None else None)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_detect_from_files, *paths, window, threshold) for window in windows]
+            for future in futures:
+                store(*future.result())
+    return change, significant
+
+
+# Confusion-matrix scores of a detection against a ground-truth mask
+def accuracy(detected: np.ndarray, truth: np.ndarray, valid: Optional[np.ndarray] = None) -> dict:
+    if valid is not None:
+        detected, truth = detected[valid], truth[valid]
+    tp = int(np.count_nonzero(detected & truth))
+    fp = int(np.count_nonzero(detected & ~truth))
+    fn = int(np.count_nonzero(~detected & truth))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': round(precision, 4), 'recall': round(recall, 4), 'f1': round(f1, 4),
+            'iou': round(tp / (tp + fp + fn), 4) if tp + fp + fn else 0.0}
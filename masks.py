@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Water / land masks for the change pipeline, cached as bit-packed tiles.
+
+Two methods are supported, matching the scripts in this repo:
+
+* ``vv_threshold`` - Sentinel-1 VV median below -16 dB is water
+  (``best_baby_javascript.js``). Depends on the date range it was built from.
+* ``modis`` - MODIS MCD12Q1 ``LC_Type1`` water class
+  (the land mask in ``semi_final_wab_app.py``).
+
+Masks are fetched per tile of the global grid in ``grid.py`` and stored in
+the tile encoding of ``packed_mask.py`` (empty / full / runs / bits), so a
+later run over the same or an overlapping AOI only computes the tiles it
+has not seen before. The cache directory is versioned by tile format
+(``CACHE_FORMAT``): tiles of an older format are not read, only recomputed.
+"""
+import os
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+import grid
+import packed_mask
+
+MASK_METHODS = ('vv_threshold', 'modis')
+VV_WATER_THRESHOLD = -16
+MODIS_LAND_COVER = 'MODIS/006/MCD12Q1/2018_01_01'
+MODIS_WATER_CLASS = 17  # IGBP class 17 is 'Water Bodies'
+MASK_SCALE = 100  # meters; masks are much coarser than the 10 m change product
+TILE_SIZE = 512
+DEFAULT_CACHE_DIR = os.path.expanduser(os.path.join('~', '.sar_change', 'masks'))
+CACHE_FORMAT = 2  # 1: plain np.packbits tiles; 2: packed_mask tile encoding
+
+
+# Earth Engine image that is 1 over water and 0 elsewhere
+def water_mask_image(method: str, geometry, dates: Optional[Tuple[str, str]] = None):
+    import ee
+
+    if method == 'vv_threshold':
+        if not dates:
+            raise ValueError("The vv_threshold mask needs a (start_date, end_date) range.")
+        vv = (ee.ImageCollection('COPERNICUS/S1_GRD')
+              .filterBounds(geometry)
+              .filterDate(dates[0], dates[1])
+              .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+              .filter(ee.Filter.eq('instrumentMode', 'IW'))
+              .select('VV')
+              .median())
+        water = vv.lt(VV_WATER_THRESHOLD)
+    elif method == 'modis':
+        water = ee.Image(MODIS_LAND_COVER).select('LC_Type1').eq(MODIS_WATER_CLASS)
+    else:
+        raise ValueError(f"Unknown mask method {method!r}, expected one of {MASK_METHODS}.")
+    return water.unmask(0).toByte().rename('water')
+
+
+# Fetch one grid tile of the mask from Earth Engine as a boolean array
+def fetch_tile_from_ee(method: str, dates, scale: float, tile_row: int, tile_col: int) -> np.ndarray:
+    import ee
+
+    col0, row0, col1, row1 = grid.tile_window(tile_row, tile_col, TILE_SIZE)
+    min_lon, min_lat, max_lon, max_lat = grid.window_bounds((col0, row0, col1, row1), scale)
+    step = grid.degrees_per_pixel(scale)
+    region = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
+    pixels = ee.data.computePixels({
+        'expression': water_mask_image(method, region, dates),
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': {
+            'dimensions': {'width': TILE_SIZE, 'height': TILE_SIZE},
+            'affineTransform': {
+                'scaleX': step, 'shearX': 0, 'translateX': min_lon,
+                'shearY': 0, 'scaleY': -step, 'translateY': max_lat,
+            },
+            'crsCode': 'EPSG:4326',
+        },
+    })
+    return np.asarray(pixels['water'], dtype=bool)
+
+
+# Directory holding the tiles of one mask variant in the current tile format
+def _variant_dir(cache_dir: str, method: str, dates, scale: float) -> str:
+    variant = method if method != 'vv_threshold' else f"{method}_{dates[0]}_{dates[1]}"
+    return os.path.join(cache_dir, f"v{CACHE_FORMAT}", variant, f"{scale:g}m")
+
+
+def _tile_path(variant_dir: str, tile_row: int, tile_col: int) -> str:
+    return os.path.join(variant_dir, f"{tile_row}_{tile_col}.npy")
+
+
+# Store a tile in its packed_mask encoding; written atomically so readers never see half a tile
+def save_tile(path: str, tile: np.ndarray) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = packed_mask.tile_to_bytes(*packed_mask.encode_tile(tile))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.frombuffer(data, dtype=np.uint8))
+    os.replace(tmp_path, path)
+
+
+def load_tile(path: str) -> np.ndarray:
+    data = np.load(path)
+    return packed_mask.decode_tile(*packed_mask.tile_from_bytes(data.tobytes()), (TILE_SIZE, TILE_SIZE))
+
+
+# Water mask for an AOI, reusing every cached tile and computing only the missing ones
+def load_or_compute_mask(bounds: grid.Bounds, method: str = 'modis', dates=None,
+                         scale: float = MASK_SCALE, cache_dir: str = DEFAULT_CACHE_DIR,
+                         fetch_tile: Optional[Callable] = None) -> Tuple[np.ndarray, grid.Window]:
+    """Return ``(water, window)``: a boolean array (True = masked) and its grid window."""
+    if method not in MASK_METHODS:
+        raise ValueError(f"Unknown mask method {method!r}, expected one of {MASK_METHODS}.")
+    fetch_tile = fetch_tile or fetch_tile_from_ee
+    window = grid.pixel_window(bounds, scale)
+    variant_dir = _variant_dir(cache_dir, method, dates, scale)
+    water = np.zeros(grid.window_shape(window), dtype=bool)
+
+    computed = 0
+    for tile_row, tile_col in grid.tiles_for_window(window, TILE_SIZE):
+        path = _tile_path(variant_dir, tile_row, tile_col)
+        if os.path.exists(path):
+            tile = load_tile(path)
+        else:
+            tile = fetch_tile(method, dates, scale, tile_row, tile_col)
+            save_tile(path, tile)
+            computed += 1
+        tile_win = grid.tile_window(tile_row, tile_col, TILE_SIZE)
+        overlap = grid.intersect_windows(window, tile_win)
+        water[grid.window_slices(overlap, window)] = tile[grid.window_slices(overlap, tile_win)]
+
+    print(f"Mask '{method}' at {scale:g} m: {computed} tile(s) computed, "
+          f"{water.mean():.1%} of the AOI masked.")
+    return water, window
+
+
+# Bounds of the unmasked part of the AOI, or None if everything is masked
+def valid_bounds(water: np.ndarray, window: grid.Window, scale: float) -> Optional[grid.Bounds]:
+    rows = np.flatnonzero(~water.all(axis=1))
+    cols = np.flatnonzero(~water.all(axis=0))
+    if rows.size == 0:
+        return None
+    col0, row0 = window[0], window[1]
+    inner = (col0 + cols[0], row0 + rows[0], col0 + cols[-1] + 1, row0 + rows[-1] + 1)
+    return grid.window_bounds(inner, scale)
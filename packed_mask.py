@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Compact boolean masks: per-tile bit packing with run-length encoding.
+
+A mask is cut into square tiles (edge tiles are smaller) and each tile is
+stored in whichever of these forms is smallest:
+
+* ``EMPTY`` / ``FULL`` - no payload;
+* ``RUNS`` - uint32 boundaries ``[start0, end0, start1, end1, ...]`` of the
+  True runs in the flattened tile, for sparse or blocky tiles;
+* ``BITS`` - ``np.packbits`` of the flattened tile, one bit per pixel.
+
+So a mask never costs more than 1/8 of a bool array (plus a few bytes per
+tile), and sparse significance or water masks cost far less. AND, OR, NOT,
+``apply_water`` and ``count`` work tile by tile on the packed forms: empty
+and full tiles short-circuit, runs are combined as sorted interval events
+and bit tiles with byte-wise numpy ops, so nothing is unpacked to one byte
+per pixel.
+"""
+import io
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+EMPTY, FULL, RUNS, BITS = 0, 1, 2, 3
+TILE_SIZE = 256
+_ZERO = np.zeros(1, dtype=np.uint32)
+
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(bits: np.ndarray) -> int:
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+else:  # numpy < 2.0
+    def _popcount(bits: np.ndarray) -> int:
+        return int(np.unpackbits(bits).sum(dtype=np.int64))
+
+
+# Clear the padding bits np.packbits adds after the last of `n` pixels
+def _clear_padding(bits: np.ndarray, n: int) -> np.ndarray:
+    if n % 8:
+        bits[-1] &= (0xFF << (8 - n % 8)) & 0xFF
+    return bits
+
+
+def _runs_to_bits(runs: np.ndarray, n: int) -> np.ndarray:
+    return np.packbits(_decode_runs(runs, n))
+
+
+# Alternating False / True runs between the boundaries, expanded with np.repeat
+def _decode_runs(runs: np.ndarray, n: int) -> np.ndarray:
+    lengths = np.diff(np.concatenate([_ZERO, runs, np.array([n], dtype=np.uint32)]).astype(np.int64))
+    values = np.zeros(len(lengths), dtype=bool)
+    values[1::2] = True
+    return np.repeat(values, lengths)
+
+
+# Runs where at least `need` of the two run lists are True, via sorted +1/-1 events
+def _combine_runs(a: np.ndarray, b: np.ndarray, need: int) -> np.ndarray:
+    positions = np.concatenate([a[0::2], b[0::2], a[1::2], b[1::2]])
+    deltas = np.concatenate([np.ones(len(a) // 2 + len(b) // 2, dtype=np.int8),
+                             -np.ones(len(a) // 2 + len(b) // 2, dtype=np.int8)])
+    # At a shared position an AND closes before it opens and an OR opens before it closes
+    order = np.lexsort((deltas if need == 2 else -deltas, positions))
+    inside = np.cumsum(deltas[order]) >= need
+    changes = np.flatnonzero(inside != np.r_[False, inside[:-1]])
+    runs = positions[order][changes]
+    if len(runs) % 2:
+        runs = runs[:-1]
+    keep = np.repeat(runs[0::2] < runs[1::2], 2)
+    return runs[keep].astype(np.uint32)
+
+
+# Complement of a run list: toggle the boundaries at 0 and n
+def _invert_runs(runs: np.ndarray, n: int) -> np.ndarray:
+    head = runs[1:] if runs[0] == 0 else np.concatenate([_ZERO, runs])
+    return head[:-1] if head[-1] == n else np.concatenate([head, np.array([n], dtype=np.uint32)])
+
+
+def encode_tile(tile: np.ndarray) -> Tuple[int, Optional[np.ndarray]]:
+    """Smallest encoding of a boolean tile as ``(kind, payload)``."""
+    flat = np.ascontiguousarray(tile, dtype=bool).ravel()
+    count = np.count_nonzero(flat)
+    if count == 0:
+        return EMPTY, None
+    if count == flat.size:
+        return FULL, None
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = len(changes) + int(flat[0]) + int(flat[-1])
+    if boundaries * 4 < (flat.size + 7) // 8:
+        runs = np.concatenate([[0] if flat[0] else [], changes, [flat.size] if flat[-1] else []])
+        return RUNS, runs.astype(np.uint32)
+    return BITS, np.packbits(flat)
+
+
+def decode_tile(kind: int, payload, shape: Tuple[int, int]) -> np.ndarray:
+    n = shape[0] * shape[1]
+    if kind == EMPTY:
+        return np.zeros(shape, dtype=bool)
+    if kind == FULL:
+        return np.ones(shape, dtype=bool)
+    if kind == RUNS:
+        return _decode_runs(payload, n).reshape(shape)
+    return np.unpackbits(payload, count=n).astype(bool).reshape(shape)
+
+
+# One tile as bytes: kind byte followed by the payload (used for on-disk tile caches)
+def tile_to_bytes(kind: int, payload) -> bytes:
+    return bytes([kind]) + (payload.tobytes() if payload is not None else b'')
+
+
+def tile_from_bytes(data: bytes):
+    kind = data[0]
+    if kind in (EMPTY, FULL):
+        return kind, None
+    return kind, np.frombuffer(data[1:], dtype=np.uint32 if kind == RUNS else np.uint8).copy()
+
+
+class PackedMask:
+    """A (height, width) boolean mask stored as encoded tiles in row-major order."""
+
+    def __init__(self, shape: Tuple[int, int], tile_size: int, kinds: np.ndarray, payloads: List):
+        self.shape = tuple(shape)
+        self.tile_size = tile_size
+        self.kinds = kinds
+        self.payloads = payloads
+
+    @property
+    def tile_grid(self) -> Tuple[int, int]:
+        return -(-self.shape[0] // self.tile_size), -(-self.shape[1] // self.tile_size)
+
+    # Array slices and pixel count of tile i
+    def _tile(self, i):
+        rows, cols = self.tile_grid
+        r0, c0 = (i // cols) * self.tile_size, (i % cols) * self.tile_size
+        r1, c1 = min(r0 + self.tile_size, self.shape[0]), min(c0 + self.tile_size, self.shape[1])
+        return (slice(r0, r1), slice(c0, c1)), (r1 - r0, c1 - c0)
+
+    @classmethod
+    def pack(cls, array: np.ndarray, tile_size: int = TILE_SIZE) -> 'PackedMask':
+        array = np.asarray(array)
+        if array.ndim != 2:
+            raise ValueError(f"Expected a 2-D mask, got shape {array.shape}.")
+        mask = cls(array.shape, tile_size, None, [])
+        encoded = [encode_tile(array[mask._tile(i)[0]]) for i in range(int(np.prod(mask.tile_grid)))]
+        mask.kinds = np.array([kind for kind, _ in encoded], dtype=np.uint8)
+        mask.payloads = [payload for _, payload in encoded]
+        return mask
+
+    def unpack(self) -> np.ndarray:
+        out = np.empty(self.shape, dtype=bool)
+        for i, (kind, payload) in enumerate(zip(self.kinds, self.payloads)):
+            region, shape = self._tile(i)
+            out[region] = decode_tile(kind, payload, shape)
+        return out
+
+    def tile(self, tile_row: int, tile_col: int) -> np.ndarray:
+        i = tile_row * self.tile_grid[1] + tile_col
+        return decode_tile(self.kinds[i], self.payloads[i], self._tile(i)[1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.kinds.nbytes + sum(p.nbytes for p in self.payloads if p is not None)
+
+    # Pixel count of every tile, in tile order
+    def _sizes(self) -> List[int]:
+        rows, cols = self.tile_grid
+        heights = np.minimum(self.tile_size, self.shape[0] - np.arange(rows) * self.tile_size)
+        widths = np.minimum(self.tile_size, self.shape[1] - np.arange(cols) * self.tile_size)
+        return np.outer(heights, widths).ravel().tolist()
+
+    def count(self) -> int:
+        """Number of True pixels."""
+        kinds, sizes = self.kinds.tolist(), self._sizes()
+        total = sum(n for kind, n in zip(kinds, sizes) if kind == FULL)
+        runs = [p for kind, p in zip(kinds, self.payloads) if kind == RUNS]
+        if runs:
+            # Every payload has an even length, so pairs stay aligned when concatenated
+            runs = np.concatenate(runs).astype(np.int64)
+            total += int((runs[1::2] - runs[0::2]).sum())
+        bits = [p for kind, p in zip(kinds, self.payloads) if kind == BITS]
+        if bits:
+            total += _popcount(np.concatenate(bits))
+        return total
+
+    def _check(self, other: 'PackedMask'):
+        if self.shape != other.shape or self.tile_size != other.tile_size:
+            raise ValueError(f"Masks differ: {self.shape}/{self.tile_size} vs {other.shape}/{other.tile_size}.")
+
+    def _combine(self, other: 'PackedMask', is_and: bool) -> 'PackedMask':
+        self._check(other)
+        absorbing, identity = (EMPTY, FULL) if is_and else (FULL, EMPTY)
+        kinds, payloads, sizes = self.kinds.tolist(), list(self.payloads), self._sizes()
+        batch = []  # BITS tiles on both sides, combined in one numpy op below
+        for i, (ka, pa, kb, pb) in enumerate(zip(self.kinds.tolist(), self.payloads,
+                                                 other.kinds.tolist(), other.payloads)):
+            if ka == absorbing or kb == absorbing:
+                kinds[i], payloads[i] = absorbing, None
+            elif ka == identity:
+                kinds[i], payloads[i] = kb, pb
+            elif kb == identity:
+                pass
+            elif ka == BITS and kb == BITS:
+                batch.append(i)
+            elif ka == RUNS and kb == RUNS:
+                runs = _combine_runs(pa, pb, 2 if is_and else 1)
+                if len(runs) == 0:
+                    kinds[i], payloads[i] = EMPTY, None
+                elif len(runs) == 2 and runs[0] == 0 and runs[1] == sizes[i]:
+                    kinds[i], payloads[i] = FULL, None
+                else:
+                    kinds[i], payloads[i] = RUNS, runs
+            else:
+                bits_a = pa if ka == BITS else _runs_to_bits(pa, sizes[i])
+                bits_b = pb if kb == BITS else _runs_to_bits(pb, sizes[i])
+                bits = (bits_a & bits_b) if is_and else (bits_a | bits_b)
+                kinds[i], payloads[i] = (BITS, bits) if bits.any() else (EMPTY, None)
+        if batch:
+            a = np.concatenate([self.payloads[i] for i in batch])
+            b = np.concatenate([other.payloads[i] for i in batch])
+            bits = (a & b) if is_and else (a | b)
+            starts = np.cumsum([0] + [len(self.payloads[i]) for i in batch[:-1]])
+            nonempty = np.logical_or.reduceat(bits, starts).tolist()
+            for i, part, keep in zip(batch, np.split(bits, starts[1:]), nonempty):
+                kinds[i], payloads[i] = (BITS, part) if keep else (EMPTY, None)
+        return PackedMask(self.shape, self.tile_size, np.array(kinds, dtype=np.uint8), payloads)
+
+    def __and__(self, other: 'PackedMask') -> 'PackedMask':
+        return self._combine(other, is_and=True)
+
+    def __or__(self, other: 'PackedMask') -> 'PackedMask':
+        return self._combine(other, is_and=False)
+
+    def __invert__(self) -> 'PackedMask':
+        kinds, payloads, sizes = self.kinds.tolist(), list(self.payloads), self._sizes()
+        batch = []
+        for i, (kind, payload) in enumerate(zip(kinds, self.payloads)):
+            if kind == EMPTY:
+                kinds[i] = FULL
+            elif kind == FULL:
+                kinds[i] = EMPTY
+            elif kind == RUNS:
+                payloads[i] = _invert_runs(payload, sizes[i])
+            else:
+                batch.append(i)
+        if batch:
+            bits = ~np.concatenate([self.payloads[i] for i in batch])
+            starts = np.cumsum([0] + [len(self.payloads[i]) for i in batch[:-1]])
+            for i, part in zip(batch, np.split(bits, starts[1:])):
+                payloads[i] = _clear_padding(part, sizes[i])
+        return PackedMask(self.shape, self.tile_size, np.array(kinds, dtype=np.uint8), payloads)
+
+    def apply_water(self, water: 'PackedMask') -> 'PackedMask':
+        """This mask with water pixels (True in `water`) cleared."""
+        return self & ~water
+
+    # Re-encode every tile in its smallest form, e.g. after many ops produced BITS tiles
+    def compact(self) -> 'PackedMask':
+        return PackedMask.pack(self.unpack(), self.tile_size)
+
+    def save(self, file):
+        """Write to a path or binary file object (uncompressed .npz)."""
+        kinds = self.kinds.astype(np.uint8)
+        blobs = [tile_to_bytes(k, p)[1:] for k, p in zip(kinds, self.payloads)]
+        offsets = np.cumsum([0] + [len(b) for b in blobs], dtype=np.uint64)
+        np.savez(file, shape=np.array(self.shape, dtype=np.int64), tile_size=np.int64(self.tile_size),
+                 kinds=kinds, offsets=offsets, payload=np.frombuffer(b''.join(blobs), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, file) -> 'PackedMask':
+        with np.load(file) as data:
+            kinds, offsets, payload = data['kinds'], data['offsets'], data['payload']
+            payloads = [tile_from_bytes(bytes([kind]) + payload[offsets[i]:offsets[i + 1]].tobytes())[1]
+                        for i, kind in enumerate(kinds)]
+            return cls(tuple(data['shape']), int(data['tile_size']), kinds, payloads)
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        self.save(buffer)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'PackedMask':
+        return cls.load(io.BytesIO(data))
+
+
+# Pack one band of a GeoTIFF (e.g. VV_significant) one strip of tiles at a time
+def pack_geotiff(path: str, band: Optional[int] = None, tile_size: int = TILE_SIZE) -> PackedMask:
+    import rasterio
+    from rasterio.windows import Window
+
+    with rasterio.open(path) as src:
+        band = band or src.count  # significance is the last band of the exported stack
+        mask = PackedMask((src.height, src.width), tile_size, None, [])
+        kinds, payloads = [], []
+        for row0 in range(0, src.height, tile_size):
+            strip = src.read(band, window=Window(0, row0, src.width, min(tile_size, src.height - row0))) > 0
+            for col0 in range(0, src.width, tile_size):
+                kind, payload = encode_tile(strip[:, col0:col0 + tile_size])
+                kinds.append(kind)
+                payloads.append(payload)
+    mask.kinds, mask.payloads = np.array(kinds, dtype=np.uint8), payloads
+    return mask
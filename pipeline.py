@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""asyncio orchestration of the change-detection workflow.
+
+Blocking service calls go through ``backend`` in a thread pool and are
+awaited together, so the two periods of a job load concurrently and one
+event loop can drive many jobs at once. Export monitoring is an awaitable
+that sleeps on the loop instead of blocking the thread.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import List, Optional, Tuple
+
+import grid
+import masks
+import profiling
+from backend import ACTIVE_STATES
+from checkpoint import JobCheckpoint, job_key
+from history_store import HistoryStore
+
+POLL_INTERVAL = 10  # seconds between export status checks
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class ChangeJob:
+    bounds: grid.Bounds
+    baseline: Tuple[str, str]
+    comparison: Tuple[str, str]
+    scale: float = 10
+    threshold: float = 0.1
+    description: str = 'area_of_interest'
+    mask_method: Optional[str] = None
+    polarisations: Tuple[str, ...] = ('VV',)  # any of backend.POLARISATIONS
+    orbit_split: bool = False  # separate ascending / descending composites
+    strategy: str = 'batch'  # 'direct', 'tiled' or 'batch', see planner.py
+    tile_grid: Tuple[int, int] = (1, 1)  # (rows, cols) for the tiled strategy
+    output_dir: str = os.path.expanduser('~/Downloads')  # where direct / tiled downloads go
+
+
+# Job parameters with the scale and strategy chosen by planner.plan()
+def job_from_plan(job: ChangeJob, plan: dict) -> ChangeJob:
+    decision = plan['decision']
+    if decision['action'] == 'refuse':
+        raise ValueError(f"The planner refused the job: {decision['reason']}")
+    return replace(job, scale=decision['scale'], strategy=decision['strategy'],
+                   tile_grid=(decision['tile_rows'], decision['tile_cols']))
+
+
+# Run a blocking backend call in the loop's executor
+async def call(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, fn, *args)
+
+
+# Poll an export task until it leaves the active states. When `should_cancel()`
+# turns true while it runs, the service task is cancelled and JobCancelled raised.
+async def wait_for_task(backend, task_id, poll_interval=POLL_INTERVAL, should_cancel=None):
+    while True:
+        state = await call(backend.task_state, task_id)
+        if state not in ACTIVE_STATES:
+            return state
+        if should_cancel is not None and await call(should_cancel):
+            print(f"Cancelling export task {task_id}.")
+            await call(backend.cancel_task, task_id)
+            raise JobCancelled(f"The job was cancelled; export task {task_id} was cancelled.")
+        print(f"Waiting for task {task_id} to complete...")
+        await asyncio.sleep(poll_interval)
+
+
+# Mask stage: cached local mask -> region of unmasked pixels + server-side land mask
+async def mask_stage(backend, job):
+    if job.mask_method is None:
+        return job.bounds, None
+    water, window = await call(
+        lambda: masks.load_or_compute_mask(job.bounds, method=job.mask_method, dates=job.baseline,
+                                           fetch_tile=backend.fetch_mask_tile))
+    valid = masks.valid_bounds(water, window, masks.MASK_SCALE)
+    if valid is None:
+        return None, None
+    region = (max(valid[0], job.bounds[0]), max(valid[1], job.bounds[1]),
+              min(valid[2], job.bounds[2]), min(valid[3], job.bounds[3]))
+    return region, backend.land_mask(job.mask_method, region, job.baseline)
+
+
+# Band names of a downloaded job output, in file order (see backend.stack)
+def output_bands(bands: List[str]) -> List[str]:
+    return [f"{b}_change" for b in bands] + [f"{b}_significant" for b in bands]
+
+
+# Add a finished job's downloaded change bands to the AOI's history stores under
+# `root` (one store per band, e.g. <root>/<aoi>/VV_change), dated by the comparison
+# period's end. Tiles outside the AOI are skipped, and an output that cannot be
+# added does not stop the others. Batch exports go to Drive and have no local
+# output to add. Returns the stores that were written to.
+def record_history(job: ChangeJob, result: dict, root: str) -> List[str]:
+    if result.get('state') != 'COMPLETED' or not result.get('outputs'):
+        return []
+    aoi_name = '_'.join(f"{value:.4f}" for value in job.bounds)
+    band_names = output_bands(result.get('bands') or [])
+    paths, failed = [], []
+    for band in (f"{b}_change" for b in result.get('bands') or []):
+        path = os.path.join(root, aoi_name, band)
+        added = False
+        for output in result['outputs']:
+            try:
+                with HistoryStore.lock(path):
+                    store = HistoryStore.open_or_create(path, job.bounds, job.scale, band=band)
+                    added = store.append_geotiff(job.comparison[1], output, band, band_names) or added
+            except (ValueError, OSError) as e:
+                failed.append(f"{os.path.basename(output)} ({band}): {e}")
+        if added:
+            paths.append(path)
+    if failed:
+        print(f"Change history only partly updated ({len(paths)} store(s) written); "
+              f"not added: {'; '.join(failed)}")
+    return paths
+
+
+# Move a job's result record to the next stage and tell the caller, if it asked
+def _enter(result, stage, on_stage, profiler=profiling.OFF, should_cancel=None):
+    if should_cancel is not None and should_cancel():
+        raise JobCancelled("The job was cancelled.")
+    result['stage'] = stage
+    profiler.mark(stage)
+    if on_stage:
+        on_stage(stage)
+
+
+async def run_job(backend, job: ChangeJob, poll_interval=POLL_INTERVAL, checkpoint_dir=None,
+                  on_stage=None, profile: Optional[bool] = None, should_cancel=None,
+                  history_root: Optional[str] = None) -> dict:
+    """Run one job end to end and return a result record (never raises for job errors).
+
+    With `checkpoint_dir`, finished stages are recorded and a rerun of the
+    same job skips them, reattaching to export tasks still in flight and
+    keeping tiles that were already downloaded. `on_stage(stage)` is called
+    as the job enters each stage. `profile` turns profiling of the job's
+    stages on or off (default: the SAR_PROFILE setting, see profiling.py).
+    `should_cancel()` is checked at every stage and on every export poll;
+    once it is true the job stops, cancelling its export task, and ends
+    as CANCELLED. With `history_root`, downloaded change bands are added to
+    the AOI's change history (see ``record_history``).
+    """
+    if hasattr(backend, 'for_job'):
+        backend = backend.for_job(job.description)  # queue this job's calls separately
+    started = time.monotonic()
+    result = {'description': job.description, 'state': 'FAILED', 'error': None,
+              'stage': 'mask', 'task_id': None, 'outputs': [], 'resumed': False}
+    ckpt = JobCheckpoint.load(checkpoint_dir, job_key(job)) if checkpoint_dir else None
+    profiler = profiling.profiler(f"job_{job.description}", profile)
+    try:
+        _enter(result, 'mask', on_stage, profiler, should_cancel)
+        if ckpt and ckpt.reached('done'):
+            result.update(resumed=True, stage='done', state=ckpt.get('final_state'),
+                          bands=ckpt.get('bands'), task_id=ckpt.task_id('export'),
+                          outputs=ckpt.get('outputs', []))
+            return result
+
+        if ckpt and ckpt.reached('mask'):
+            region = ckpt.get('region')
+            land = (backend.land_mask(job.mask_method, region, job.baseline)
+                    if region and job.mask_method else None)
+        else:
+            region, land = await mask_stage(backend, job)
+            if ckpt:
+                ckpt.finish_stage('mask', region=region)
+        if region is None:
+            result.update(state='SKIPPED', error="The whole area of interest is masked as water.")
+            return result
+
+        _enter(result, 'composite', on_stage, profiler, should_cancel)
+        if ckpt and ckpt.reached('composite'):
+            result['bands'] = ckpt.get('bands')
+            export_image = backend.deserialize(ckpt.get('export_image'))
+            result['resumed'] = True
+        else:
+            baseline, comparison = await asyncio.gather(
+                call(backend.composite, region, job.baseline[0], job.baseline[1], land,
+                     job.polarisations, job.orbit_split),
+                call(backend.composite, region, job.comparison[0], job.comparison[1], land,
+                     job.polarisations, job.orbit_split))
+            if baseline is None or comparison is None:
+                raise ValueError("No images found in the collection.")
+            (baseline, baseline_bands), (comparison, comparison_bands) = baseline, comparison
+            # An orbit direction seen in only one period has nothing to compare against
+            bands = [band for band in baseline_bands if band in comparison_bands]
+            if not bands:
+                raise ValueError("The two periods have no polarisation / orbit bands in common.")
+            change, significant = backend.difference(baseline, comparison, job.threshold, bands)
+            result['bands'], result['change'], result['significant'] = bands, change, significant
+            export_image = backend.stack(change, significant)
+            if ckpt:
+                ckpt.finish_stage('composite', bands=bands, export_image=backend.serialize(export_image))
+
+        _enter(result, 'export', on_stage, profiler, should_cancel)
+        if job.strategy == 'batch':
+            result['task_id'], result['state'] = await export_task(
+                backend, job, export_image, region, ckpt, poll_interval, should_cancel)
+        elif job.strategy in ('direct', 'tiled'):
+            tiles = grid.split_bounds(region, *job.tile_grid) if job.strategy == 'tiled' else [region]
+            result['outputs'] = await asyncio.gather(*(
+                download_tile(backend, job, export_image, i, tile, ckpt) for i, tile in enumerate(tiles)))
+            result['state'] = 'COMPLETED'
+        else:
+            raise ValueError(f"Unknown strategy {job.strategy!r}.")
+
+        if result['state'] != 'COMPLETED':
+            result['error'] = f"Export ended as {result['state']}."
+            if ckpt:
+                ckpt.forget_task('export')  # the next run exports again
+        else:
+            if history_root:
+                result['history'] = record_history(job, result, history_root)
+            _enter(result, 'done', on_stage, profiler)
+            if ckpt:
+                ckpt.finish_stage('done', final_state=result['state'], outputs=result['outputs'])
+    except JobCancelled as e:
+        result.update(state='CANCELLED', error=str(e))
+        if ckpt:
+            ckpt.forget_task('export')  # the cancelled task cannot be reattached to
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        result['elapsed'] = time.monotonic() - started
+        if profiler.enabled:
+            result['profile'] = profiler.finish(state=result['state'], error=result['error'])
+    return result
+
+
+# Batch strategy: one Drive export task, reattached to if an earlier run submitted it
+async def export_task(backend, job, image, region, ckpt, poll_interval, should_cancel=None):
+    task_id = ckpt.task_id('export') if ckpt else None
+    if task_id:
+        state = await call(backend.task_state, task_id)
+        if state in ACTIVE_STATES or state == 'COMPLETED':
+            print(f"Reattaching to export task {task_id}.")
+        else:
+            print(f"Export task {task_id} ended as {state}; exporting again.")
+            task_id = None
+    try:
+        if not task_id:
+            task_id = await call(backend.start_export, image, region, job.description, job.scale)
+            if ckpt:
+                ckpt.record_task('export', task_id)
+            print(f"Export task {task_id} started. Check your Google Drive for the result.")
+        return task_id, await wait_for_task(backend, task_id, poll_interval, should_cancel)
+    finally:
+        # A scheduler's batch slot is otherwise only freed by a poll that sees a final state
+        release = getattr(backend, 'release_task', None)
+        if task_id and release is not None:
+            release(task_id)
+
+
+# Direct / tiled strategies: synchronous download of one tile, skipped if already on disk
+async def download_tile(backend, job, image, index, bounds, ckpt):
+    name = f"tile_{index}"
+    path = ckpt.output(name) if ckpt else None
+    if path:
+        return path
+    path = os.path.join(job.output_dir, f"{job.description}_{index}.tif")
+    path = await call(backend.download, image, bounds, job.scale, path)
+    if ckpt:
+        ckpt.record_output(name, path)
+    return path
+
+
+async def run_jobs(backend, jobs: List[ChangeJob], poll_interval=POLL_INTERVAL, max_workers=32,
+                   checkpoint_dir=None, coalesce=False, profile: Optional[bool] = None,
+                   history_root: Optional[str] = None):
+    """Run jobs concurrently; with `coalesce`, overlapping jobs share computations."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
+    if coalesce:
+        from coalescing import Coalescer
+
+        coalescer = Coalescer(backend, poll_interval=poll_interval, checkpoint_dir=checkpoint_dir,
+                              profile=profile, history_root=history_root)
+        results = await asyncio.gather(*(coalescer.submit(job) for job in jobs))
+        report = coalescer.report()
+        print(f"Coalescing: {report['requests']} jobs ran as {report['computations']} computation(s), "
+              f"{report['pixels_saved']} of {report['pixels_requested']} pixels "
+              f"({report['saved_fraction']:.0%}) not computed twice.")
+        return results
+    return await asyncio.gather(*(run_job(backend, job, poll_interval, checkpoint_dir, profile=profile,
+                                          history_root=history_root)
+                                  for job in jobs))
+
+
+# Synchronous entry point for one job, e.g. inside a queue worker process
+def run_job_sync(backend, job: ChangeJob, poll_interval=POLL_INTERVAL, checkpoint_dir=None,
+                 on_stage=None, profile: Optional[bool] = None, should_cancel=None,
+                 history_root: Optional[str] = None) -> dict:
+    return asyncio.run(run_job(backend, job, poll_interval, checkpoint_dir, on_stage, profile, should_cancel,
+                               history_root))
+
+
+# Synchronous entry point for scripts
+def run(backend, jobs: List[ChangeJob], poll_interval=POLL_INTERVAL, max_workers=32,
+        checkpoint_dir=None, coalesce=False, profile: Optional[bool] = None,
+        history_root: Optional[str] = None) -> List[dict]:
+    return asyncio.run(run_jobs(backend, jobs, poll_interval, max_workers, checkpoint_dir, coalesce, profile,
+                                history_root))
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Preflight pixel-budget planner: how big a job is, and how to run it.
+
+Works only from the AOI bounds and the dates - no service calls - and
+returns a JSON-serialisable plan with, for every candidate scale, the
+pixel count, output bytes, expected scene count and runtime, plus the
+strategy it would use:
+
+* ``direct`` - one synchronous download (small outputs)
+* ``tiled``  - the region split into tiles downloaded in parallel
+* ``batch``  - a single Drive export task
+
+A ``CostPolicy`` caps pixels, bytes, scenes and runtime; a job over budget
+is either moved to a coarser scale or refused.
+
+The scene and runtime figures are rough models meant for choosing between
+strategies, not for billing.
+"""
+import json
+import math
+from dataclasses import asdict, dataclass
+from datetime import date
+from typing import Optional, Sequence
+
+import grid
+from backend import composite_bands
+
+CANDIDATE_SCALES = (10, 20, 30, 60, 100, 250)
+BYTES_PER_PIXEL = 4  # float32 per output band
+
+# Earth Engine synchronous download limits (getDownloadURL)
+DIRECT_MAX_BYTES = 32 * 1024 ** 2
+DIRECT_MAX_DIMENSION = 10000
+TILED_MAX_TILES = 64
+TILED_PARALLELISM = 8
+
+# Sentinel-1 coverage model: one acquisition per relative orbit every 12 days,
+# a point seen from about two relative orbits per pass direction, frames ~250 km wide
+REVISIT_DAYS = 12
+ORBITS_PER_PASS = 2
+FRAME_WIDTH_M = 250000.0
+
+# Runtime model, in seconds
+DIRECT_OVERHEAD_S = 5.0
+BATCH_OVERHEAD_S = 60.0
+SECONDS_PER_PIXEL_SCENE = 2e-8  # server-side compositing cost
+DOWNLOAD_BYTES_PER_S = 8 * 1024 ** 2
+
+
+@dataclass
+class CostPolicy:
+    max_pixels: float = 1e10
+    max_bytes: float = 10 * 1024 ** 3
+    max_scenes: int = 2000
+    max_runtime_s: float = 6 * 3600
+    on_exceed: str = 'downscale'  # or 'refuse'
+
+
+def _parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD.")
+
+
+# Width and height of the AOI in meters, measured at its central latitude
+def aoi_size_m(bounds: grid.Bounds):
+    min_lon, min_lat, max_lon, max_lat = bounds
+    mid_lat = math.radians((min_lat + max_lat) / 2)
+    width = (max_lon - min_lon) * grid.METERS_PER_DEGREE * math.cos(mid_lat)
+    height = (max_lat - min_lat) * grid.METERS_PER_DEGREE
+    return width, height
+
+
+# Expected Sentinel-1 IW scenes intersecting the AOI over a period
+def estimate_scenes(bounds: grid.Bounds, start: str, end: str) -> int:
+    days = (_parse_date(end) - _parse_date(start)).days
+    if days <= 0:
+        raise ValueError(f"The period {start} to {end} is empty.")
+    width, height = aoi_size_m(bounds)
+    frames = math.ceil(width / FRAME_WIDTH_M) * math.ceil(height / FRAME_WIDTH_M)
+    passes = 2 * ORBITS_PER_PASS
+    return max(1, math.ceil(days / REVISIT_DAYS * passes * frames))
+
+
+# (rows, cols) of equal tiles that each fit a synchronous download: under the
+# dimension limit on both sides, then split along the longer tile side until
+# every tile is also under the byte limit
+def tile_grid(width: int, height: int, output_bands: int):
+    rows, cols = math.ceil(height / DIRECT_MAX_DIMENSION), math.ceil(width / DIRECT_MAX_DIMENSION)
+    while math.ceil(width / cols) * math.ceil(height / rows) * output_bands * BYTES_PER_PIXEL > DIRECT_MAX_BYTES:
+        if math.ceil(width / cols) >= math.ceil(height / rows):
+            cols += 1
+        else:
+            rows += 1
+    return rows, cols
+
+
+# Size, cost and strategy of the job at one scale
+def estimate(bounds: grid.Bounds, scale: float, scenes: int, output_bands: int) -> dict:
+    width_m, height_m = aoi_size_m(bounds)
+    width, height = max(1, math.ceil(width_m / scale)), max(1, math.ceil(height_m / scale))
+    pixels = width * height
+    output_bytes = pixels * output_bands * BYTES_PER_PIXEL
+    compute_s = pixels * scenes * SECONDS_PER_PIXEL_SCENE
+
+    tile_rows = tile_cols = 1
+    if output_bytes <= DIRECT_MAX_BYTES and max(width, height) <= DIRECT_MAX_DIMENSION:
+        strategy = 'direct'
+        runtime = DIRECT_OVERHEAD_S + compute_s + output_bytes / DOWNLOAD_BYTES_PER_S
+    else:
+        tile_rows, tile_cols = tile_grid(width, height, output_bands)
+        tiles = tile_rows * tile_cols
+        if tiles <= TILED_MAX_TILES:
+            strategy = 'tiled'
+            waves = math.ceil(tiles / TILED_PARALLELISM)
+            runtime = (DIRECT_OVERHEAD_S * waves + compute_s / min(tiles, TILED_PARALLELISM)
+                       + output_bytes / DOWNLOAD_BYTES_PER_S)
+        else:
+            strategy = 'batch'
+            tile_rows = tile_cols = 1
+            runtime = BATCH_OVERHEAD_S + compute_s
+    return {
+        'scale': scale,
+        'width': width,
+        'height': height,
+        'pixels': pixels,
+        'output_bytes': output_bytes,
+        'scenes': scenes,
+        'runtime_s': round(runtime, 1),
+        'strategy': strategy,
+        'tiles': tile_rows * tile_cols,
+        'tile_rows': tile_rows,
+        'tile_cols': tile_cols,
+    }
+
+
+# Budget lines a candidate crosses
+def violations(candidate: dict, policy: CostPolicy):
+    found = []
+    if candidate['pixels'] > policy.max_pixels:
+        found.append(f"pixels {candidate['pixels']:.3g} > {policy.max_pixels:.3g}")
+    if candidate['output_bytes'] > policy.max_bytes:
+        found.append(f"output bytes {candidate['output_bytes']:.3g} > {policy.max_bytes:.3g}")
+    if candidate['scenes'] > policy.max_scenes:
+        found.append(f"scenes {candidate['scenes']} > {policy.max_scenes}")
+    if candidate['runtime_s'] > policy.max_runtime_s:
+        found.append(f"runtime {candidate['runtime_s']:.0f} s > {policy.max_runtime_s:.0f} s")
+    return found
+
+
+def plan(bounds: grid.Bounds, baseline, comparison, scale: float = 10,
+         polarisations: Sequence[str] = ('VV',), orbit_split: bool = False,
+         policy: Optional[CostPolicy] = None, scales: Sequence[float] = CANDIDATE_SCALES) -> dict:
+    """Plan a change job before any service call is made."""
+    policy = policy or CostPolicy()
+    if policy.on_exceed not in ('downscale', 'refuse'):
+        raise ValueError(f"Unknown on_exceed policy {policy.on_exceed!r}.")
+    min_lon, min_lat, max_lon, max_lat = bounds
+    if not (min_lon < max_lon and min_lat < max_lat):
+        raise ValueError(f"Invalid bounds {bounds}.")
+
+    scenes = (estimate_scenes(bounds, baseline[0], baseline[1])
+              + estimate_scenes(bounds, comparison[0], comparison[1]))
+    # change + significance layer per band
+    output_bands = 2 * len(composite_bands(polarisations, orbit_split))
+    candidates = []
+    for candidate_scale in sorted(set(scales) | {scale}):
+        candidate = estimate(bounds, candidate_scale, scenes, output_bands)
+        candidate['violations'] = violations(candidate, policy)
+        candidates.append(candidate)
+
+    requested = next(c for c in candidates if c['scale'] == scale)
+    if not requested['violations']:
+        decision = {'action': 'run', 'scale': scale, 'reason': 'within budget'}
+        chosen = requested
+    else:
+        coarser = [c for c in candidates if c['scale'] > scale and not c['violations']]
+        if policy.on_exceed == 'downscale' and coarser:
+            chosen = coarser[0]
+            decision = {'action': 'downscale', 'scale': chosen['scale'],
+                        'reason': '; '.join(requested['violations'])}
+        else:
+            chosen = None
+            decision = {'action': 'refuse', 'scale': None,
+                        'reason': '; '.join(requested['violations'])}
+    if chosen:
+        decision.update(strategy=chosen['strategy'], tiles=chosen['tiles'],
+                        tile_rows=chosen['tile_rows'], tile_cols=chosen['tile_cols'],
+                        runtime_s=chosen['runtime_s'])
+
+    return {
+        'bounds': list(bounds),
+        'baseline': list(baseline),
+        'comparison': list(comparison),
+        'requested_scale': scale,
+        'output_bands': output_bands,
+        'policy': asdict(policy),
+        'candidates': candidates,
+        'decision': decision,
+    }
+
+
+def plan_json(*args, **kwargs) -> str:
+    return json.dumps(plan(*args, **kwargs), indent=2)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""Opt-in memory and CPU profiling of workflow stages, reported as one JSON file.
+
+Profiling is off unless a job asks for it (``profile=True`` on
+``pipeline.run_job`` / ``run_jobs``, ``"profile": true`` in a queued job's
+params) or ``SAR_PROFILE`` is set in the environment. When it is off every
+hook goes to ``OFF``, whose methods do nothing, so the hooks can stay in
+production code.
+
+When it is on, each stage records wall and CPU time, resident memory at
+the end, the traced (tracemalloc) peak and net growth, and the top
+allocating source lines between the snapshots taken at its start and end.
+With ``SAR_PROFILE_CPROFILE=1`` (or ``cprofile=True``) each stage also
+runs under cProfile; its pstats file is saved next to the report and its
+top functions are listed in it.
+
+Stages either wrap a block (``with profiler.stage('composite'):``) or are
+marked as the workflow moves on (``profiling.mark('export')`` ends the
+current stage and starts the next), which is how ``main()`` in each
+script and the pipeline's stage transitions are hooked. Memory and CPU
+figures are process-wide, so stages of jobs running concurrently in one
+process overlap; queue workers run one job per process.
+"""
+import cProfile
+import functools
+import itertools
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+PROFILE_ENV = 'SAR_PROFILE'  # '1' or a report directory turns profiling on everywhere
+CPROFILE_ENV = 'SAR_PROFILE_CPROFILE'
+DEFAULT_REPORT_DIR = os.path.expanduser(os.path.join('~', '.sar_change', 'profiles'))
+TOP_LINES = 10
+TRACE_FRAMES = 1
+
+_tracing_users = 0  # profilers sharing tracemalloc in this process
+_serials = itertools.count(1)
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # high-water mark only
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+
+
+def _top_functions(profile: cProfile.Profile, limit: int):
+    stats = pstats.Stats(profile).sort_stats('cumulative')
+    top = []
+    for func in stats.fcn_list[:limit]:
+        calls, _, own, cumulative, _ = stats.stats[func]
+        top.append({'function': f"{func[0]}:{func[1]}({func[2]})", 'calls': calls,
+                    'own_s': round(own, 4), 'cumulative_s': round(cumulative, 4)})
+    return top
+
+
+class _Off:
+    """The profiler used when profiling is off: every hook is a no-op."""
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def mark(self, name):
+        pass
+
+    def finish(self, **extra):
+        return None
+
+
+class _NullStage:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+OFF = _Off()
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, name: str, report_dir: str = DEFAULT_REPORT_DIR, cprofile: bool = False,
+                 memory: bool = True, top: int = TOP_LINES):
+        self.name = name
+        self.report_dir = report_dir
+        self.cprofile = cprofile
+        self.memory = memory
+        self.top = top
+        self.stages = []
+        self._current = None
+        self._started_wall = time.perf_counter()
+        self._started_cpu = time.process_time()
+        self._started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self._finished = None
+        self._serial = next(_serials)
+        global _tracing_users
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+            _tracing_users += 1
+
+    def _start(self, name):
+        stage = {'stage': name, 'wall': time.perf_counter(), 'cpu': time.process_time()}
+        if self.memory:
+            tracemalloc.reset_peak()
+            stage['traced'] = tracemalloc.get_traced_memory()[0]
+            stage['snapshot'] = _snapshot()
+        if self.cprofile:
+            stage['profile'] = cProfile.Profile()
+            try:
+                stage['profile'].enable()
+            except ValueError:  # another profiler is active (e.g. a concurrent job's stage)
+                stage['profile'] = None
+        self._current = stage
+
+    def _end(self):
+        stage, self._current = self._current, None
+        if stage is None:
+            return
+        profile = stage.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+        rss = _rss_mb()
+        record = {'stage': stage['stage'],
+                  'wall_s': round(time.perf_counter() - stage['wall'], 4),
+                  'cpu_s': round(time.process_time() - stage['cpu'], 4),
+                  'rss_mb': round(rss, 1) if rss is not None else None}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stats = _snapshot().compare_to(stage['snapshot'], 'lineno')
+            record.update(
+                traced_peak_mb=round(peak / 1024 ** 2, 3),
+                traced_growth_mb=round((current - stage['traced']) / 1024 ** 2, 3),
+                top_allocations=[{'line': f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                                  'size_kb': round(s.size / 1024, 1), 'growth_kb': round(s.size_diff / 1024, 1),
+                                  'blocks': s.count}
+                                 for s in stats[:self.top] if s.size_diff > 0])
+        if profile is not None:
+            os.makedirs(self.report_dir, exist_ok=True)
+            path = os.path.join(self.report_dir, f"{self._file_stem()}_{len(self.stages)}_{stage['stage']}.pstats")
+            profile.dump_stats(path)
+            record.update(pstats=path, top_functions=_top_functions(profile, self.top))
+        self.stages.append(record)
+
+    def _file_stem(self) -> str:
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in self.name)
+        started = self._started_at.replace(':', '').replace('-', '')[:15]
+        return f"{safe}_{started}_{os.getpid()}_{self._serial}"
+
+    @contextmanager
+    def stage(self, name: str):
+        """Profile the block as stage `name` (ends any stage started by ``mark``)."""
+        self._end()
+        self._start(name)
+        try:
+            yield self
+        finally:
+            self._end()
+
+    def mark(self, name: str):
+        """End the current stage, if any, and start stage `name`."""
+        self._end()
+        self._start(name)
+
+    def finish(self, **extra) -> Optional[str]:
+        """End the last stage, write the report and return its path (once)."""
+        if self._finished is not None:
+            return self._finished
+        self._end()
+        global _tracing_users
+        if self.memory:
+            _tracing_users -= 1
+            if _tracing_users == 0:
+                tracemalloc.stop()
+        report = {'name': self.name, 'pid': os.getpid(), 'started': self._started_at,
+                  'wall_s': round(time.perf_counter() - self._started_wall, 4),
+                  'cpu_s': round(time.process_time() - self._started_cpu, 4),
+                  'stages': self.stages, **extra}
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"{self._file_stem()}.json")
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Profile of {self.name} written to {path}")
+        self._finished = path
+        return path
+
+
+# Profiler for one entry point or job: OFF unless `requested`, or SAR_PROFILE when not given.
+# Inside a profiled entry point, jobs are only profiled separately when asked explicitly.
+def profiler(name: str, requested: Optional[bool] = None):
+    setting = os.environ.get(PROFILE_ENV, '')
+    if requested is False or (requested is None and (setting in ('', '0') or _active is not OFF)):
+        return OFF
+    report_dir = setting if setting not in ('', '0', '1') else DEFAULT_REPORT_DIR
+    return Profiler(name, report_dir, cprofile=os.environ.get(CPROFILE_ENV, '') not in ('', '0'))
+
+
+_active = OFF  # profiler of the entry point running in this process, for mark()
+
+
+def mark(name: str):
+    """Start stage `name` of the running entry point's profiler (no-op when off)."""
+    _active.mark(name)
+
+
+def profiled(name: str):
+    """Decorator for entry points such as ``main()``: profile the call when enabled."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            global _active
+            prof = profiler(name)
+            if prof is OFF:
+                return fn(*args, **kwargs)
+            previous, _active = _active, prof
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _active = previous
+                prof.finish()
+        return wrapper
+    return decorate
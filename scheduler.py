@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Quota-aware scheduler that every Earth Engine call goes through.
+
+* Interactive requests (getInfo, computePixels, task status) are paced by a
+  token bucket.
+* Batch tasks (exports) are capped at ``max_batch`` running at once; a slot
+  is held from ``start_export`` until the task leaves the active states, or
+  until ``release_task`` when the job stops polling it (failed poll, cancel).
+* Calls failing with a quota / rate-limit error are retried with jittered
+  exponential backoff instead of being given up on.
+* Pending requests are kept per job and dispatched round-robin, so a job
+  with hundreds of requests cannot starve the others.
+
+``SchedulingBackend`` wraps any backend (EarthEngineBackend, StandInBackend)
+so the pipeline needs no changes beyond asking it for a per-job view.
+"""
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backend import ACTIVE_STATES
+
+QUOTA_MARKERS = ('429', 'too many requests', 'quota exceeded', 'rate limit',
+                 'resource_exhausted', 'too many tasks', 'too many concurrent')
+
+
+# True when an exception from the service means "slow down", not "this request is wrong"
+def is_quota_error(exc: Exception) -> bool:
+    message = str(exc).lower()
+    return any(marker in message for marker in QUOTA_MARKERS)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Take a token if one is available; otherwise return the seconds until one is
+    def try_take(self, now=None) -> float:
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Request:
+    __slots__ = ('job_id', 'kind', 'fn', 'args', 'hold', 'future', 'enqueued', 'ready_at', 'attempt')
+
+    def __init__(self, job_id, kind, fn, args, hold):
+        self.job_id, self.kind, self.fn, self.args, self.hold = job_id, kind, fn, args, hold
+        self.future = Future()
+        self.enqueued = self.ready_at = time.monotonic()
+        self.attempt = 0
+
+
+class RequestScheduler:
+    def __init__(self, rate=10.0, burst=20, max_batch=3, workers=16,
+                 max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._queues = OrderedDict()  # job id -> deque of pending requests
+        self._cond = threading.Condition()
+        self._batch_in_use = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._stopped = False
+        self._waits = deque(maxlen=1000)
+        self._counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'retries': 0, 'quota_errors': 0}
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='ee-scheduler', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, job_id, fn, *args, kind='interactive', hold=False) -> Future:
+        """Queue ``fn(*args)`` for `job_id`. ``kind`` is 'interactive' or 'batch'.
+
+        A batch request with ``hold=True`` keeps its slot after returning,
+        until ``release_batch()`` is called.
+        """
+        if kind not in ('interactive', 'batch'):
+            raise ValueError(f"Unknown request kind {kind!r}.")
+        request = _Request(job_id, kind, fn, args, hold)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("The scheduler has been shut down.")
+            self._queues.setdefault(job_id, deque()).append(request)
+            self._counts['submitted'] += 1
+            self._cond.notify()
+        return request.future
+
+    # Blocking convenience wrapper around submit()
+    def call(self, job_id, fn, *args, kind='interactive', hold=False):
+        return self.submit(job_id, fn, *args, kind=kind, hold=hold).result()
+
+    def release_batch(self):
+        with self._cond:
+            self._batch_in_use = max(0, self._batch_in_use - 1)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            depth = {job_id: len(queue) for job_id, queue in self._queues.items() if queue}
+            waits = sorted(self._waits)
+            counts = dict(self._counts)
+            batch_in_use = self._batch_in_use
+        return {
+            'queue_depth': sum(depth.values()),
+            'queue_depth_per_job': depth,
+            'batch_in_use': batch_in_use,
+            'mean_wait': sum(waits) / len(waits) if waits else 0.0,
+            'p95_wait': waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            'max_wait': waits[-1] if waits else 0.0,
+            **counts,
+        }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._pool.shutdown(wait=wait)
+
+    # Next dispatchable request in round-robin job order, or the delay until one may be
+    def _next_ready(self, now):
+        delay = None
+        for job_id in list(self._queues):
+            queue = self._queues[job_id]
+            if not queue:
+                del self._queues[job_id]
+                continue
+            request = queue[0]
+            if request.ready_at > now:
+                wait = request.ready_at - now
+            elif request.kind == 'batch':
+                if self._batch_in_use >= self.max_batch:
+                    continue  # woken by release_batch()
+                self._batch_in_use += 1
+                wait = 0.0
+            else:
+                wait = self.bucket.try_take(now)
+            if wait == 0.0:
+                queue.popleft()
+                self._queues.move_to_end(job_id)  # this job goes to the back of the line
+                return request, None
+            delay = wait if delay is None else min(delay, wait)
+        return None, delay
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    for queue in self._queues.values():
+                        for request in queue:
+                            request.future.cancel()
+                    return
+                request, delay = self._next_ready(time.monotonic())
+                if request is None:
+                    self._cond.wait(timeout=delay)
+                    continue
+                if request.attempt == 0:
+                    self._waits.append(time.monotonic() - request.enqueued)
+            self._pool.submit(self._execute, request)
+
+    def _execute(self, request):
+        try:
+            result = request.fn(*request.args)
+        except Exception as e:
+            with self._cond:
+                if request.kind == 'batch':
+                    self._batch_in_use = max(0, self._batch_in_use - 1)
+                quota = is_quota_error(e)
+                self._counts['quota_errors'] += quota
+                if quota and request.attempt < self.max_retries and not self._stopped:
+                    delay = min(self.max_delay, self.base_delay * 2 ** request.attempt)
+                    request.attempt += 1
+                    request.ready_at = time.monotonic() + random.uniform(0.5, 1.0) * delay
+                    self._queues.setdefault(request.job_id, deque()).appendleft(request)
+                    self._counts['retries'] += 1
+                    self._cond.notify()
+                    return
+                self._counts['failed'] += 1
+                self._cond.notify()
+            request.future.set_exception(e)
+            return
+        with self._cond:
+            if request.kind == 'batch' and not request.hold:
+                self._batch_in_use = max(0, self._batch_in_use - 1)
+            self._counts['completed'] += 1
+            self._cond.notify()
+        request.future.set_result(result)
+
+
+class SchedulingBackend:
+    """Backend wrapper that routes every service call through a RequestScheduler."""
+
+    _job_ids = itertools.count(1)
+
+    def __init__(self, backend, scheduler: RequestScheduler, job_id=None):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.job_id = job_id if job_id is not None else f"job_{next(self._job_ids)}"
+        self._held_tasks = set()
+        self._lock = threading.Lock()
+
+    # Per-job view so requests are queued (and kept fair) per job
+    def for_job(self, job_id):
+        return SchedulingBackend(self.backend, self.scheduler, job_id)
+
+    # Calls without a round trip (image algebra, geometry) go straight through
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def composite(self, *args):
+        return self.scheduler.call(self.job_id, self.backend.composite, *args)
+
+    def fetch_mask_tile(self, *args):
+        return self.scheduler.call(self.job_id, self.backend.fetch_mask_tile, *args)
+
+    def download(self, *args):
+        return self.scheduler.call(self.job_id, self.backend.download, *args)
+
+    def start_export(self, *args):
+        task_id = self.scheduler.call(self.job_id, self.backend.start_export, *args,
+                                      kind='batch', hold=True)
+        with self._lock:
+            self._held_tasks.add(task_id)
+        return task_id
+
+    def task_state(self, task_id):
+        state = self.scheduler.call(self.job_id, self.backend.task_state, task_id)
+        if state not in ACTIVE_STATES:
+            self.release_task(task_id)
+        return state
+
+    def cancel_task(self, task_id):
+        self.scheduler.call(self.job_id, self.backend.cancel_task, task_id)
+        self.release_task(task_id)
+
+    # Free the batch slot held for `task_id`, if this view still holds one
+    def release_task(self, task_id):
+        with self._lock:
+            held = task_id in self._held_tasks
+            self._held_tasks.discard(task_id)
+        if held:
+            self.scheduler.release_batch()
@@ -2,13 +2,14 @@
 import ee
 import time
 import webbrowser
-import pyautogui
-import pyperclip
-import json
 import folium
 from folium import plugins
 import os
 
+import gee_templates
+import geojson_stream
+import profiling
+
 # Initialize the Earth Engine library
 def authenticate():
     try:
@@ -33,16 +34,7 @@ def open_map(map_file):
 
 # Extract coordinates from GeoJSON file
 def extract_coordinates_from_geojson(geojson_file):
-    with open(geojson_file, 'r') as file:
-        data = json.load(file)
-        coordinates = []
-        for feature in data['features']:
-            geometry = feature['geometry']
-            if geometry['type'] == 'Polygon':
-                coords = geometry['coordinates'][0]
-                for coord in coords:
-                    coordinates.append(coord)
-        return coordinates
+    return geojson_stream.extract_coordinates_from_geojson(geojson_file)
 
 # Wait for the user to export the GeoJSON file
 def wait_for_geojson(downloads_folder):
@@ -83,20 +75,25 @@ def load_and_export_images(start_date, end_date, prefix):
         print(f'Export task for image {i} completed.')
 
 # Main workflow
+@profiling.profiled('semi_final_wab_app')
 def main():
     # Step 1: Create and open the map
+    profiling.mark('open_map')
     map_file = 'interactive_map.html'
     create_map(map_file)
     open_map(map_file)
 
     # Step 2: Wait for the user to export the GeoJSON file to Downloads folder
+    profiling.mark('wait_for_geojson')
     downloads_folder = os.path.expanduser('~/Downloads')
     geojson_file = wait_for_geojson(downloads_folder)
 
     # Step 3: Extract coordinates from GeoJSON
+    profiling.mark('parse_geojson')
     coords = extract_coordinates_from_geojson(geojson_file)
     
     # Step 4: Calculate min/max latitude and longitude
+    profiling.mark('bounds')
     if coords:
         latitudes = [coord[1] for coord in coords]
         longitudes = [coord[0] for coord in coords]
@@ -116,9 +113,11 @@ def main():
         return
 
     # Step 5: Authenticate the user with Earth Engine
+    profiling.mark('authenticate')
     authenticate()
 
     # Step 6: Ask for user input for date ranges
+    profiling.mark('date_input')
     start_date1 = input("Enter start date for baseline period (YYYY-MM-DD): ")
     end_date1 = input("Enter end date for baseline period (YYYY-MM-DD): ")
     start_date2 = input("Enter start date for comparison period (YYYY-MM-DD): ")
@@ -130,6 +129,7 @@ def main():
     coordinates = f"{(min_latitude + max_latitude) / 2},{(min_longitude + max_longitude) / 2}"  # Center for GMaps
 
     # Step 7: Load and export all images from each period
+    profiling.mark('export')
     print("Exporting images for the baseline period...")
     load_and_export_images(start_date1, end_date1, "baseline_period")
     
@@ -137,59 +137,22 @@ def main():
     load_and_export_images(start_date2, end_date2, "comparison_period")
 
     # Step 8: Open Google Maps with the area of interest
+    profiling.mark('google_maps')
     webbrowser.open(f"https://www.google.com/maps/@{coordinates},15z")
 
-    # Step 9: Prepare the GEE script
-    gee_script = f"""
-    var geometry = ee.Geometry.Rectangle([{min_longitude}, {min_latitude}, {max_longitude}, {max_latitude}]);
-    
-    var collection1 = ee.ImageCollection('COPERNICUS/S1_GRD')
-                        .filterBounds(geometry)
-                        .filterDate('{start_date1}', '{end_date1}')
-                        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                        .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                        .select('VV');
-    
-    var collection2 = ee.ImageCollection('COPERNICUS/S1_GRD')
-                        .filterBounds(geometry)
-                        .filterDate('{start_date2}', '{end_date2}')
-                        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                        .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                        .select('VV');
-    
-    var change = collection2.mean().subtract(collection1.mean()).rename('Change');
-    var significantChange = change.gt(0.1);
-    Map.centerObject(geometry, 10);
-    
-    // Create a land mask
-    var landMask = ee.Image('MODIS/006/MCD12Q1/2018_01_01')
-                     .select('LC_Type1')
-                     .eq(1)  // 1 corresponds to 'Water'
-                     .not(); // Invert the mask to get land areas
-    
-    // Apply the land mask
-    var maskedChange = change.updateMask(landMask);
-    
-    // Adjust the color palette for smooth transitions
-    Map.addLayer(maskedChange, 
-      {{min: -1, max: 1, palette: ['blue', 'white', 'yellow', 'red'], opacity: 0.6}}, 
-      'Change Detection'
-    );
-    
-    Map.addLayer(significantChange.updateMask(significantChange).updateMask(landMask), 
-      {{palette: ['red'], opacity: 0.3}}, 
-      'Significant Change'
-    );
-    """
-
-    # Copy the script to clipboard and open GEE Code Editor
-    pyperclip.copy(gee_script)
-    webbrowser.open("https://code.earthengine.google.com/")
-    time.sleep(15)
-    pyautogui.hotkey('ctrl', 'v')
-    print("JavaScript code pasted into the Google Earth Engine Code Editor.")
-    pyautogui.hotkey('ctrl', 'enter')
-    print("Code executed in GEE Code Editor.")
+    # Step 9: Render the GEE script from its template
+    profiling.mark('gee_script')
+    try:
+        script_path = gee_templates.save_script(
+            'land_mask', bounds=(min_longitude, min_latitude, max_longitude, max_latitude),
+            baseline=(start_date1, end_date1), comparison=(start_date2, end_date2))
+    except ValueError as e:
+        print(f"Could not prepare the GEE script: {e}")
+        return
+
+    # Open the GEE Code Editor; the script is a file to load there rather than a clipboard paste
+    webbrowser.open(gee_templates.CODE_EDITOR_URL)
+    print(f"GEE script written to {script_path}. Paste it into the Code Editor and press Ctrl+Enter to run it.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for EarthEngineBackend that only injects latency.
+
+Used by the benchmark and load-test scripts so the orchestration can be
+measured without an Earth Engine account. Images are plain dicts.
+"""
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+import masks
+from backend import composite_bands
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class StandInBackend:
+    def __init__(self, latency=0.5, export_time=2.0, scenes=12, failure_rate=0.0, max_tasks=None):
+        self.latency = latency  # seconds per blocking service call
+        self.export_time = export_time  # seconds an export task stays active
+        self.scenes = scenes
+        self.failure_rate = failure_rate  # share of calls rejected with a 429-style error
+        self.max_tasks = max_tasks  # concurrent export tasks allowed, None for no limit
+        self.calls = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count(1)
+        self._tasks = {}
+        self._cancelled = set()
+
+    # One simulated round trip to the service
+    def _round_trip(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            with self._lock:
+                self.rejected += 1
+            raise QuotaExceeded("429 Too Many Requests: Quota exceeded for interactive requests.")
+
+    def rectangle(self, bounds):
+        return tuple(bounds)
+
+    def land_mask(self, method, bounds, dates):
+        return {'mask': method, 'bounds': tuple(bounds)}
+
+    def fetch_mask_tile(self, method, dates, scale, tile_row, tile_col):
+        self._round_trip()
+        return np.zeros((masks.TILE_SIZE, masks.TILE_SIZE), dtype=bool)
+
+    def composite(self, bounds, start_date, end_date, land=None,
+                  polarisations=('VV',), orbit_split=False):
+        self._round_trip()
+        if self.scenes == 0:
+            return None
+        bands = composite_bands(polarisations, orbit_split)
+        return {'bounds': tuple(bounds), 'dates': (start_date, end_date), 'land': land,
+                'bands': bands}, bands
+
+    def difference(self, baseline, comparison, threshold, bands=('VV',)):
+        change = {'op': 'subtract', 'args': (comparison, baseline), 'bands': list(bands)}
+        return change, {'op': 'gt', 'args': (change, threshold)}
+
+    def stack(self, change, significant):
+        return {'op': 'cat', 'args': (change, significant)}
+
+    def serialize(self, image):
+        return json.dumps(image)
+
+    def deserialize(self, blob):
+        return json.loads(blob)
+
+    def start_export(self, image, bounds, description, scale):
+        self._round_trip()
+        with self._lock:
+            now = time.monotonic()
+            running = sum(done_at > now for done_at in self._tasks.values())
+            if self.max_tasks is not None and running >= self.max_tasks:
+                self.rejected += 1
+                raise QuotaExceeded(f"Too many tasks: {running} already running.")
+            task_id = f"STANDIN_{next(self._task_ids)}"
+            self._tasks[task_id] = time.monotonic() + self.export_time
+        return task_id
+
+    # Writes a small real GeoTIFF over the bounds (at most 256 px a side) so
+    # downstream code that reads or crops downloads can run against it
+    def download(self, image, bounds, scale, path):
+        import rasterio
+        from rasterio.transform import from_bounds
+
+        self._round_trip()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        width = height = 256
+        change, significant = image['args']
+        bands = [f"{b}_change" for b in change['bands']] + [f"{b}_significant" for b in change['bands']]
+        with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=len(bands),
+                           dtype='float32', crs='EPSG:4326',
+                           transform=from_bounds(*bounds, width, height)) as dst:
+            dst.write(np.zeros((len(bands), height, width), dtype=np.float32))
+            dst.descriptions = tuple(bands)
+            dst.update_tags(image=json.dumps(image), scale=scale)
+        return path
+
+    def task_state(self, task_id):
+        self._round_trip()
+        with self._lock:
+            done_at = self._tasks[task_id]
+        if task_id in self._cancelled:
+            return 'CANCELLED'
+        return 'COMPLETED' if time.monotonic() >= done_at else 'RUNNING'
+
+    def cancel_task(self, task_id):
+        self._round_trip()
+        with self._lock:
+            if time.monotonic() < self._tasks[task_id]:
+                self._tasks[task_id] = time.monotonic()  # no longer counts as running
+                self._cancelled.add(task_id)
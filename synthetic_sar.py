@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Sentinel-1 VV/VH stacks with known change, for local benchmarks.
+
+Backscatter is a smooth random sigma0 field (in dB) per polarisation, with
+a few water bodies. Each scene multiplies the linear sigma0 by
+gamma-distributed speckle with ``looks`` looks (GRD IW is about 4.4), which
+is the standard fully-developed speckle model. The comparison scenes get
+rectangular patches whose backscatter rises by a few dB; their union is
+the ground-truth change mask.
+
+    python synthetic_sar.py out_dir --size 1024 --scenes 6
+"""
+import argparse
+import json
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+POLARISATIONS = ('VV', 'VH')
+MEAN_DB = {'VV': -12.0, 'VH': -19.0}
+WATER_DB = {'VV': -22.0, 'VH': -28.0}
+ENL = 4.4  # equivalent number of looks of Sentinel-1 GRD IW
+REVISIT_DAYS = 12
+
+
+# Smooth random field with values in about [-1, 1]
+def _texture(rng, height, width, cells=8):
+    coarse = rng.standard_normal((cells + 1, cells + 1))
+    rows = np.linspace(0, cells, height)
+    cols = np.linspace(0, cells, width)
+    r0, c0 = np.floor(rows).astype(int).clip(0, cells - 1), np.floor(cols).astype(int).clip(0, cells - 1)
+    fr, fc = (rows - r0)[:, None], (cols - c0)[None, :]
+    top = coarse[r0][:, c0] * (1 - fc) + coarse[r0][:, c0 + 1] * fc
+    bottom = coarse[r0 + 1][:, c0] * (1 - fc) + coarse[r0 + 1][:, c0 + 1] * fc
+    return ((top * (1 - fr) + bottom * fr) / 2).astype(np.float32)
+
+
+def generate_stack(height=1024, width=1024, scenes=6, looks=ENL, patches=6,
+                   patch_size=(0.03, 0.15), change_db=(4.0, 8.0), water_bodies=2,
+                   polarisations=POLARISATIONS, seed=0) -> dict:
+    """Return baseline / comparison stacks in dB, shaped (scenes, bands, height, width).
+
+    Also returns ``truth`` (bool, height x width), ``water`` and the list of
+    injected ``patches`` as (row0, col0, row1, col1, delta_db). ``patch_size``
+    is the range of patch sides as a fraction of the smaller image side.
+    """
+    rng = np.random.default_rng(seed)
+    texture = _texture(rng, height, width)
+    water = np.zeros((height, width), dtype=bool)
+    for _ in range(water_bodies):
+        r, c = rng.integers(0, height), rng.integers(0, width)
+        radius = rng.integers(min(height, width) // 16, min(height, width) // 6)
+        rr, cc = np.ogrid[:height, :width]
+        water |= (rr - r) ** 2 + (cc - c) ** 2 < radius ** 2
+
+    sigma0_db = np.empty((len(polarisations), height, width), dtype=np.float32)
+    for b, polarisation in enumerate(polarisations):
+        sigma0_db[b] = MEAN_DB[polarisation] + 3.0 * texture
+        sigma0_db[b][water] = WATER_DB[polarisation]
+
+    truth = np.zeros((height, width), dtype=bool)
+    change = np.zeros((height, width), dtype=np.float32)
+    injected = []
+    for _ in range(patches):
+        side = min(height, width)
+        h, w = rng.integers(max(1, int(patch_size[0] * side)), max(2, int(patch_size[1] * side)), size=2)
+        r0, c0 = rng.integers(0, max(1, height - h)), rng.integers(0, max(1, width - w))
+        delta = float(rng.uniform(*change_db))
+        region = (slice(r0, r0 + h), slice(c0, c0 + w))
+        change[region] = np.maximum(change[region], delta)
+        truth[region] = True
+        injected.append((int(r0), int(c0), int(r0 + h), int(c0 + w), round(delta, 2)))
+    truth &= ~water  # change patches are on land
+    change[water] = 0
+
+    def scenes_for(offset_db):
+        linear = 10 ** ((sigma0_db + offset_db) / 10)
+        speckle = rng.gamma(looks, 1.0 / looks, size=(scenes,) + linear.shape).astype(np.float32)
+        return (10 * np.log10(linear[None] * speckle)).astype(np.float32)
+
+    return {
+        'bands': list(polarisations),
+        'baseline': scenes_for(0.0),
+        'comparison': scenes_for(change[None]),
+        'truth': truth,
+        'water': water,
+        'patches': injected,
+    }
+
+
+# Write each scene as a multi-band GeoTIFF plus truth.tif and a metadata file
+def write_stack(stack: dict, directory: str, bounds=(72.8, 19.0, 72.9, 19.1),
+                start=date(2023, 1, 1)) -> dict:
+    import rasterio
+    from rasterio.transform import from_bounds
+
+    os.makedirs(directory, exist_ok=True)
+    scenes, bands, height, width = stack['baseline'].shape
+    profile = {'driver': 'GTiff', 'width': width, 'height': height, 'crs': 'EPSG:4326',
+               'transform': from_bounds(*bounds, width, height), 'tiled': True,
+               'blockxsize': 256, 'blockysize': 256}
+    files = {'baseline': [], 'comparison': []}
+    for period, first_day in (('baseline', start), ('comparison', start + timedelta(days=180))):
+        for i in range(scenes):
+            day = (first_day + timedelta(days=REVISIT_DAYS * i)).isoformat()
+            path = os.path.join(directory, f"S1_synthetic_{period}_{day}.tif")
+            with rasterio.open(path, 'w', count=bands, dtype='float32', **profile) as dst:
+                dst.write(stack[period][i])
+                dst.descriptions = tuple(stack['bands'])
+                dst.update_tags(date=day, units='dB', instrumentMode='IW')
+            files[period].append(path)
+    truth_path = os.path.join(directory, 'truth.tif')
+    with rasterio.open(truth_path, 'w', count=1, dtype='uint8', **profile) as dst:
+        dst.write(stack['truth'].astype(np.uint8)[None])
+    meta = {'bounds': list(bounds), 'bands': stack['bands'], 'patches': stack['patches'],
+            'files': files, 'truth': truth_path}
+    with open(os.path.join(directory, 'synthetic.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--scenes', type=int, default=6)
+    parser.add_argument('--patches', type=int, default=6)
+    parser.add_argument('--looks', type=float, default=ENL)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stack = generate_stack(args.size, args.size, args.scenes, looks=args.looks,
+                           patches=args.patches, seed=args.seed)
+    meta = write_stack(stack, args.directory)
+    print(f"Wrote {2 * args.scenes} scenes and truth.tif to {args.directory} "
+          f"({stack['truth'].mean():.1%} changed).")
+    return meta
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Per-pixel temporal statistics of an AOI, kept on disk, for z-score change.
+
+Instead of "median of period B minus median of period A", each pixel's
+baseline is its own history: count, mean and variance of its backscatter
+(dB) over every baseline scene, accumulated with Welford's algorithm.
+A new scene is scored as ``(x - mean) / std`` per pixel, so a pixel that
+is normally stable is flagged by a smaller jump than a noisy one.
+
+Layout of a stats directory::
+
+    stats.json   metadata: grid window, scale, band, dates folded in
+    count.npy    (H, W) uint16  valid observations per pixel
+    mean.npy     (H, W) float32 running mean
+    m2.npy       (H, W) float32 running sum of squared deviations
+
+That is 10 bytes per pixel however many scenes went in. ``update`` folds
+in one scene in O(pixels); ``extend`` makes one pass over a long stack,
+tile by tile over a process pool, each worker reading only its tile of
+every scene and writing its tile of the memory-mapped state.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import grid
+
+TILE_SIZE = 512
+MIN_COUNT = 3  # observations a pixel needs before it is scored
+STATE = (('count', 'uint16'), ('mean', 'float32'), ('m2', 'float32'))
+
+
+# Welford update of one tile of state with one scene; NaN pixels are skipped
+def _welford(count, mean, m2, x):
+    valid = ~np.isnan(x)
+    count += valid
+    n = np.maximum(count, 1).astype(np.float64)
+    delta = np.where(valid, x - mean, 0.0)
+    mean += delta / n
+    m2 += delta * np.where(valid, x - mean, 0.0)
+
+
+# Bounds strictly inside a window, so grid.pixel_window maps them back to the same window
+def _inset_bounds(window: grid.Window, scale: float) -> grid.Bounds:
+    half = grid.degrees_per_pixel(scale) / 2
+    min_lon, min_lat, max_lon, max_lat = grid.window_bounds(window, scale)
+    return min_lon + half, min_lat + half, max_lon - half, max_lat - half
+
+
+# Fold every scene of `source` into one tile of the on-disk state. `source` is an
+# (S, H, W) stack covering the stats window (or its .npy path) or a list of grd_reader.Scene
+def _extend_tile(path, window, tile, source, scale, band):
+    state = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r+') for name, _ in STATE}
+    local = grid.window_slices(tile, window)
+    count = state['count'][local].astype(np.int64)
+    mean = state['mean'][local].astype(np.float64)
+    m2 = state['m2'][local].astype(np.float64)
+    if isinstance(source, str):
+        source = np.load(source, mmap_mode='r')
+    for index in range(len(source)):
+        if isinstance(source, np.ndarray):
+            x = source[(index,) + local]
+        else:
+            x, _ = source[index].read(_inset_bounds(tile, scale), scale, band)
+        _welford(count, mean, m2, np.asarray(x, dtype=np.float64))
+    state['count'][local] = np.minimum(count, np.iinfo(np.uint16).max)
+    state['mean'][local] = mean
+    state['m2'][local] = m2
+    for array in state.values():
+        array.flush()
+    return tile
+
+
+class TemporalStats:
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.window = tuple(meta['window'])
+        self.scale = meta['scale']
+
+    @classmethod
+    def create(cls, path: str, bounds: grid.Bounds, scale: float, band: str = 'VV'):
+        if os.path.exists(os.path.join(path, 'stats.json')):
+            raise FileExistsError(f"Temporal statistics already exist at {path}.")
+        window = grid.pixel_window(bounds, scale)
+        os.makedirs(path, exist_ok=True)
+        for name, dtype in STATE:
+            state = np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode='w+',
+                                              dtype=dtype, shape=grid.window_shape(window))
+            state[:] = 0
+            state.flush()
+            del state
+        stats = cls(path, {'band': band, 'scale': scale, 'window': list(window), 'dates': []})
+        stats._save_meta()
+        return stats
+
+    @classmethod
+    def open(cls, path: str):
+        with open(os.path.join(path, 'stats.json'), 'r') as f:
+            return cls(path, json.load(f))
+
+    @classmethod
+    def open_or_create(cls, path: str, bounds: grid.Bounds, scale: float, **kwargs):
+        if os.path.exists(os.path.join(path, 'stats.json')):
+            return cls.open(path)
+        return cls.create(path, bounds, scale, **kwargs)
+
+    @property
+    def dates(self) -> List[str]:
+        return list(self.meta['dates'])
+
+    def _save_meta(self):
+        meta_path = os.path.join(self.path, 'stats.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _state(self, name: str, mode: str = 'r') -> np.ndarray:
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode=mode)
+
+    def _tiles(self, tile_size: int):
+        for tile_row, tile_col in grid.tiles_for_window(self.window, tile_size):
+            yield grid.intersect_windows(grid.tile_window(tile_row, tile_col, tile_size), self.window)
+
+    def _add_dates(self, dates):
+        self.meta['dates'] = sorted(set(self.meta['dates']) | {d for d in dates if d})
+        self._save_meta()
+
+    def update(self, raster: np.ndarray, window: Optional[grid.Window] = None, date: Optional[str] = None):
+        """Fold one scene (dB, NaN = no data) into the statistics."""
+        window = tuple(window) if window is not None else self.window
+        if np.shape(raster) != grid.window_shape(window):
+            raise ValueError(f"Raster shape {np.shape(raster)} does not match window {window}.")
+        overlap = grid.intersect_windows(window, self.window)
+        if overlap is None:
+            raise ValueError("The raster does not overlap the statistics' area of interest.")
+        local = grid.window_slices(overlap, self.window)
+        count, mean, m2 = (self._state(name, 'r+') for name, _ in STATE)
+        c = count[local].astype(np.int64)
+        mu, s = mean[local].astype(np.float64), m2[local].astype(np.float64)
+        _welford(c, mu, s, np.asarray(raster, dtype=np.float64)[grid.window_slices(overlap, window)])
+        count[local], mean[local], m2[local] = np.minimum(c, np.iinfo(np.uint16).max), mu, s
+        for array in (count, mean, m2):
+            array.flush()
+        self._add_dates([date])
+
+    def extend(self, sources: Sequence, dates: Sequence[str] = (), workers: int = 1,
+               tile_size: int = TILE_SIZE):
+        """Fold in many scenes in one pass, tile by tile.
+
+        `sources` is either a (scenes, H, W) array / ``.npy`` path covering the
+        stats window, or a list of ``grd_reader.Scene`` objects.
+        """
+        source = np.load(sources, mmap_mode='r') if isinstance(sources, str) else sources
+        if isinstance(source, np.ndarray):
+            if source.shape[1:] != grid.window_shape(self.window):
+                raise ValueError(f"Stack shape {source.shape} does not match window {self.window}.")
+            # Workers reopen a memmapped .npy by path rather than receiving a pickled copy
+            filename = getattr(source, 'filename', None)
+            if workers > 1:
+                if not filename or np.load(filename, mmap_mode='r').shape != source.shape:
+                    raise ValueError("Pass the stack as a .npy path (or np.load(path, mmap_mode='r')) "
+                                     "to use several workers.")
+                source = filename
+        else:
+            source = list(source)
+        tiles = list(self._tiles(tile_size))
+        args = (self.path, self.window)
+        if workers <= 1:
+            for tile in tiles:
+                _extend_tile(*args, tile, source, self.scale, self.meta['band'])
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_extend_tile, *args, tile, source, self.scale, self.meta['band'])
+                           for tile in tiles]
+                for future in futures:
+                    future.result()
+        self._add_dates(dates)
+
+    def count(self) -> np.ndarray:
+        return np.asarray(self._state('count'))
+
+    def mean(self) -> np.ndarray:
+        return np.asarray(self._state('mean'))
+
+    # Sample variance; NaN where a pixel has fewer than two observations
+    def variance(self) -> np.ndarray:
+        count = self._state('count').astype(np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count > 1, self._state('m2') / (count - 1), np.nan).astype(np.float32)
+
+    def zscore(self, raster: np.ndarray, window: Optional[grid.Window] = None,
+               min_count: int = MIN_COUNT) -> np.ndarray:
+        """(raster - mean) / std per pixel of `window`; NaN where the baseline is too thin."""
+        window = tuple(window) if window is not None else self.window
+        overlap = grid.intersect_windows(window, self.window)
+        out = np.full(np.shape(raster), np.nan, dtype=np.float32)
+        if overlap is None:
+            return out
+        local = grid.window_slices(overlap, self.window)
+        count = self._state('count')[local].astype(np.float32)
+        mean, m2 = self._state('mean')[local], self._state('m2')[local]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(m2 / (count - 1))
+            z = (np.asarray(raster, dtype=np.float32)[grid.window_slices(overlap, window)] - mean) / std
+        z[(count < min_count) | ~(std > 0)] = np.nan
+        out[grid.window_slices(overlap, window)] = z
+        return out
@@ -8,9 +8,6 @@ Created on Fri Sep 20 10:17:56 2024
 import ee
 import time
 import webbrowser
-import pyautogui  # Ensure this library is installed
-import pyperclip  # Ensure this library is installed
-import json
 import folium
 from folium import plugins
 import os
@@ -18,6 +15,12 @@ import rasterio
 import matplotlib.pyplot as plt
 from typing import List, Tuple
 
+from backend import ACTIVE_STATES
+from checkpoint import DEFAULT_CHECKPOINT_DIR, JobCheckpoint, job_key
+import gee_templates
+import geojson_stream
+import profiling
+
 # Function to authenticate the user with Google Earth Engine
 def authenticate():
     try:
@@ -41,16 +44,7 @@ def open_map(map_file):
 
 # Extract coordinates from GeoJSON file
 def extract_coordinates_from_geojson(geojson_file):
-    with open(geojson_file, 'r') as file:
-        data = json.load(file)
-        coordinates = []
-        for feature in data['features']:
-            geometry = feature['geometry']
-            if geometry['type'] == 'Polygon':
-                coords = geometry['coordinates'][0]
-                for coord in coords:
-                    coordinates.append(coord)
-        return coordinates
+    return geojson_stream.extract_coordinates_from_geojson(geojson_file)
 
 # Wait for the user to export the GeoJSON file
 def wait_for_geojson(downloads_folder):
@@ -62,42 +56,32 @@ def wait_for_geojson(downloads_folder):
 
 # Function to extract coordinates and date periods from GeoJSON file
 def extract_data_from_geojson(geojson_file: str) -> Tuple[List[Tuple[float, float]], dict, dict]:
-    with open(geojson_file, 'r') as f:
-        data = json.load(f)
-
-    # Extract date periods
-    baseline_period = data.get("baseline_period", {})
-    comparison_period = data.get("comparison_period", {})
-
-    # Extract coordinates
-    features = data.get('features', [])
-    coords = []
-    
-    for feature in features:
-        geometry = feature.get('geometry', {})
-        if geometry.get('type') == 'Polygon':
-            coords.extend(geometry['coordinates'][0])
-
-    return coords, baseline_period, comparison_period
+    return geojson_stream.extract_data_from_geojson(geojson_file)
 
 # Main workflow
+@profiling.profiled('updated_script')
 def main():
     # Step 1: Authenticate and Initialize Earth Engine
+    profiling.mark('authenticate')
     authenticate()  # Ensure proper authentication
 
     # Step 2: Create and open the map
+    profiling.mark('open_map')
     map_file = 'interactive_map.html'
     create_map(map_file)
     open_map(map_file)
 
     # Step 3: Wait for the user to export the GeoJSON file to Downloads folder
+    profiling.mark('wait_for_geojson')
     downloads_folder = os.path.expanduser('~/Downloads')
     geojson_file = wait_for_geojson(downloads_folder)
 
     # Step 4: Extract coordinates and date periods from GeoJSON
+    profiling.mark('parse_geojson')
     coords, baseline_period, comparison_period = extract_data_from_geojson(geojson_file)
 
     # Step 5: Calculate min/max latitude and longitude
+    profiling.mark('bounds')
     if coords:
         latitudes = [coord[1] for coord in coords]
         longitudes = [coord[0] for coord in coords]
@@ -143,12 +127,20 @@ def main():
     # Print the dates
     print(f"Baseline Period: Start: {baseline_start}, End: {baseline_end}")
     print(f"Comparison Period: Start: {comparison_start}, End: {comparison_end}")
+
+    # Durable record of this job, so a restarted run resumes where the last one stopped
+    checkpoint = JobCheckpoint.load(DEFAULT_CHECKPOINT_DIR, job_key({
+        'bounds': [min_longitude, min_latitude, max_longitude, max_latitude],
+        'baseline': [baseline_start, baseline_end],
+        'comparison': [comparison_start, comparison_end],
+    }))
     
     # Define the geometry based on the extracted coordinates
     geometry = ee.Geometry.Rectangle([min_longitude, min_latitude, max_longitude, max_latitude])
     coordinates = f"{(min_latitude + max_latitude) / 2},{(min_longitude + max_longitude) / 2}"
 
     # Step 6: Load image collections and calculate change using Earth Engine
+    profiling.mark('composite')
     def load_image_collection(start_date, end_date):
         collection = (ee.ImageCollection('COPERNICUS/S1_GRD')
                       .filterBounds(geometry)
@@ -170,115 +162,97 @@ def main():
             raise ValueError("Image does not have any bands.")
         return image
 
+    # An export recorded by an earlier run that failed or was cancelled is submitted again
+    task_id = checkpoint.task_id('export')
+    if checkpoint.reached('export') and task_id:
+        try:
+            state = ee.data.getTaskStatus(task_id)[0]['state']
+        except Exception as e:
+            print(f"Could not check export task {task_id}: {e}")
+            state = 'RUNNING'
+        if state not in ACTIVE_STATES and state != 'COMPLETED':
+            print(f"Export task {task_id} ended as {state}; exporting again.")
+            checkpoint.forget_task('export')
+            checkpoint.rewind('new')
+
+    # Skip the image processing when an earlier run of this job already submitted the export
+    if not checkpoint.reached('export'):
+        try:
+            collection1 = check_image_bands(load_image_collection(baseline_start, baseline_end))
+            collection2 = check_image_bands(load_image_collection(comparison_start, comparison_end))
+            change = collection2.subtract(collection1).rename('Change')
+
+            # Apply a threshold to identify significant changes
+            threshold = 0.1  # Adjust threshold
+            significantChange = change.gt(threshold)
+        except ValueError as e:
+            print(f"Error in image processing: {e}")
+            return
+
+    # Step 7: Export the image to Google Drive, or reattach to the export of an interrupted run
+    profiling.mark('export')
     try:
-        collection1 = check_image_bands(load_image_collection(baseline_start, baseline_end))
-        collection2 = check_image_bands(load_image_collection(comparison_start, comparison_end))
-        change = collection2.subtract(collection1).rename('Change')
-
-        # Apply a threshold to identify significant changes
-        threshold = 0.1  # Adjust threshold
-        significantChange = change.gt(threshold)
-    except ValueError as e:
-        print(f"Error in image processing: {e}")
-        return
-
-    # Step 7: Export the image to Google Drive
-    try:
-        task = ee.batch.Export.image.toDrive(
-            image=change,
-            description='area_of_interest',
-            scale=10,
-            region=geometry,
-            maxPixels=1e13
-        )
-        task.start()
-        print("Export task started. Check your Google Drive for the result.")
-        while task.active():
+        task_id = checkpoint.task_id('export')
+        if checkpoint.reached('export') and task_id:
+            print(f"Reattaching to export task {task_id}.")
+        else:
+            task = ee.batch.Export.image.toDrive(
+                image=change,
+                description='area_of_interest',
+                scale=10,
+                region=geometry,
+                maxPixels=1e13
+            )
+            task.start()
+            task_id = task.id
+            checkpoint.record_task('export', task_id)
+            checkpoint.finish_stage('export')
+            print("Export task started. Check your Google Drive for the result.")
+        state = ee.data.getTaskStatus(task_id)[0]['state']
+        while state in ACTIVE_STATES:
             print('Waiting for task to complete...')
             time.sleep(10)
+            state = ee.data.getTaskStatus(task_id)[0]['state']
+        if state != 'COMPLETED':
+            # No TIFF will arrive; the next run submits a new export
+            checkpoint.forget_task('export')
+            checkpoint.rewind('new')
+            print(f"Export task {task_id} ended as {state}. Run the script again to export again.")
+            return
         print('Export task completed.')
     except Exception as e:
         print(f"An error occurred during export: {e}")
 
     # Step 8: Open Google Maps with the area of interest
+    profiling.mark('google_maps')
     webbrowser.open(f"https://www.google.com/maps/@{coordinates},15z")
 
-    # Step 9: Prepare the GEE script
-    gee_script = f"""
-// Define the area of interest (AOI) dynamically using placeholders for coordinates
-var geometry = ee.Geometry.Rectangle([{min_longitude}, {min_latitude}, {max_longitude}, {max_latitude}]);
-
-// Define dynamic date ranges for the baseline and comparison periods
-var baseline_start = '{baseline_start}';
-var baseline_end = '{baseline_end}';
-var comparison_start = '{comparison_start}';
-var comparison_end = '{comparison_end}';
-
-// Load and process the Sentinel-1 SAR image collection for the baseline period
-var collection1 = ee.ImageCollection('COPERNICUS/S1_GRD')
-                    .filterBounds(geometry)
-                    .filterDate(baseline_start, baseline_end)
-                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                    .select('VV')
-                    .median();
-
-// Load and process the Sentinel-1 SAR image collection for the comparison period
-var collection2 = ee.ImageCollection('COPERNICUS/S1_GRD')
-                    .filterBounds(geometry)
-                    .filterDate(comparison_start, comparison_end)
-                    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                    .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                    .select('VV')
-                    .median();
-
-// Check if an image was found
-if (collection1 && collection2) {{
-  // Calculate the change between the two periods
-  var change = collection2.subtract(collection1);
-
-  // Define visualization parameters
-  var visParams = {{
-      min: -30,
-      max: 0,
-      palette: ['white', 'black']  // Grayscale palette
-  }};
-
-  // Add the change layer to the map
-  Map.centerObject(geometry, 12);  // Center the map on the AOI with zoom level 12
-  Map.addLayer(change, visParams, 'Sentinel-1 Change Detection');
-
-  // Set the export parameters
-  Export.image.toDrive({{
-      image: change,
-      description: 'Sentinel1_Change_Detection',
-      scale: 10,  // Set the scale/resolution
-      region: geometry,  // Export the AOI
-      maxPixels: 1e13  // Adjust if necessary
-  }});
-
-  print('Export task created. Check the Tasks tab to start the export.');
-}} else {{
-  print('No images found for the selected area and date ranges.');
-}}
-    """
-
-    # Copy the script to clipboard and open GEE Code Editor
-    pyperclip.copy(gee_script)
-    webbrowser.open("https://code.earthengine.google.com/")
-    time.sleep(15)
-    pyautogui.hotkey('ctrl', 'v')
-    print("JavaScript code pasted into the Google Earth Engine Code Editor.")
-    pyautogui.hotkey('ctrl', 'enter')
-    print("Code executed in GEE Code Editor.")
+    # Step 9: Render the GEE script from its template
+    profiling.mark('gee_script')
+    try:
+        script_path = gee_templates.save_script(
+            'export', bounds=(min_longitude, min_latitude, max_longitude, max_latitude),
+            baseline=(baseline_start, baseline_end), comparison=(comparison_start, comparison_end))
+        # Open the GEE Code Editor; the script is a file to load there rather than a clipboard paste
+        webbrowser.open(gee_templates.CODE_EDITOR_URL)
+        print(f"GEE script written to {script_path}. Paste it into the Code Editor and press Ctrl+Enter to run it.")
+    except ValueError as e:
+        print(f"Could not prepare the GEE script: {e}")
 
     # Step 10: Visualize the exported TIFF file
-    tiff_file = os.path.join(downloads_folder, 'Sentinel1_SAR_VV_Image.tif')
+    profiling.mark('visualize')
+    tiff_file = checkpoint.output('tiff') or os.path.join(downloads_folder, 'Sentinel1_SAR_VV_Image.tif')
 
     # Wait for the TIFF file to be downloaded
     while not os.path.exists(tiff_file):
         print("Waiting for the Sentinel1_SAR_VV_Image.tif file to download...")
         time.sleep(5)  # Adjust the waiting period if necessary
+    checkpoint.record_output('tiff', tiff_file)
+    if not checkpoint.reached('download'):
+        checkpoint.finish_stage('download')
+
+    if not checkpoint.reached('done'):
+        checkpoint.finish_stage('done')
 
     # Open the TIFF file using rasterio
     try:
@@ -2,28 +2,53 @@
 import ee
 import time
 import webbrowser
-import pyautogui
-import pyperclip
 import json
 import os
+from dataclasses import asdict
 from typing import List, Tuple
 
+import gee_templates
+import geojson_stream
+import history_store
+import pipeline
+import planner
+import profiling
+from backend import EarthEngineBackend
+from job_queue import JobQueue
+from scheduler import RequestScheduler, SchedulingBackend
+
+# Water mask applied before compositing: 'modis' or 'vv_threshold' (see masks.py)
+MASK_METHOD = 'modis'
+# Polarisations to compare ('VV', 'VH', 'VV/VH') and whether to split by orbit direction
+POLARISATIONS = ('VV',)
+ORBIT_SPLIT = False
+# Budgets the planner enforces before any Earth Engine call is made
+COST_POLICY = planner.CostPolicy()
+# SQLite queue served by `python job_queue.py workers`; None runs the job in this process
+QUEUE_PATH = None
+
 # Open the HTML map file
 def open_map(map_file):
     webbrowser.open(f"file://{os.path.abspath(map_file)}")
 
+# Hand a job to the job_queue workers and follow its progress until it ends
+def run_via_queue(job):
+    queue = JobQueue(QUEUE_PATH)
+    job_id = queue.submit(dict(asdict(job), policy=asdict(COST_POLICY)))  # planned as here
+    print(f"Queued job {job_id}.")
+    while True:
+        status = queue.status(job_id)
+        if status['status'] in ('done', 'skipped', 'failed', 'cancelled'):
+            break
+        print(f"Job {job_id}: {status['status']}, {status['progress']:.0%} {status['message'] or ''}")
+        time.sleep(5)
+    if status['status'] == 'done':
+        return dict(status['result'], error=None)
+    return {'stage': status['message'] or 'mask', 'error': status['error']}
+
 # Extract coordinates from GeoJSON file
 def extract_coordinates_from_geojson(geojson_file):
-    with open(geojson_file, 'r') as file:
-        data = json.load(file)
-        coordinates = []
-        for feature in data['features']:
-            geometry = feature['geometry']
-            if geometry['type'] == 'Polygon':
-                coords = geometry['coordinates'][0]
-                for coord in coords:
-                    coordinates.append(coord)
-        return coordinates
+    return geojson_stream.extract_coordinates_from_geojson(geojson_file)
 
 # Authenticate the user with Google Earth Engine
 def authenticate():
@@ -49,48 +74,33 @@ def wait_for_geojson(downloads_folder):
 # Extract coordinates and date periods from GeoJSON file
 def extract_data_from_geojson(geojson_file: str) -> Tuple[List[Tuple[float, float]], dict, dict]:
     """Extract coordinates and dates from a GeoJSON file."""
-    with open(geojson_file, 'r') as f:
-        data = json.load(f)
-
-    # Extract date periods
-    baseline_period = data.get("baseline_period", {})
-    comparison_period = data.get("comparison_period", {})
-
-    # Extract coordinates
-    features = data.get('features', [])
-    coords = []
-    
-    for feature in features:
-        geometry = feature.get('geometry', {})
-        if geometry.get('type') == 'Polygon':
-            coords.extend(geometry['coordinates'][0])
-
-    return coords, baseline_period, comparison_period
+    return geojson_stream.extract_data_from_geojson(geojson_file)
 
 # Main workflow
+@profiling.profiled('webapp')
 def main():
+    profiling.mark('authenticate')
     authenticate()  # Ensure authentication before proceeding
 
     # Open the existing map file
+    profiling.mark('open_map')
     map_file = 'interactive_map.html'  # Adjust the path if necessary
     open_map(map_file)
 
     # Wait for the user to export the GeoJSON file to Downloads folder
+    profiling.mark('wait_for_geojson')
     downloads_folder = os.path.expanduser('~/Downloads')
     geojson_file = wait_for_geojson(downloads_folder)
 
-    # Extract coordinates and date periods from GeoJSON
-    coords, baseline_period, comparison_period = extract_data_from_geojson(geojson_file)
+    # Stream the GeoJSON into coordinate arrays and read the date periods
+    profiling.mark('parse_geojson')
+    parsed = geojson_stream.parse_geojson(geojson_file)
+    baseline_period, comparison_period = parsed.baseline_period, parsed.comparison_period
 
     # Calculate min/max latitude and longitude
-    if coords:
-        latitudes = [coord[1] for coord in coords]
-        longitudes = [coord[0] for coord in coords]
-        
-        min_latitude = min(latitudes)
-        max_latitude = max(latitudes)
-        min_longitude = min(longitudes)
-        max_longitude = max(longitudes)
+    bbox = parsed.bbox()
+    if bbox:
+        min_longitude, min_latitude, max_longitude, max_latitude = bbox
         
         # Print the coordinates
         print(f"Min Longitude: {min_longitude}")
@@ -125,115 +135,63 @@ def main():
     comparison_start = comparison_period.get('start_date', 'Not Available')
     comparison_end = comparison_period.get('end_date', 'Not Available')
 
-    # Define the geometry based on the extracted coordinates
-    geometry = ee.Geometry.Rectangle([min_longitude, min_latitude, max_longitude, max_latitude])
-    coordinates = f"{(min_latitude + max_latitude) / 2},{(min_longitude + max_longitude) / 2}"  # Center for GMaps
-
-    # Load image collections and calculate change using Earth Engine
-    def load_image_collection(start_date, end_date):
-        collection = (ee.ImageCollection('COPERNICUS/S1_GRD')
-                      .filterBounds(geometry)
-                      .filterDate(start_date, end_date)
-                      .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                      .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                      .select('VV'))
-        size = collection.size().getInfo()
-        print(f"Number of images in collection from {start_date} to {end_date}: {size}")
-        if size == 0:
-            return None  # No images found, return None
-        return collection.median()
-
-    def check_image_bands(image):
-        if image is None:
-            raise ValueError("No images found in the collection.")
-        bands = image.bandNames().getInfo()
-        if not bands:
-            raise ValueError("Image does not have any bands.")
-        return image
-
+    # Run the change-detection job: both periods load concurrently and the
+    # export is awaited on the event loop instead of blocking on time.sleep
+    job = pipeline.ChangeJob(
+        bounds=(min_longitude, min_latitude, max_longitude, max_latitude),
+        baseline=(baseline_start, baseline_end),
+        comparison=(comparison_start, comparison_end),
+        mask_method=MASK_METHOD,
+        polarisations=POLARISATIONS,
+        orbit_split=ORBIT_SPLIT
+    )
+
+    # Plan the job first: estimate its size and pick the scale and execution strategy
+    profiling.mark('plan')
     try:
-        # Use the dates from GeoJSON
-        collection1 = check_image_bands(load_image_collection(baseline_start, baseline_end))
-        collection2 = check_image_bands(load_image_collection(comparison_start, comparison_end))
-        change = collection2.subtract(collection1).rename('Change')
-
-        # Apply a threshold to identify significant changes
-        threshold = 0.1  # Adjust threshold
-        significantChange = change.gt(threshold)
+        plan = planner.plan(job.bounds, job.baseline, job.comparison, scale=job.scale,
+                            polarisations=job.polarisations, orbit_split=job.orbit_split,
+                            policy=COST_POLICY)
+        print(json.dumps(plan['decision'], indent=2))
+        job = pipeline.job_from_plan(job, plan)
     except ValueError as e:
-        print(f"Error in image processing: {e}")
+        print(e)
         return
 
-    # Export the image to Google Drive
-    try:
-        task = ee.batch.Export.image.toDrive(
-            image=change,
-            description='area_of_interest',
-            scale=10,
-            region=geometry,
-            maxPixels=1e13
-        )
-        task.start()
-        print("Export task started. Check your Google Drive for the result.")
-        while task.active():
-            print('Waiting for task to complete...')
-            time.sleep(10)
+    profiling.mark('run_job')
+    if QUEUE_PATH:
+        result = run_via_queue(job)
+    else:
+        scheduler = RequestScheduler()
+        result = pipeline.run(SchedulingBackend(EarthEngineBackend(), scheduler), [job],
+                              history_root=history_store.DEFAULT_ROOT)[0]
+        scheduler.shutdown()
+    if result['stage'] in ('mask', 'composite'):
+        print(f"Error in image processing: {result['error']}")
+        return
+    if result['error']:
+        print(f"An error occurred during export: {result['error']}")
+    else:
         print('Export task completed.')
-    except Exception as e:
-        print(f"An error occurred during export: {e}")
+    coordinates = f"{(min_latitude + max_latitude) / 2},{(min_longitude + max_longitude) / 2}"  # Center for GMaps
 
     # Open Google Maps with the area of interest
+    profiling.mark('google_maps')
     webbrowser.open(f"https://www.google.com/maps/@{coordinates},15z")
 
-    # Prepare the GEE script
-    gee_script = f"""
-    var geometry = ee.Geometry.Rectangle([{min_longitude}, {min_latitude}, {max_longitude}, {max_latitude}]);
-    
-    var collection1 = ee.ImageCollection('COPERNICUS/S1_GRD')
-                        .filterBounds(geometry)
-                        .filterDate('{baseline_start}', '{baseline_end}')
-                        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                        .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                        .select('VV')
-                        .median();
-    
-    var collection2 = ee.ImageCollection('COPERNICUS/S1_GRD')
-                        .filterBounds(geometry)
-                        .filterDate('{comparison_start}', '{comparison_end}')
-                        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                        .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                        .select('VV')
-                        .median();
-    
-    var change = collection2.subtract(collection1).rename('Change');
-    var significantChange = change.gt(0.1);
-    Map.centerObject(geometry, 10);
-    
-    // Add the "Change Detection" layer with reduced opacity
-    Map.addLayer(change, 
-      {{min: -2, max: 2, palette: ['yellow', 'black', 'red'], opacity: 0.3}},  // Reduced opacity to 0.3
-      'Change Detection'
-    );
-    
-    // Add the "Significant Change" layer with reduced opacity
-    Map.addLayer(significantChange.updateMask(significantChange), 
-      {{palette: ['red'], opacity: 0.2}},  // Reduced opacity to 0.2
-      'Significant Change'
-    );
-    """
-
-    # Copy the script to clipboard and open GEE Code Editor
-    pyperclip.copy(gee_script)
-    webbrowser.open("https://code.earthengine.google.com/")
-    time.sleep(15)
-    pyautogui.hotkey('ctrl', 'v')
-    print("JavaScript code pasted into the Google Earth Engine Code Editor.")
-    time.sleep(5)
-    pyautogui.hotkey('ctrl', 'enter')
-    time.sleep(10)
-    pyautogui.click(x=1000,y=500)
-    pyautogui.hotkey('1')
-    print("Code executed in GEE Code Editor.")
+    # Render the GEE script from its template
+    profiling.mark('gee_script')
+    try:
+        script_path = gee_templates.save_script(
+            'overlay', bounds=(min_longitude, min_latitude, max_longitude, max_latitude),
+            baseline=(baseline_start, baseline_end), comparison=(comparison_start, comparison_end))
+    except ValueError as e:
+        print(f"Could not prepare the GEE script: {e}")
+        return
+
+    # Open the GEE Code Editor; the script is a file to load there rather than a clipboard paste
+    webbrowser.open(gee_templates.CODE_EDITOR_URL)
+    print(f"GEE script written to {script_path}. Paste it into the Code Editor and press Ctrl+Enter to run it.")
 
 if __name__ == "__main__":
     main()